@@ -0,0 +1,253 @@
+from models import db, Transaction
+from categories import category_names
+from money import from_cents
+from txframe import load_transaction_frame, month_labels, CHUNK_SIZE
+from utils import get_monthly_totals
+from fx import to_owner_currencies
+from sqlalchemy import select
+from numpy.lib.stride_tricks import sliding_window_view
+import numpy as np
+
+# Spending anomalies, scored with robust z-scores (median / MAD) so a single
+# huge month or purchase cannot hide itself by inflating the spread. Only
+# spending above normal is flagged: an unusually cheap month is not actionable.
+
+# Trailing months each month is compared against
+WINDOW = 6
+# Robust z-score above which a value is flagged (Iglewicz & Hoaglin's 3.5)
+THRESHOLD = 3.5
+# Fewest expenses a category needs before single transactions are judged
+MIN_CATEGORY_ROWS = 8
+# Values per block in batch mode, counting each month once per trailing window
+# it sits in: bounds the (users, months, categories) cube and the window
+# copies median() makes of it, whatever the history length or category count
+ANOMALY_BLOCK_ELEMENTS = 4_000_000
+
+
+def _robust_scale(dev, axis):
+    # Normal-consistent spread from absolute deviations about the median. MAD
+    # is 0 when over half the values tie (e.g. months with no spending), so the
+    # mean absolute deviation stands in there.
+    mad = np.median(dev, axis=axis) * 1.4826
+    mean_ad = dev.mean(axis=axis) * 1.2533
+    return np.where(mad > 0, mad, mean_ad)
+
+
+def _money(cents) -> float:
+    return from_cents(int(round(float(cents))))
+
+
+def rolling_robust_z(series, window: int = WINDOW):
+    """Score every point of `series` against the `window` points before it.
+
+    `series` has time on axis -2 and one column per series on axis -1, e.g.
+    (months, categories) or (users, months, categories). Returns (z, median)
+    for points window..T-1; z is 0 where the trailing window has no spread.
+    """
+    if series.shape[-2] <= window:
+        empty = np.zeros(series.shape[:-2] + (0, series.shape[-1]))
+        return empty, empty
+    # (..., T - window, C, window) view, no copy: windows[..., i, :, :] holds
+    # the points before series[..., window + i, :]
+    windows = sliding_window_view(series, window, axis=-2)[..., :-1, :, :]
+    median = np.median(windows, axis=-1)
+    scale = _robust_scale(np.abs(windows - median[..., None]), axis=-1)
+    current = series[..., window:, :]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = np.where(scale > 0, (current - median) / scale, 0.0)
+    return z, median
+
+
+def group_median(codes, values, n_groups):
+    # Median of values within each code, from a single lexsort
+    order = np.lexsort((values, codes))
+    ordered = values[order]
+    counts = np.bincount(codes, minlength=n_groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    present = counts > 0
+    lo = (starts + (counts - 1) // 2)[present]
+    hi = (starts + counts // 2)[present]
+    median = np.zeros(n_groups)
+    median[present] = (ordered[lo] + ordered[hi]) / 2
+    return median, counts
+
+
+def month_anomalies(months, totals, window: int = WINDOW, threshold: float = THRESHOLD):
+    """Months whose total expense is unusually high, from get_monthly_totals output."""
+    if not months:
+        return []
+    keys = np.array(months, dtype='datetime64[M]')
+    offsets = (keys - keys[0]).astype(np.int64)
+    # Months with no expenses are missing from the totals; they count as 0
+    series = np.zeros((offsets[-1] + 1, 1))
+    series[offsets, 0] = np.rint(np.asarray(totals, dtype=np.float64) * 100)
+    z, median = rolling_robust_z(series, window)
+    labels = month_labels(keys[0] + np.arange(window, len(series)))
+    return [{
+        'month': labels[i],
+        'total': _money(series[window + i, 0]),
+        'typical': _money(median[i, 0]),
+        'score': round(float(z[i, 0]), 1)
+    } for i in np.flatnonzero(z[:, 0] > threshold)][::-1]
+
+
+def _month_matrix(frame, mask):
+    # Expense cents per (month, category) over a gap-free range of months
+    n_cat = len(frame.categories)
+    months = frame.dates[mask].astype('datetime64[M]')
+    if not len(months):
+        return np.empty(0, dtype='datetime64[M]'), np.zeros((0, n_cat))
+    first = months.min()
+    offsets = (months - first).astype(np.int64)
+    n_months = int(offsets.max()) + 1
+    flat = np.bincount(offsets * n_cat + frame.category_codes[mask],
+                       weights=frame.amount_cents[mask], minlength=n_months * n_cat)
+    return first + np.arange(n_months), flat.reshape(n_months, n_cat)
+
+
+def category_month_anomalies(frame, window: int = WINDOW, threshold: float = THRESHOLD):
+    """(month, category) cells with unusually high spending, newest first."""
+    keys, matrix = _month_matrix(frame, frame.mask(kind='expense'))
+    z, median = rolling_robust_z(matrix, window)
+    labels = month_labels(keys[window:])
+    hits = np.argwhere(z > threshold)
+    # Newest month first, then strongest signal
+    hits = hits[np.lexsort((-z[hits[:, 0], hits[:, 1]], -hits[:, 0]))]
+    return [{
+        'month': labels[i],
+        'category': frame.categories[j],
+        'total': _money(matrix[window + i, j]),
+        'typical': _money(median[i, j]),
+        'score': round(float(z[i, j]), 1)
+    } for i, j in hits]
+
+
+def transaction_anomalies(frame, threshold: float = THRESHOLD, min_rows: int = MIN_CATEGORY_ROWS):
+    """Row indexes of expenses unusually large for their category, with their scores.
+
+    Amounts are compared on a log scale, where spending is roughly symmetric,
+    against the median/MAD of every expense in the same category.
+    """
+    rows = np.flatnonzero(frame.mask(kind='expense') & (frame.amount_cents > 0))
+    if not len(rows):
+        return rows, np.empty(0), np.empty(0)
+    n_cat = len(frame.categories)
+    codes = frame.category_codes[rows]
+    values = np.log(frame.amount_cents[rows].astype(np.float64))
+
+    median, counts = group_median(codes, values, n_cat)
+    dev = np.abs(values - median[codes])
+    mad, _ = group_median(codes, dev, n_cat)
+    mean_ad = np.bincount(codes, weights=dev, minlength=n_cat) / np.maximum(counts, 1)
+    scale = np.where(mad > 0, mad * 1.4826, mean_ad * 1.2533)[codes]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = np.where(scale > 0, (values - median[codes]) / scale, 0.0)
+    flagged = (z > threshold) & (counts[codes] >= min_rows)
+    return rows[flagged], z[flagged], np.exp(median[codes][flagged])
+
+
+def detect_anomalies(user_id: int, months=None, totals=None, limit: int = 20):
+    """Monthly, category-month and transaction anomalies for one user.
+
+    Pass `months`/`totals` when the caller already has get_monthly_totals().
+    """
+    if months is None:
+        months, totals = get_monthly_totals(user_id)
+    frame = load_transaction_frame(user_id, kind='expense')
+
+    rows, scores, typical = transaction_anomalies(frame)
+    # Most recent first
+    recent = np.lexsort((-frame.ids[rows], -frame.dates[rows].astype(np.int64)))[:limit]
+    ids = [int(i) for i in frame.ids[rows[recent]]]
+    notes = dict(db.session.execute(
+        select(Transaction.id, Transaction.note).where(Transaction.id.in_(ids))
+    ).all()) if ids else {}
+
+    return {
+        'months': month_anomalies(months, totals)[:limit],
+        'categories': category_month_anomalies(frame)[:limit],
+        'transactions': [{
+            'id': ids[k],
+            'date': str(frame.dates[rows[r]]),
+            'category': frame.categories[frame.category_codes[rows[r]]],
+            'amount': from_cents(frame.amount_cents[rows[r]]),
+            'typical': _money(typical[r]),
+            'note': notes.get(ids[k]),
+            'score': round(float(scores[r]), 1)
+        } for k, r in enumerate(recent)]
+    }
+
+
+def _load_all_expenses():
+    # (user_id, month, category_id, cents) columns for every expense, cents in the owner's base currency
+    stmt = select(
+        Transaction.user_id, Transaction.date, Transaction.category_id, Transaction.amount_cents,
+        Transaction.currency
+    ).where(Transaction.type == 'expense')
+    users, days, categories, cents, currencies = [], [], [], [], []
+    result = db.session.execute(stmt)
+    for rows in result.partitions(CHUNK_SIZE):
+        n = len(rows)
+        u, d, c, a, cur = zip(*rows)
+        users.append(np.fromiter(u, dtype=np.int64, count=n))
+        days.append(np.array(d, dtype='datetime64[D]'))
+        categories.append(np.fromiter((-1 if x is None else x for x in c), dtype=np.int64, count=n))
+        cents.append(np.fromiter(a, dtype=np.int64, count=n))
+        currencies.append(np.array(cur, dtype='U3'))
+    if not users:
+        return None
+    users, days = np.concatenate(users), np.concatenate(days)
+    cents = to_owner_currencies(np.concatenate(cents), days, np.concatenate(currencies), users)
+    return users, days.astype('datetime64[M]'), np.concatenate(categories), cents
+
+
+def batch_category_month_anomalies(window: int = WINDOW, threshold: float = THRESHOLD):
+    """Category-month anomalies for every user, one vectorized pass per block of users.
+
+    All users share one month axis; windows reaching back before a user's
+    first expense are not scored, so a new user's first months are not
+    compared against zeros.
+    """
+    columns = _load_all_expenses()
+    if columns is None:
+        return []
+    users, months, categories, cents = columns
+    user_ids, user_idx = np.unique(users, return_inverse=True)
+    category_ids, cat_idx = np.unique(categories, return_inverse=True)
+    first = months.min()
+    month_idx = (months - first).astype(np.int64)
+    n_months, n_cat = int(month_idx.max()) + 1, len(category_ids)
+    labels = month_labels(first + np.arange(n_months))
+    names = category_names([int(c) for c in category_ids if c >= 0])
+    cat_names = [names.get(int(c), 'Other') for c in category_ids]
+
+    first_month = np.full(len(user_ids), n_months)
+    np.minimum.at(first_month, user_idx, month_idx)
+
+    # Rows grouped by user, so a block's rows are one slice
+    order = np.argsort(user_idx, kind='stable')
+    user_idx, month_idx, cat_idx, cents = user_idx[order], month_idx[order], cat_idx[order], cents[order]
+    block_users = max(1, ANOMALY_BLOCK_ELEMENTS // (n_months * n_cat * max(window, 1)))
+
+    found = []
+    for lo in range(0, len(user_ids), block_users):
+        hi = min(lo + block_users, len(user_ids))
+        sel = slice(*np.searchsorted(user_idx, [lo, hi]))
+        flat = np.bincount(((user_idx[sel] - lo) * n_months + month_idx[sel]) * n_cat + cat_idx[sel],
+                           weights=cents[sel], minlength=(hi - lo) * n_months * n_cat)
+        cube = flat.reshape(hi - lo, n_months, n_cat)
+        z, median = rolling_robust_z(cube, window)
+        # Window i starts at month i; it must not precede the user's first month
+        valid = np.arange(z.shape[1])[None, :] >= first_month[lo:hi, None]
+        z = np.where(valid[..., None], z, 0.0)
+        for u, i, j in np.argwhere(z > threshold):
+            found.append({
+                'user_id': int(user_ids[lo + u]),
+                'month': labels[window + i],
+                'category': cat_names[j],
+                'total': _money(cube[u, window + i, j]),
+                'typical': _money(median[u, i, j]),
+                'score': round(float(z[u, i, j]), 1)
+            })
+    return found
@@ -1,13 +1,43 @@
-from flask import Flask, render_template, request, redirect, url_for, flash
+from flask import Flask, Response, render_template, request, redirect, url_for, flash, stream_with_context
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from models import db, User, Transaction, Goal
 from config import Config
-from utils import get_monthly_totals, predict_next_month_expense, category_breakdown, saving_tips
+from utils import get_monthly_totals, predict_next_month_expense, saving_tips
+from txframe import load_transaction_frame
+from purge import delete_user_account
+from categories import resolve_category, lookup_category
+from money import to_cents, from_cents, DEFAULT_CURRENCY
+from search import install_search, apply_search
+from anomalies import detect_anomalies, batch_category_month_anomalies
+from recurring import cash_flow_projection, batch_cash_flow
+from async_api import async_api
+from assets import assets
+from dashboard import dashboard_snapshot, dashboard_stream, server_timing
+from events import hub, resync, StreamLimit
+from fx import grouped_totals, known_currencies, normalize_currency, currency_symbol
+from principal import load_principal
+from streaming import stream_page, stream_rows, StreamedPage
+from budgets import budget_status, pop_budget_alerts, recompute_budgets, set_budget, delete_budget, DEFAULT_ALERT_PERCENT
+from migrations import prepare_database
+from migrate import REVISIONS
+import archive
+import auth
+import bulk
+import ingest
+import outbox
+import simulation
 from datetime import datetime, date
 
 app = Flask(__name__)
 app.config.from_object(Config)
 db.init_app(app)
+app.register_blueprint(async_api)
+app.register_blueprint(assets)
+hub.configure(app.config['EVENT_BROKER_URL'], app.config['DASHBOARD_STREAMS'])
+auth.configure(app.config)
+archive.configure(app.config)
+ingest.configure(app.config)
+simulation.configure(app.config)
 
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
@@ -15,11 +45,22 @@ login_manager.login_message_category = 'info'
 
 @login_manager.user_loader
 def load_user(user_id):
-    return db.session.get(User, int(user_id))
+    # A cached Principal, not a User: current_user.user loads the row when a view needs it
+    return load_principal(int(user_id))
 
-# Create tables if not exists
+app.add_template_filter(currency_symbol)
+
+@app.context_processor
+def inject_currency():
+    # Symbol for totals, which are always in the viewer's base currency
+    if current_user.is_authenticated:
+        return {'currency': currency_symbol(current_user.base_currency)}
+    return {'currency': currency_symbol(DEFAULT_CURRENCY)}
+
+# Create the tables of an empty database; an existing one is upgraded by migrate.py
 with app.app_context():
-    db.create_all()
+    prepare_database(db.engine, db.metadata, REVISIONS)
+    install_search(db.engine, only_if_cheap=True)
 
 # ---------- Home ----------
 @app.route('/')
@@ -61,9 +102,13 @@ def login():
     if request.method == 'POST':
         email = request.form.get('email','').strip().lower()
         password = request.form.get('password','')
-        user = User.query.filter_by(email=email).first()
+        try:
+            user = auth.authenticate(email, password, request.remote_addr)
+        except auth.LoginRefused as refused:
+            flash(str(refused), 'warning')
+            return render_template('login.html'), refused.status, {'Retry-After': str(refused.retry_after)}
 
-        if user and user.check_password(password):
+        if user:
             login_user(user)
             flash('Logged in successfully', 'success')
 
@@ -93,23 +138,9 @@ def dashboard():
     if current_user.role == 'admin':
         return redirect(url_for('admin_dashboard'))
 
-    today = date.today()
-    month_start = date(today.year, today.month, 1)
-    month_transactions = Transaction.query.filter(
-        Transaction.user_id==current_user.id,
-        Transaction.date >= month_start
-    ).all()
-
-    income_this_month = sum(t.amount for t in month_transactions if t.type == 'income')
-    expense_this_month = sum(t.amount for t in month_transactions if t.type == 'expense')
-    months, totals = get_monthly_totals(current_user.id)
-    by_category = category_breakdown(current_user.id)
-
-    return render_template('dashboard.html',
-                           income_this_month=income_this_month,
-                           expense_this_month=expense_this_month,
-                           months=months, totals=totals,
-                           by_category=by_category)
+    payload, timings = dashboard_snapshot(current_user.id)
+    return _with_timing(render_template('dashboard.html', dashboard=payload,
+                                        budgets=budget_status(current_user.id)), timings)
 
 # ---------- Transactions ----------
 @app.route('/transactions/add', methods=['GET','POST'])
@@ -122,11 +153,16 @@ def add_transaction():
         note = request.form.get('note','').strip()
         date_str = request.form.get('date','')
         try:
-            amount = float(amount)
+            amount_cents = to_cents(amount)
         except ValueError:
             flash('Amount must be a number', 'warning')
             return redirect(url_for('add_transaction'))
-        if amount <= 0:
+        try:
+            currency = normalize_currency(request.form.get('currency') or current_user.base_currency)
+        except ValueError:
+            flash('Unknown currency', 'warning')
+            return redirect(url_for('add_transaction'))
+        if amount_cents <= 0:
             flash('Amount must be positive', 'warning')
             return redirect(url_for('add_transaction'))
 
@@ -135,31 +171,37 @@ def add_transaction():
         except ValueError:
             tdate = date.today()
 
+        category_id, category = resolve_category(category)
         tx = Transaction(
             user_id=current_user.id,
             type=ttype,
-            amount=amount,
+            amount_cents=amount_cents,
+            currency=currency,
             category=category,
+            category_id=category_id,
             note=note,
             date=tdate
         )
         db.session.add(tx)
         db.session.commit()
         flash('Transaction added', 'success')
+        for alert in pop_budget_alerts(current_user.id):
+            flash(alert, 'warning')
         return redirect(url_for('transactions'))
 
-    return render_template('add_transaction.html')
+    return render_template('add_transaction.html', currencies=known_currencies())
 
-@app.route('/transactions')
-@login_required
-def transactions():
-    category = request.args.get('category','')
-    start = request.args.get('start','')
-    end = request.args.get('end','')
+def _filtered_transactions(user_id, args):
+    # Shared by the transactions page and its JSON API
+    category = args.get('category','')
+    start = args.get('start','')
+    end = args.get('end','')
+    search = args.get('q','').strip()
 
-    q = Transaction.query.filter_by(user_id=current_user.id)
+    q = Transaction.query.filter_by(user_id=user_id)
     if category:
-        q = q.filter(Transaction.category==category)
+        found = lookup_category(category)
+        q = q.filter(Transaction.category_id==(found[0] if found else None))
     if start:
         try:
             sdate = datetime.strptime(start, '%Y-%m-%d').date()
@@ -173,8 +215,28 @@ def transactions():
         except ValueError:
             pass
 
-    items = q.order_by(Transaction.date.desc(), Transaction.id.desc()).all()
-    return render_template('transactions.html', items=items)
+    # Ranked by relevance first when searching, newest first otherwise
+    q = apply_search(q, search, user_id)
+    return q.order_by(Transaction.date.desc(), Transaction.id.desc())
+
+def _transaction_summary(q):
+    # Income/expense over the whole filtered set, not just the current page,
+    # in the user's base currency
+    totals = grouped_totals(q.statement, [Transaction.type], current_user.id, current_user.base_currency)
+    income = from_cents(totals.get(('income',), [0])[0])
+    expense = from_cents(totals.get(('expense',), [0])[0])
+    count = sum(n for _, n in totals.values())
+    return {'income': income, 'expense': expense, 'net': round(income - expense, 2), 'count': count}
+
+@app.route('/transactions')
+@login_required
+def transactions():
+    q = _filtered_transactions(current_user.id, request.args)
+    summary = _transaction_summary(q)
+    # The summary already counted the filtered rows; the page's rows are read as they are sent
+    page = StreamedPage(q.statement, request.args.get('page', 1, type=int),
+                        app.config['TRANSACTIONS_PER_PAGE'], summary['count'])
+    return stream_page('transactions.html', items=page, page=page, summary=summary)
 
 # ---------- Edit Transaction ----------
 @app.route('/edit_transaction/<int:transaction_id>', methods=['GET', 'POST'])
@@ -188,17 +250,35 @@ def edit_transaction(transaction_id):
         return redirect(url_for('transactions'))
     
     if request.method == 'POST':
+        try:
+            amount_cents = to_cents(request.form.get('amount', 0))
+        except ValueError:
+            flash('Amount must be a number', 'warning')
+            return redirect(url_for('edit_transaction', transaction_id=transaction_id))
+        if amount_cents <= 0:
+            flash('Amount must be positive', 'warning')
+            return redirect(url_for('edit_transaction', transaction_id=transaction_id))
+        try:
+            currency = normalize_currency(request.form.get('currency') or transaction.currency)
+        except ValueError:
+            flash('Unknown currency', 'warning')
+            return redirect(url_for('edit_transaction', transaction_id=transaction_id))
+        # Resolved first: creating a category flushes, which would log a half-made edit
+        category_id, category = resolve_category(request.form.get('category', 'Other'))
         transaction.type = request.form.get('type', 'expense')
-        transaction.amount = float(request.form.get('amount', 0))
-        transaction.category = request.form.get('category', 'Other')
+        transaction.amount_cents = amount_cents
+        transaction.currency = currency
+        transaction.category_id, transaction.category = category_id, category
         transaction.note = request.form.get('note', '')
         transaction.date = datetime.strptime(request.form.get('date'), '%Y-%m-%d').date()
         
         db.session.commit()
         flash('Transaction updated successfully!', 'success')
+        for alert in pop_budget_alerts(current_user.id):
+            flash(alert, 'warning')
         return redirect(url_for('transactions'))
     
-    return render_template('edit_transaction.html', transaction=transaction)
+    return render_template('edit_transaction.html', transaction=transaction, currencies=known_currencies())
 
 # ---------- Delete Transaction (User) ----------
 @app.route('/delete_transaction/<int:transaction_id>', methods=['POST'])
@@ -222,7 +302,10 @@ def delete_transaction_user(transaction_id):
 def predictions():
     months, totals = get_monthly_totals(current_user.id)
     prediction = predict_next_month_expense(months, totals)
-    return render_template('predictions.html', months=months, totals=totals, prediction=prediction)
+    anomalies = detect_anomalies(current_user.id, months, totals)
+    cash_flow = cash_flow_projection(current_user.id, days=30)
+    return render_template('predictions.html', months=months, totals=totals, prediction=prediction,
+                           anomalies=anomalies, cash_flow=cash_flow)
 
 # ---------- Savings ----------
 @app.route('/savings', methods=['GET','POST'])
@@ -233,26 +316,53 @@ def savings():
         if request.method == 'POST':
             target = request.form.get('monthly_savings_target','0')
             try:
-                target = float(target)
+                target_cents = to_cents(target)
             except ValueError:
                 flash('Target must be a number', 'warning')
                 return redirect(url_for('savings'))
 
             if not goal:
-                goal = Goal(user_id=current_user.id, monthly_savings_target=target)
+                goal = Goal(user_id=current_user.id, monthly_savings_target_cents=target_cents)
                 db.session.add(goal)
             else:
-                goal.monthly_savings_target = target
+                goal.monthly_savings_target_cents = target_cents
             db.session.commit()
             flash('Savings target updated', 'success')
             return redirect(url_for('savings'))
 
         tips, snapshot = saving_tips(current_user.id)
-        return render_template('savings.html', goal=goal, tips=tips, snapshot=snapshot)
+        return render_template('savings.html', goal=goal, tips=tips, snapshot=snapshot,
+                               budgets=budget_status(current_user.id), default_alert=DEFAULT_ALERT_PERCENT)
     except Exception as e:
         flash(f"Error loading savings page: {str(e)}", "danger")
         return redirect(url_for('dashboard'))
 
+# ---------- Budgets ----------
+@app.route('/budgets', methods=['POST'])
+@login_required
+def save_budget():
+    category = request.form.get('category', '').strip()
+    try:
+        limit_cents = to_cents(request.form.get('limit', ''))
+        alert_percent = int(request.form.get('alert_percent') or DEFAULT_ALERT_PERCENT)
+    except ValueError:
+        flash('Limit and alert level must be numbers', 'warning')
+        return redirect(url_for('savings'))
+    if not category or limit_cents <= 0 or not 1 <= alert_percent <= 100:
+        flash('Choose a category, a positive limit and an alert level between 1 and 100', 'warning')
+        return redirect(url_for('savings'))
+
+    set_budget(current_user.id, category, limit_cents, alert_percent)
+    flash('Budget saved', 'success')
+    return redirect(url_for('savings'))
+
+@app.route('/budgets/<int:budget_id>/delete', methods=['POST'])
+@login_required
+def remove_budget(budget_id):
+    if delete_budget(current_user.id, budget_id):
+        flash('Budget removed', 'success')
+    return redirect(url_for('savings'))
+
 # ---------- Profile ----------
 @app.route('/profile', methods=['GET','POST'])
 @login_required
@@ -261,18 +371,33 @@ def profile():
         username = request.form.get('username','').strip()
         email = request.form.get('email','').strip().lower()
         password = request.form.get('password','')
+        base = request.form.get('base_currency','')
+        if base:
+            try:
+                base = normalize_currency(base)
+            except ValueError:
+                flash('Unknown currency', 'warning')
+                return redirect(url_for('profile'))
 
+        user = current_user.user
         if username:
-            current_user.username = username
+            user.username = username
         if email:
-            current_user.email = email
+            user.email = email
         if password:
-            current_user.set_password(password)
+            user.set_password(password)
+        rebase = base and base != user.base_currency
+        if rebase:
+            user.base_currency = base
         db.session.commit()
+        if rebase:
+            # Open dashboards reload their totals in the new currency
+            resync(current_user.id)
+            recompute_budgets([current_user.id])
         flash('Profile updated', 'success')
         return redirect(url_for('profile'))
 
-    return render_template('profile.html')
+    return render_template('profile.html', currencies=known_currencies())
 
 # ---------- About ----------
 @app.route('/about')
@@ -305,32 +430,34 @@ def admin_dashboard():
             flash("Access denied. Admins only.", "danger")
             return redirect(url_for('dashboard'))
 
-        users = User.query.all()
-        transactions = Transaction.query.all()
-        goals = Goal.query.all()
-
-        total_users = len(users)
-        total_transactions = len(transactions)
-        total_income = sum(t.amount for t in transactions if t.type == 'income')
-        total_expense = sum(t.amount for t in transactions if t.type == 'expense')
-        total_goals = len(goals)
-        # Safely check achieved goals with fallback
-        achieved_goals = 0
-        for g in goals:
-            if hasattr(g, 'achieved') and hasattr(g, 'target_amount') and g.achieved and g.target_amount:
-                if g.achieved >= g.target_amount:
-                    achieved_goals += 1
-
-        return render_template('admin_dashboard.html',
-                               users=users,
-                               transactions=transactions,
-                               goals=goals,
-                               total_users=total_users,
-                               total_transactions=total_transactions,
-                               total_income=total_income,
-                               total_expense=total_expense,
-                               total_goals=total_goals,
-                               achieved_goals=achieved_goals)
+        # Tables are streamed row by row as the page is sent; the figures above them are counted in SQL
+        users = stream_rows(db.select(User).order_by(User.id))
+        transactions = stream_rows(db.select(Transaction).options(db.joinedload(Transaction.user, innerjoin=True)))
+        goals = stream_rows(db.select(Goal).options(db.joinedload(Goal.user, innerjoin=True)))
+
+        total_users = db.session.scalar(db.select(db.func.count(User.id)))
+        total_transactions = db.session.scalar(db.select(db.func.count(Transaction.id)))
+        totals = dict(db.session.query(
+            Transaction.type, db.func.sum(Transaction.amount_cents)
+        ).group_by(Transaction.type).all())
+        total_income = from_cents(totals.get('income'))
+        total_expense = from_cents(totals.get('expense'))
+        total_goals, achieved_goals = db.session.execute(db.select(
+            db.func.count(Goal.id),
+            db.func.count(Goal.id).filter(Goal.achieved_cents > 0, Goal.target_amount_cents > 0,
+                                          Goal.achieved_cents >= Goal.target_amount_cents)
+        )).one()
+
+        return stream_page('admin_dashboard.html',
+                           users=users,
+                           transactions=transactions,
+                           goals=goals,
+                           total_users=total_users,
+                           total_transactions=total_transactions,
+                           total_income=total_income,
+                           total_expense=total_expense,
+                           total_goals=total_goals,
+                           achieved_goals=achieved_goals)
     except Exception as e:
         flash(f"Error loading admin dashboard: {str(e)}", "danger")
         return redirect(url_for('dashboard'))
@@ -343,9 +470,11 @@ def delete_user(user_id):
         return redirect(url_for('dashboard'))
 
     user = User.query.get_or_404(user_id)
-    db.session.delete(user)
-    db.session.commit()
-    flash(f'User {user.username} deleted successfully.', 'success')
+    username = user.username
+    if delete_user_account(user):
+        flash(f'User {username} is being deleted in the background.', 'info')
+    else:
+        flash(f'User {username} deleted successfully.', 'success')
     return redirect(url_for('admin_dashboard'))
 
 # ---------- Admin: Delete Transaction ----------
@@ -391,9 +520,10 @@ def admin_delete_user(user_id):
     
     user = User.query.get_or_404(user_id)
     username = user.username
-    db.session.delete(user)
-    db.session.commit()
-    flash(f'User {username} deleted successfully.', 'success')
+    if delete_user_account(user):
+        flash(f'User {username} is being deleted in the background.', 'info')
+    else:
+        flash(f'User {username} deleted successfully.', 'success')
     return redirect(url_for('admin_dashboard'))
 
 # ---------- Goal Management ----------
@@ -406,10 +536,20 @@ def admin_edit_goal(goal_id):
     
     goal = Goal.query.get_or_404(goal_id)
     if request.method == 'POST':
+        try:
+            target_cents = to_cents(request.form.get('target_amount', 0))
+            achieved_cents = to_cents(request.form.get('achieved', 0))
+            monthly_cents = to_cents(request.form.get('monthly_savings_target', 0))
+        except ValueError:
+            flash('Amounts must be numbers', 'warning')
+            return redirect(url_for('admin_edit_goal', goal_id=goal_id))
+        if min(target_cents, achieved_cents, monthly_cents) < 0:
+            flash('Amounts cannot be negative', 'warning')
+            return redirect(url_for('admin_edit_goal', goal_id=goal_id))
         goal.name = request.form.get('name', 'Monthly Savings')
-        goal.target_amount = float(request.form.get('target_amount', 0))
-        goal.achieved = float(request.form.get('achieved', 0))
-        goal.monthly_savings_target = float(request.form.get('monthly_savings_target', 0))
+        goal.target_amount_cents = target_cents
+        goal.achieved_cents = achieved_cents
+        goal.monthly_savings_target_cents = monthly_cents
         db.session.commit()
         flash('Goal updated successfully.', 'success')
         return redirect(url_for('admin_dashboard'))
@@ -429,6 +569,148 @@ def admin_delete_goal(goal_id):
     flash('Goal deleted successfully.', 'success')
     return redirect(url_for('admin_dashboard'))
 
+# ---------- Admin: Bulk Operations ----------
+def _parse_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date() if value else None
+    except ValueError:
+        return None
+
+def _parse_ids(values):
+    return [int(v) for v in values if str(v).isdigit()]
+
+def _bulk_result(message, affected):
+    # JSON for scripted cleanups, flash + redirect for the admin panel
+    if request.accept_mimetypes.best == 'application/json':
+        return {'message': message, 'affected': affected}
+    flash(f'{message}: {affected} row(s) affected.', 'success')
+    return redirect(url_for('admin_dashboard'))
+
+@app.route('/admin/anomalies')
+@login_required
+def admin_anomalies():
+    if current_user.role != 'admin':
+        return {'error': 'Access denied. Admins only.'}, 403
+    # Every user's unusual category-months in one batch pass
+    found = batch_category_month_anomalies()
+    return {'count': len(found), 'anomalies': found}
+
+@app.route('/admin/cash_flow')
+@login_required
+def admin_cash_flow():
+    if current_user.role != 'admin':
+        return {'error': 'Access denied. Admins only.'}, 403
+    projections = batch_cash_flow(days=request.args.get('days', 60, type=int))
+    return {'count': len(projections), 'users': projections}
+
+@app.route('/admin/goal_simulations')
+@login_required
+def admin_goal_simulations():
+    if current_user.role != 'admin':
+        return {'error': 'Access denied. Admins only.'}, 403
+    # Every user's goal in blocks of users, with fewer paths each than the per-user endpoint
+    results = simulation.batch_goal_simulations(
+        paths=request.args.get('paths', simulation.BATCH_PATHS, type=int),
+        horizon=request.args.get('months', simulation.DEFAULT_HORIZON, type=int))
+    return {'count': len(results), 'users': results}
+
+@app.route('/admin/login_metrics')
+@login_required
+def admin_login_metrics():
+    if current_user.role != 'admin':
+        return {'error': 'Access denied. Admins only.'}, 403
+    # Hash pool queue waits and throttled attempts since this worker started
+    return auth.stats()
+
+@app.route('/admin/changes')
+@login_required
+def admin_changes():
+    if current_user.role != 'admin':
+        return {'error': 'Access denied. Admins only.'}, 403
+    # Change feed for derived stores: pass the returned `next` as `after` to continue
+    after = request.args.get('after', 0, type=int)
+    changes = outbox.read_changes(after, min(request.args.get('limit', outbox.CHANGE_BATCH, type=int),
+                                             outbox.CHANGE_BATCH))
+    return {'changes': changes, 'next': changes[-1]['id'] if changes else after}
+
+@app.route('/admin/ingest_metrics')
+@login_required
+def admin_ingest_metrics():
+    if current_user.role != 'admin':
+        return {'error': 'Access denied. Admins only.'}, 403
+    # Ingestion queue depth and rows per group commit since this worker started
+    return ingest.ingest_queue.stats()
+
+@app.route('/admin/bulk/delete_transactions', methods=['POST'])
+@login_required
+def admin_bulk_delete_transactions():
+    if current_user.role != 'admin':
+        flash("Access denied. Admins only.", "danger")
+        return redirect(url_for('dashboard'))
+
+    user_id = request.form.get('user_id', '').strip()
+    condition = bulk.transaction_filter(
+        user_id=int(user_id) if user_id.isdigit() else None,
+        ttype=request.form.get('type', '').strip() or None,
+        category=request.form.get('category', '').strip() or None,
+        start=_parse_date(request.form.get('start', '')),
+        end=_parse_date(request.form.get('end', ''))
+    )
+    if condition is None:
+        flash('Refusing to delete every transaction: set at least one filter.', 'warning')
+        return redirect(url_for('admin_dashboard'))
+
+    affected = bulk.delete_transactions(condition)
+    resync(int(user_id) if user_id.isdigit() else None)
+    recompute_budgets([int(user_id)] if user_id.isdigit() else None)
+    return _bulk_result('Transactions deleted', affected)
+
+@app.route('/admin/bulk/recategorize', methods=['POST'])
+@login_required
+def admin_bulk_recategorize():
+    if current_user.role != 'admin':
+        flash("Access denied. Admins only.", "danger")
+        return redirect(url_for('dashboard'))
+
+    pattern = request.form.get('pattern', '').strip()
+    new_category = request.form.get('new_category', '').strip()
+    user_id = request.form.get('user_id', '').strip()
+    if not pattern or not new_category:
+        flash('Pattern and new category are required.', 'warning')
+        return redirect(url_for('admin_dashboard'))
+
+    affected = bulk.recategorize_transactions(pattern, new_category,
+                                              user_id=int(user_id) if user_id.isdigit() else None)
+    resync(int(user_id) if user_id.isdigit() else None)
+    recompute_budgets([int(user_id)] if user_id.isdigit() else None)
+    return _bulk_result(f"Transactions matching '{pattern}' moved to '{new_category}'", affected)
+
+@app.route('/admin/bulk/set_role', methods=['POST'])
+@login_required
+def admin_bulk_set_role():
+    if current_user.role != 'admin':
+        flash("Access denied. Admins only.", "danger")
+        return redirect(url_for('dashboard'))
+
+    role = request.form.get('role', '')
+    if role not in ('user', 'admin'):
+        flash('Unknown role.', 'warning')
+        return redirect(url_for('admin_dashboard'))
+
+    # Admins cannot change their own role from a bulk selection
+    affected = bulk.set_user_roles(_parse_ids(request.form.getlist('user_ids')), role,
+                                   exclude_id=current_user.id)
+    return _bulk_result(f"Role set to '{role}'", affected)
+
+@app.route('/admin/bulk/delete_goals', methods=['POST'])
+@login_required
+def admin_bulk_delete_goals():
+    if current_user.role != 'admin':
+        flash("Access denied. Admins only.", "danger")
+        return redirect(url_for('dashboard'))
+
+    return _bulk_result('Goals deleted', bulk.delete_goals(_parse_ids(request.form.getlist('goal_ids'))))
+
 # ---------- Analytics & Reports ----------
 @app.route('/analytics')
 @login_required
@@ -437,41 +719,27 @@ def analytics():
     year_start = date(today.year, 1, 1)
     
     # Yearly data
-    yearly_transactions = Transaction.query.filter(
-        Transaction.user_id == current_user.id,
-        Transaction.date >= year_start
-    ).all()
+    frame = load_transaction_frame(current_user.id, start=year_start)
     
     # Monthly breakdown
-    monthly_data = {}
-    for month in range(1, 13):
-        month_start = date(today.year, month, 1)
-        if month == 12:
-            month_end = date(today.year + 1, 1, 1)
-        else:
-            month_end = date(today.year, month + 1, 1)
-        
-        month_transactions = [t for t in yearly_transactions if month_start <= t.date < month_end]
-        income = sum(t.amount for t in month_transactions if t.type == 'income')
-        expense = sum(t.amount for t in month_transactions if t.type == 'expense')
-        monthly_data[month] = {'income': income, 'expense': expense, 'savings': income - expense}
+    monthly_data = {month: {'income': 0.0, 'expense': 0.0, 'savings': 0.0} for month in range(1, 13)}
+    keys, incomes, expenses = frame.by_month(frame.mask(end=date(today.year + 1, 1, 1)))
+    for key, income, expense in zip(keys.astype(int) % 12 + 1, incomes, expenses):
+        monthly_data[int(key)] = {'income': float(income), 'expense': float(expense),
+                                  'savings': float(income - expense)}
     
     # Category analysis
-    category_expenses = {}
-    for t in yearly_transactions:
-        if t.type == 'expense':
-            if t.category not in category_expenses:
-                category_expenses[t.category] = 0
-            category_expenses[t.category] += t.amount
+    category_expenses = frame.by_category(frame.mask(kind='expense'))
     
     # Top categories
     top_categories = sorted(category_expenses.items(), key=lambda x: x[1], reverse=True)[:10]
     
+    total_income, total_expense = frame.totals()
     return render_template('analytics.html', 
                          monthly_data=monthly_data,
                          top_categories=top_categories,
-                         total_income=sum(t.amount for t in yearly_transactions if t.type == 'income'),
-                         total_expense=sum(t.amount for t in yearly_transactions if t.type == 'expense'))
+                         total_income=total_income,
+                         total_expense=total_expense)
 
 # ---------- Help & Support ----------
 @app.route('/help')
@@ -503,47 +771,125 @@ def forgot_password():
     return render_template('forgot_password.html')
 
 # ---------- API Endpoints for AJAX ----------
+def _with_timing(body, timings):
+    # Per-widget timings for the browser's network panel, when enabled
+    response = app.make_response(body)
+    if app.debug or app.config['SERVER_TIMING']:
+        response.headers['Server-Timing'] = server_timing(timings)
+    return response
+
+@app.route('/api/dashboard')
+@login_required
+def api_dashboard():
+    payload, timings = dashboard_snapshot(current_user.id)
+    return _with_timing({**payload, 'budgets': budget_status(current_user.id)}, timings)
+
+@app.route('/api/dashboard/stream')
+@login_required
+def api_dashboard_stream():
+    # Holds a worker thread while open (hidden tabs close theirs), so each
+    # worker serves at most DASHBOARD_STREAMS; past that the page stops live updates
+    try:
+        stream = dashboard_stream(current_user.id)
+    except StreamLimit:
+        return {'error': 'Too many live dashboards open; retry shortly'}, 503, {'Retry-After': '30'}
+    return Response(stream_with_context(stream),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/budgets')
+@login_required
+def api_budgets():
+    return {'budgets': budget_status(current_user.id)}
+
 @app.route('/api/transaction_stats')
 @login_required
 def api_transaction_stats():
     today = date.today()
     month_start = date(today.year, today.month, 1)
     
-    month_transactions = Transaction.query.filter(
-        Transaction.user_id == current_user.id,
-        Transaction.date >= month_start
-    ).all()
-    
-    income = sum(t.amount for t in month_transactions if t.type == 'income')
-    expense = sum(t.amount for t in month_transactions if t.type == 'expense')
+    frame = load_transaction_frame(current_user.id, start=month_start)
+    income, expense = frame.totals()
     
     return {
         'income': income,
         'expense': expense,
-        'savings': income - expense,
-        'transaction_count': len(month_transactions)
+        'savings': round(income - expense, 2),
+        'transaction_count': len(frame)
     }
 
+@app.route('/api/transactions')
+@login_required
+def api_transactions():
+    q = _filtered_transactions(current_user.id, request.args)
+    page = db.paginate(q, page=request.args.get('page', 1, type=int),
+                       per_page=min(request.args.get('per_page', app.config['TRANSACTIONS_PER_PAGE'], type=int), 200),
+                       error_out=False)
+    return {
+        'items': [{
+            'id': t.id,
+            'date': t.date.isoformat(),
+            'type': t.type,
+            'amount': t.amount,
+            'currency': t.currency,
+            'category': t.category,
+            'note': t.note
+        } for t in page.items],
+        'page': page.page,
+        'pages': page.pages,
+        'total': page.total
+    }
+
+@app.route('/api/anomalies')
+@login_required
+def api_anomalies():
+    return detect_anomalies(current_user.id, limit=min(request.args.get('limit', 20, type=int), 200))
+
+@app.route('/api/cash_flow')
+@login_required
+def api_cash_flow():
+    return cash_flow_projection(current_user.id, days=request.args.get('days', 60, type=int))
+
+@app.route('/api/goal_simulation')
+@login_required
+def api_goal_simulation():
+    # Seeded per user, so reloading the savings page gives the same answer
+    return simulation.simulate_goal(current_user.id,
+                                    paths=request.args.get('paths', simulation.DEFAULT_PATHS, type=int),
+                                    horizon=request.args.get('months', simulation.DEFAULT_HORIZON, type=int),
+                                    seed=current_user.id)
+
 @app.route('/api/category_chart')
 @login_required
 def api_category_chart():
     today = date.today()
     month_start = date(today.year, today.month, 1)
     
-    expenses = Transaction.query.filter(
-        Transaction.user_id == current_user.id,
-        Transaction.type == 'expense',
-        Transaction.date >= month_start
-    ).all()
-    
-    category_data = {}
-    for t in expenses:
-        if t.category not in category_data:
-            category_data[t.category] = 0
-        category_data[t.category] += t.amount
+    frame = load_transaction_frame(current_user.id, start=month_start, kind='expense')
+    category_data = frame.by_category()
     
     return {'categories': list(category_data.keys()), 'amounts': list(category_data.values())}
 
+# ---------- Ingestion API ----------
+@app.route('/api/transactions/batch', methods=['POST'])
+@login_required
+def api_ingest_transactions():
+    # For bank feeds: [{"key": ..., "amount": ..., ...}, ...], or {"items": [...]}
+    body = request.get_json(silent=True)
+    items = body.get('items') if isinstance(body, dict) else body
+    if not isinstance(items, list) or not items:
+        return {'error': 'Expected a non-empty array of transactions'}, 400
+    if len(items) > ingest.INGEST_MAX_ITEMS:
+        return {'error': f'At most {ingest.INGEST_MAX_ITEMS} transactions per request'}, 413
+    try:
+        results = ingest.ingest(app, current_user.id, items, current_user.base_currency)
+    except ingest.IngestBusy:
+        return {'error': 'Too many transactions waiting; retry shortly'}, 503, {'Retry-After': '1'}
+    counts = {}
+    for result in results:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+    return {'items': results, 'counts': counts}
+
 # ---------------- Run the app ----------------
 if __name__ == "__main__":
     app.run(debug=True)
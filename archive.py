@@ -0,0 +1,193 @@
+from models import db, User, Transaction, TransactionRollup
+from fx import base_currency, add_converted
+from partitions import is_partitioned, list_partitions, drop_partition
+from sqlalchemy import (MetaData, Table, Column, Index, create_engine, inspect, select, insert, delete, func,
+                        cast, text, Date)
+
+# Cold storage for closed years. archive_before() moves every transaction
+# dated before a cut-off into a separate database (ARCHIVE_DATABASE_URL,
+# e.g. sqlite:///trackflow-archive.db) and leaves per-month rollups in their
+# place: one transaction_rollups row per (user, month, type, category,
+# currency). Monthly totals, the dashboard and the forecasts add the rollups
+# to what they sum from the remaining rows, so archiving does not change
+# them. Row-level views (the transaction list, search, anomaly and recurring
+# detection) only see the years still in the hot database. Archived amounts
+# in a currency other than the user's base are converted per month, at the
+# rate of its first day, rather than per day.
+#
+# A batch of rows is written to the archive, and committed there, before it
+# is swapped for rollups in one hot transaction; copying again replaces what
+# an interrupted run left behind, so a failed run can simply be repeated.
+# Partitions of a partitioned Postgres table (partitions.py) that lie wholly
+# before the cut-off are dropped instead of deleted row by row.
+#
+# The rollups are read only while ARCHIVE_DATABASE_URL is set: set it for
+# the app as well as for archive_transactions.py.
+
+# Users whose rows are swapped for rollups per hot transaction
+ARCHIVE_BATCH_USERS = 100
+# Rows written to the archive per round-trip
+COPY_CHUNK_SIZE = 10000
+
+# The archive's copy of `transactions`: same columns, no foreign keys (users stay in the hot database)
+archive_metadata = MetaData()
+archived_transactions = Table(
+    'transactions', archive_metadata,
+    *(Column(c.name, c.type, primary_key=c.primary_key) for c in Transaction.__table__.columns),
+    Index('ix_archived_transactions_user_date', 'user_id', 'date'),
+)
+_columns = [Transaction.__table__.c[c.name] for c in archived_transactions.columns]
+
+store_url = None
+_store = None
+
+
+def configure(config):
+    """Apply ARCHIVE_DATABASE_URL from the app config."""
+    global store_url, _store
+    store_url = config['ARCHIVE_DATABASE_URL'] or None
+    _store = None
+
+
+def enabled() -> bool:
+    return store_url is not None
+
+
+def _add_missing_columns(engine):
+    # Columns added to `transactions` since the archive was created
+    with engine.begin() as conn:
+        present = {c['name'] for c in inspect(conn).get_columns('transactions')}
+        for column in archived_transactions.columns:
+            if column.name not in present:
+                conn.execute(text(f"ALTER TABLE transactions ADD COLUMN {column.name} "
+                                  f"{column.type.compile(engine.dialect)}"))
+
+
+def store():
+    """Engine of the archive database, its table created on first use."""
+    global _store
+    if _store is None:
+        if store_url is None:
+            raise RuntimeError('ARCHIVE_DATABASE_URL is not set')
+        engine = create_engine(store_url)
+        archive_metadata.create_all(engine)
+        _add_missing_columns(engine)
+        _store = engine
+    return _store
+
+
+def month_start(column):
+    # First day of the month of a date column
+    if db.engine.dialect.name == 'sqlite':
+        return func.date(column, 'start of month')
+    return cast(func.date_trunc('month', column), Date)
+
+
+# Reading rollups
+
+def rollup_sums_stmt(user_id: int, keys, *where):
+    """(*keys, currency, month, cents, count) over user_id's rollups: fx.by_day_stmt()'s shape.
+
+    `keys` and `where` are expressions over TransactionRollup columns.
+    """
+    return select(
+        *keys, TransactionRollup.currency, TransactionRollup.month,
+        func.sum(TransactionRollup.amount_cents), func.sum(TransactionRollup.count)
+    ).where(TransactionRollup.user_id == user_id, *where).group_by(
+        *keys, TransactionRollup.currency, TransactionRollup.month
+    )
+
+
+def add_rollups(groups: dict, user_id: int, keys, *where, base: str = None) -> dict:
+    """Fold user_id's archived sums into grouped_totals() output grouped by the same `keys`."""
+    if not enabled():
+        return groups
+    rows = db.session.execute(rollup_sums_stmt(user_id, keys, *where)).all()
+    return add_converted(groups, rows, len(keys), base or base_currency(user_id))
+
+
+# Archiving
+
+def _copy(rows) -> int:
+    # Earlier copies of the same ids (from an interrupted run) are replaced
+    copied = 0
+    with store().begin() as conn:
+        for chunk in rows.partitions(COPY_CHUNK_SIZE):
+            values = [dict(row._mapping) for row in chunk]
+            conn.execute(delete(archived_transactions).where(
+                archived_transactions.c.id.in_([v['id'] for v in values])))
+            conn.execute(insert(archived_transactions), values)
+            copied += len(values)
+    return copied
+
+
+def _add_rollups_for(*where):
+    # One rollup row per (user, month, type, category, currency) of the rows `where` selects
+    month = month_start(Transaction.date)
+    keys = [Transaction.user_id, month, Transaction.type, Transaction.category_id, Transaction.currency]
+    db.session.execute(insert(TransactionRollup).from_select(
+        ['user_id', 'month', 'type', 'category_id', 'currency', 'amount_cents', 'count'],
+        select(*keys, func.sum(Transaction.amount_cents), func.count(Transaction.id))
+        .where(*where).group_by(*keys)
+    ))
+
+
+def _archive_partition(name: str, start, end) -> int:
+    # Writes to the partition wait until it is gone; reads carry on
+    db.session.execute(text(f"LOCK TABLE {name} IN SHARE MODE"))
+    scope = (Transaction.date >= start, Transaction.date < end)
+    copied = _copy(db.session.execute(
+        select(*_columns).where(*scope).execution_options(yield_per=COPY_CHUNK_SIZE)))
+    _add_rollups_for(*scope)
+    drop_partition(db.session.connection(), name)
+    db.session.commit()
+    return copied
+
+
+def _archive_rows(user_ids, cutoff, last_id: int) -> int:
+    # Rows added after the run started (id > last_id) stay hot
+    scope = (Transaction.user_id.in_(user_ids), Transaction.date < cutoff, Transaction.id <= last_id)
+    # Locked on Postgres until the rollups replace them, so none can change in between
+    copied = _copy(db.session.execute(
+        select(*_columns).where(*scope).with_for_update().execution_options(yield_per=COPY_CHUNK_SIZE)))
+    if copied:
+        _add_rollups_for(*scope)
+        db.session.execute(delete(Transaction).where(*scope), execution_options={'synchronize_session': False})
+    db.session.commit()
+    return copied
+
+
+def archive_before(cutoff, batch_users: int = ARCHIVE_BATCH_USERS, progress=None):
+    """Move every transaction dated before `cutoff` to the archive; returns (rows, partitions dropped).
+
+    `progress`, if given, is called with a line of text after each step.
+    """
+    report = progress or (lambda line: None)
+    copied, dropped = 0, []
+    conn = db.session.connection()
+    if db.engine.dialect.name == 'postgresql' and is_partitioned(conn):
+        for name, start, end in list_partitions(conn):
+            if end <= cutoff:
+                rows = _archive_partition(name, start, end)
+                copied += rows
+                dropped.append(name)
+                report(f"  {name}: {rows} row(s) archived, partition dropped")
+
+    # Whatever is left: an unpartitioned table, or stray rows in the default partition
+    last_id = db.session.execute(select(func.max(Transaction.id))).scalar() or 0
+    user_ids = db.session.execute(select(User.id).order_by(User.id)).scalars().all()
+    for i in range(0, len(user_ids), batch_users):
+        rows = _archive_rows(user_ids[i:i + batch_users], cutoff, last_id)
+        copied += rows
+        if rows:
+            report(f"  users {user_ids[i]}-{user_ids[min(i + batch_users, len(user_ids)) - 1]}: "
+                   f"{rows} row(s) archived")
+    return copied, dropped
+
+
+def delete_archived(user_id: int) -> int:
+    """Delete a user's archived transactions (their rollups go with the user row)."""
+    if not enabled():
+        return 0
+    with store().begin() as conn:
+        return conn.execute(delete(archived_transactions).where(archived_transactions.c.user_id == user_id)).rowcount
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+TrackFlow Transaction Archiver
+Keeps the transactions table to the years the app still works on
+
+  1. Partitions: on a partitioned Postgres table (TRANSACTION_PARTITIONS,
+     applied by migrate.py), creates the partitions for the coming months.
+  2. Archiving: with ARCHIVE_DATABASE_URL set, moves every transaction dated
+     before the last ARCHIVE_KEEP_YEARS calendar years into the archive
+     database, leaving monthly rollups behind so totals, charts and
+     forecasts are unchanged. Closed partitions are dropped whole.
+
+Safe to re-run, and to run again after an interruption. Run it from cron,
+e.g. monthly.
+
+Usage:
+    python archive_transactions.py                  # both steps
+    python archive_transactions.py --before 2023    # archive everything dated before 2023
+    python archive_transactions.py --partitions-only
+"""
+
+import sys
+import time
+import argparse
+from datetime import date
+
+from sqlalchemy.exc import SQLAlchemyError
+
+def create_partitions(db):
+    """Partitions up to PARTITIONS_AHEAD months ahead, if the table is partitioned"""
+    from partitions import PARTITIONS_AHEAD, is_partitioned, partition_interval, ensure_partitions, add_months
+
+    if db.engine.dialect.name != 'postgresql':
+        print("  Not Postgres: transactions are not partitioned")
+        return
+    with db.engine.connect() as conn:
+        if not is_partitioned(conn):
+            print("  transactions is not partitioned (set TRANSACTION_PARTITIONS and run migrate.py)")
+            return
+        today = date.today()
+        created = ensure_partitions(conn, today, add_months(today, PARTITIONS_AHEAD + 1), partition_interval(conn))
+        conn.commit()
+        print(f"  Created {len(created)} partition(s){': ' + ', '.join(created) if created else ''}")
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description="Create upcoming partitions and archive closed years")
+    parser.add_argument('--before', type=int, metavar='YEAR',
+                        help="archive transactions dated before this year (default: keep ARCHIVE_KEEP_YEARS)")
+    parser.add_argument('--partitions-only', action='store_true', help="do not archive anything")
+    args = parser.parse_args()
+
+    print("TrackFlow Transaction Archiver")
+    print("=" * 50)
+
+    from app import app
+    from models import db
+    import archive
+
+    try:
+        with app.app_context():
+            print("Database URL:", app.config['SQLALCHEMY_DATABASE_URI'])
+            print("Checking partitions...")
+            create_partitions(db)
+            if args.partitions_only:
+                return
+            if not archive.enabled():
+                print("ARCHIVE_DATABASE_URL not set; nothing archived")
+                return
+
+            year = args.before or date.today().year - app.config['ARCHIVE_KEEP_YEARS'] + 1
+            print(f"Archiving transactions dated before {year} to {archive.store_url}...")
+            started = time.perf_counter()
+            rows, dropped = archive.archive_before(date(year, 1, 1), progress=print)
+            print(f"Archived {rows} transaction(s), dropped {len(dropped)} partition(s) "
+                  f"in {time.perf_counter() - started:.2f} s")
+    except SQLAlchemyError as e:
+        print(f"Database error: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+from flask import Blueprint, send_from_directory, url_for
+import json
+import os
+
+# Fingerprinted static files written by build_assets.py. Their names change
+# whenever their contents do, so they are served with a year-long immutable
+# Cache-Control and browsers never ask for them again. Templates link them
+# with asset_url('css/tailwind.css'); until the assets are built, the same
+# call falls back to the plain /static file (or a CDN URL, where given).
+# The manifest is read once at import, so restart after a build.
+
+DIST_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'dist')
+# Seconds browsers may keep a fingerprinted file
+MAX_AGE = 365 * 24 * 3600
+
+assets = Blueprint('assets', __name__)
+
+
+def load_manifest(dist_dir: str = DIST_DIR) -> dict:
+    """{'css/tailwind.css': 'css/tailwind.<hash>.css', ...}; empty when nothing is built."""
+    try:
+        with open(os.path.join(dist_dir, 'manifest.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+manifest = load_manifest()
+
+
+@assets.app_template_global()
+def asset_built(name: str) -> bool:
+    return name in manifest
+
+
+@assets.app_template_global()
+def asset_url(name: str, fallback: str = None) -> str:
+    """URL of static file `name`: its fingerprinted copy once built, else `fallback` or /static/<name>."""
+    if name in manifest:
+        return url_for('assets.asset', filename=manifest[name])
+    if fallback:
+        return fallback
+    return url_for('static', filename=name)
+
+
+@assets.route('/assets/<path:filename>')
+def asset(filename):
+    response = send_from_directory(DIST_DIR, filename, max_age=MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
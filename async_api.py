@@ -0,0 +1,164 @@
+from flask import Blueprint
+from flask_login import login_required, current_user
+from models import db, Transaction, Category
+from money import from_cents
+from utils import monthly_totals_source, monthly_rollups_source, monthly_totals_from_groups
+from budgets import month_bounds
+from fx import (base_currency, other_currencies_stmt, sums_stmt, by_day_stmt, split_by_currency,
+                fold_sums, add_converted)
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine
+from datetime import date
+import archive
+import asyncio
+import threading
+
+# Dashboard widgets served by async views over SQLAlchemy's asyncio engine.
+# Each widget query runs on its own connection, so a dashboard load waits
+# for the slowest query rather than the sum of all of them.
+#
+# Flask runs every async view in a fresh event loop, and asyncio connections
+# cannot move between loops. The async engine and its pool therefore live on
+# one long-lived loop per process ("async-db" thread); views hand their
+# queries to it and await the result, so asyncpg connections are pooled and
+# reused across requests and threads. aiosqlite keeps SQLAlchemy's default
+# NullPool: each of its connections owns a non-daemon thread, and pooled ones
+# would keep the process from exiting.
+
+# asyncio drivers for the dialects the app runs on
+ASYNC_DRIVERS = {'sqlite': 'sqlite+aiosqlite', 'postgresql': 'postgresql+asyncpg'}
+
+async_api = Blueprint('async_api', __name__, url_prefix='/api/async')
+
+_engines = {}
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _db_loop():
+    # Started on first use, so workers forked after import each get their own
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name='async-db', daemon=True).start()
+            _loop = loop
+    return _loop
+
+
+def async_engine(url):
+    """AsyncEngine for a sync database URL, one per URL and process."""
+    with _loop_lock:
+        if url not in _engines:
+            driver = ASYNC_DRIVERS.get(url.get_backend_name())
+            if driver is None:
+                raise RuntimeError(f"No asyncio driver for '{url.get_backend_name()}'")
+            _engines[url] = create_async_engine(url.set(drivername=driver))
+    return _engines[url]
+
+
+async def run_on_db_loop(coro):
+    """Await `coro` on the process-wide database loop from any event loop."""
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, _db_loop()))
+
+
+async def _all(engine, stmt):
+    async with engine.connect() as conn:
+        return (await conn.execute(stmt)).all()
+
+
+async def _grouped_totals(engine, bind, stmt, keys, user_id: int, base: str):
+    # fx.grouped_totals() over the async engine; rates are read through the
+    # sync engine `bind`, in a worker thread
+    if not (await _all(engine, other_currencies_stmt(user_id, base)))[0][0]:
+        return fold_sums(await _all(engine, sums_stmt(stmt, keys)), len(keys))
+    same, other = split_by_currency(stmt, base)
+    groups = fold_sums(await _all(engine, sums_stmt(same, keys)), len(keys))
+    rows = await _all(engine, by_day_stmt(other, keys))
+    return await asyncio.to_thread(add_converted, groups, rows, len(keys), base, bind)
+
+
+async def transaction_stats(engine, bind, user_id: int, base: str, today: date):
+    # Same figures as TransactionFrame.totals(): anything not income is expense
+    start, end = month_bounds(today)
+    groups = await _grouped_totals(engine, bind, select(Transaction).where(
+        Transaction.user_id == user_id, Transaction.date >= start, Transaction.date < end
+    ), [Transaction.type], user_id, base)
+    income_cents = sum(cents for (kind,), (cents, _) in groups.items() if kind == 'income')
+    expense_cents = sum(cents for (kind,), (cents, _) in groups.items() if kind != 'income')
+    income, expense = from_cents(income_cents), from_cents(expense_cents)
+    return {
+        'income': income,
+        'expense': expense,
+        'savings': round(income - expense, 2),
+        'transaction_count': sum(count for cents, count in groups.values())
+    }
+
+
+async def category_chart(engine, bind, user_id: int, base: str, today: date):
+    # This month's expenses per category, largest first
+    start, end = month_bounds(today)
+    groups = await _grouped_totals(engine, bind, select(Transaction).outerjoin(
+        Category, Category.id == Transaction.category_id
+    ).where(
+        Transaction.user_id == user_id, Transaction.type == 'expense',
+        Transaction.date >= start, Transaction.date < end
+    ), [Transaction.category_id, Category.name], user_id, base)
+    ranked = sorted(((name or 'Other', cents) for (_, name), (cents, _) in groups.items()),
+                    key=lambda item: -item[1])
+    return {'categories': [name for name, _ in ranked], 'amounts': [from_cents(cents) for _, cents in ranked]}
+
+
+async def monthly_totals(engine, bind, user_id: int, base: str):
+    stmt, keys = monthly_totals_source(user_id)
+    groups = await _grouped_totals(engine, bind, stmt, keys, user_id, base)
+    if archive.enabled():
+        keys, where = monthly_rollups_source(user_id)
+        rows = await _all(engine, archive.rollup_sums_stmt(user_id, keys, where))
+        groups = await asyncio.to_thread(add_converted, groups, rows, len(keys), base, bind)
+    months, totals = monthly_totals_from_groups(groups)
+    return {'months': months, 'totals': totals}
+
+
+async def _widgets(bind, user_id: int, base: str, today: date):
+    engine = async_engine(bind.url)
+    stats, categories, monthly = await asyncio.gather(
+        transaction_stats(engine, bind, user_id, base, today),
+        category_chart(engine, bind, user_id, base, today),
+        monthly_totals(engine, bind, user_id, base),
+    )
+    return {'stats': stats, 'categories': categories, 'monthly': monthly}
+
+
+async def dashboard_widgets(user_id: int, today: date = None):
+    """Every dashboard widget for one user, queried concurrently."""
+    return await run_on_db_loop(_widgets(db.engine, user_id, base_currency(user_id), today or date.today()))
+
+
+async def _one(widget, *args):
+    return await run_on_db_loop(widget(async_engine(db.engine.url), db.engine, current_user.id,
+                                       current_user.base_currency, *args))
+
+
+@async_api.route('/transaction_stats')
+@login_required
+async def api_transaction_stats():
+    return await _one(transaction_stats, date.today())
+
+
+@async_api.route('/category_chart')
+@login_required
+async def api_category_chart():
+    return await _one(category_chart, date.today())
+
+
+@async_api.route('/monthly_totals')
+@login_required
+async def api_monthly_totals():
+    return await _one(monthly_totals)
+
+
+@async_api.route('/dashboard')
+@login_required
+async def api_dashboard():
+    return await dashboard_widgets(current_user.id)
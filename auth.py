@@ -0,0 +1,213 @@
+from models import db, User
+from principal import load_principal
+from sqlalchemy import select
+from werkzeug.security import generate_password_hash, check_password_hash
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, deque
+from math import ceil
+import logging
+import secrets
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# Password checks for /login. A hash costs ~100 ms of CPU by design, so a
+# burst of attempts could otherwise occupy every worker. Checks run on a
+# small pool (LOGIN_HASH_WORKERS per process, LOGIN_HASH_QUEUE more may
+# wait, any beyond that are refused at once); every attempt first takes a
+# token from its client IP's bucket and from its account's bucket; and an
+# unknown email is checked against a dummy hash, so it costs and takes as
+# long as a real one. Buckets live in this process, or in Redis with
+# LOGIN_THROTTLE_URL set (redis://...) so every worker shares them.
+
+# Login attempts per client IP: a burst of IP_BURST, then one per IP_INTERVAL seconds
+IP_BURST = 20
+IP_INTERVAL = 3
+# Login attempts per account (email address), whether or not it exists
+ACCOUNT_BURST = 5
+ACCOUNT_INTERVAL = 30
+# Buckets kept per process when they are not shared
+THROTTLE_KEYS = 100000
+# Recent hash queue waits kept for the percentiles in stats()
+WAIT_SAMPLES = 1000
+# Redis key prefix of shared buckets
+THROTTLE_PREFIX = 'trackflow:login:'
+
+# KEYS[1]: bucket; ARGV: burst, interval. Returns seconds until a token is
+# free, "0" when one was taken. Uses the server's clock, shared by all workers.
+_TAKE_SCRIPT = """
+local burst, interval = tonumber(ARGV[1]), tonumber(ARGV[2])
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'at')
+local tokens = tonumber(state[1]) or burst
+local at = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + (now - at) / interval)
+local wait = 0
+if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) * interval end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'at', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst * interval))
+return tostring(wait)
+"""
+
+
+class LoginRefused(Exception):
+    """A login attempt turned away before its password was checked."""
+
+    def __init__(self, message: str, status: int, retry_after: int):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class TokenBuckets:
+    """Token buckets in this process, least recently used dropped beyond `size`."""
+
+    def __init__(self, size: int = THROTTLE_KEYS):
+        self.size = size
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()  # key -> (tokens, updated_at)
+
+    def take(self, key: str, burst: int, interval: float) -> float:
+        """Take a token from `key`'s bucket: 0 if there was one, else seconds until there is."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, at = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - at) / interval)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) * interval
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.size:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+class SharedTokenBuckets:
+    """Token buckets in Redis, shared by every worker; falls back to this process's if Redis fails."""
+
+    def __init__(self, url: str):
+        import redis  # only needed with LOGIN_THROTTLE_URL
+        self._take = redis.Redis.from_url(url).register_script(_TAKE_SCRIPT)
+        self._local = TokenBuckets()
+
+    def take(self, key: str, burst: int, interval: float) -> float:
+        try:
+            return float(self._take(keys=[THROTTLE_PREFIX + key], args=[burst, interval]))
+        except Exception:
+            log.warning('Login throttle store unavailable; throttling in this process only', exc_info=True)
+            return self._local.take(key, burst, interval)
+
+
+class HashPool:
+    """Runs password checks on at most `workers` threads, with up to `queue` more waiting."""
+
+    def __init__(self, workers: int = 2, queue: int = 16):
+        self.configure(workers, queue)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._waits = deque(maxlen=WAIT_SAMPLES)
+        self.in_flight = self.completed = self.refused = 0
+
+    def configure(self, workers: int, queue: int):
+        self.workers = max(1, workers)
+        self.queue = max(0, queue)
+
+    def _pool(self) -> ThreadPoolExecutor:
+        # Started on first use, so workers forked after import each get their own
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='password-hash')
+            return self._executor
+
+    def check(self, pwhash: str, password: str) -> bool:
+        """check_password_hash() on the pool; raises LoginRefused when the pool is full."""
+        with self._lock:
+            if self.in_flight >= self.workers + self.queue:
+                self.refused += 1
+                raise LoginRefused('Too many sign-ins right now. Please try again in a moment.', 503, 1)
+            self.in_flight += 1
+        try:
+            return self._pool().submit(self._check, time.perf_counter(), pwhash, password).result()
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def _check(self, queued_at: float, pwhash: str, password: str) -> bool:
+        wait = time.perf_counter() - queued_at
+        with self._lock:
+            self._waits.append(wait)
+            self.completed += 1
+        return check_password_hash(pwhash, password)
+
+    def stats(self) -> dict:
+        with self._lock:
+            waits = sorted(self._waits)
+            in_flight, completed, refused = self.in_flight, self.completed, self.refused
+
+        def percentile(p):
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))] * 1000, 2) if waits else 0.0
+
+        return {
+            'workers': self.workers,
+            'queue': self.queue,
+            'in_flight': in_flight,
+            'completed': completed,
+            'refused': refused,
+            'wait_ms': {'p50': percentile(0.5), 'p95': percentile(0.95), 'p99': percentile(0.99),
+                        'max': percentile(1.0), 'samples': len(waits)},
+        }
+
+
+hash_pool = HashPool()
+throttle = TokenBuckets()
+throttled = {'ip': 0, 'account': 0}
+_dummy_hash = None
+_dummy_lock = threading.Lock()
+
+
+def configure(config):
+    """Apply LOGIN_HASH_WORKERS, LOGIN_HASH_QUEUE and LOGIN_THROTTLE_URL from the app config."""
+    global throttle
+    hash_pool.configure(config['LOGIN_HASH_WORKERS'], config['LOGIN_HASH_QUEUE'])
+    throttle = SharedTokenBuckets(config['LOGIN_THROTTLE_URL']) if config['LOGIN_THROTTLE_URL'] else TokenBuckets()
+
+
+def dummy_hash() -> str:
+    # Same method and cost as real password hashes, matching nothing
+    global _dummy_hash
+    with _dummy_lock:
+        if _dummy_hash is None:
+            _dummy_hash = generate_password_hash(secrets.token_urlsafe(32))
+    return _dummy_hash
+
+
+def _throttle(scope: str, key: str, burst: int, interval: float):
+    wait = throttle.take(f'{scope}:{key}', burst, interval)
+    if wait:
+        throttled[scope] += 1
+        seconds = ceil(wait)
+        raise LoginRefused(f'Too many login attempts. Please try again in {seconds} seconds.', 429, seconds)
+
+
+def authenticate(email: str, password: str, remote_addr: str):
+    """The Principal for email and password, None if they do not match.
+
+    Raises LoginRefused, without checking the password, when the client IP
+    or the account is out of attempts or the hashing pool is full.
+    """
+    _throttle('ip', remote_addr or '-', IP_BURST, IP_INTERVAL)
+    _throttle('account', email, ACCOUNT_BURST, ACCOUNT_INTERVAL)
+    row = db.session.execute(select(User.id, User.password_hash).where(User.email == email)).first()
+    # Hand the connection back while the check waits its turn on the pool
+    db.session.close()
+    matches = hash_pool.check(row.password_hash if row is not None else dummy_hash(), password)
+    return load_principal(row.id) if row is not None and matches else None
+
+
+def stats() -> dict:
+    return {'hashing': hash_pool.stats(), 'throttled': dict(throttled)}
@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+"""
+TrackFlow Benchmarks
+Seeds a synthetic dataset and times hot paths against it
+
+Usage:
+    python benchmark.py seed --users 200 --per-user 5000
+    python benchmark.py categories
+    python benchmark.py search --terms uber netflix "coffee shop"
+    python benchmark.py startup
+    python benchmark.py widgets --concurrency 1 4 16 64
+    python benchmark.py ingest --concurrency 1 8 32 --rows 4000 --batch 100
+    python benchmark.py simulate --paths 1000 10000 100000 --months 120
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import subprocess
+from datetime import date, timedelta
+
+DEFAULT_DATABASE = "sqlite:///benchmark.db"
+
+CATEGORIES = ['Food', 'Transport', 'Bills', 'Shopping', 'Health', 'Education', 'Entertainment',
+              'Travel', 'Rent', 'Groceries', 'Subscriptions', 'Insurance', 'Gift', 'Other']
+INCOME_CATEGORIES = ['Salary', 'Business', 'Investment']
+MERCHANTS = ['Swiggy order', 'Uber ride', 'Electricity bill', 'Amazon', 'Pharmacy', 'Netflix',
+             'Spotify', 'Rent payment', 'BigBasket', 'Movie tickets', 'Gym membership', 'Flight',
+             'Coffee shop', 'Mobile recharge', 'Fuel', '']
+
+def seed(users: int, per_user: int, rng_seed: int = 42):
+    """Insert `users` users with `per_user` transactions each"""
+    from app import app
+    from models import db, User, Transaction
+    from categories import resolve_category
+    from sqlalchemy import insert
+    from werkzeug.security import generate_password_hash
+
+    rng = random.Random(rng_seed)
+    today = date.today()
+    password_hash = generate_password_hash('benchmark')
+    started = time.perf_counter()
+
+    with app.app_context():
+        offset = db.session.query(db.func.count(User.id)).scalar()
+        codes = {}
+        for label in CATEGORIES + INCOME_CATEGORIES:
+            codes[label] = resolve_category(label)
+        db.session.commit()
+
+        for n in range(users):
+            user = User(username=f'bench{offset + n}', email=f'bench{offset + n}@example.com',
+                        password_hash=password_hash)
+            db.session.add(user)
+            db.session.flush()
+            rows = []
+            for _ in range(per_user):
+                income = rng.random() < 0.15
+                label = rng.choice(INCOME_CATEGORIES if income else CATEGORIES)
+                cid, _ = codes[label]
+                rows.append({
+                    'user_id': user.id,
+                    'type': 'income' if income else 'expense',
+                    'amount_cents': int(rng.lognormvariate(6, 1.2) * 100),
+                    'category': label,
+                    'category_id': cid,
+                    'note': rng.choice(MERCHANTS),
+                    'date': today - timedelta(days=rng.randrange(3 * 365)),
+                })
+            db.session.execute(insert(Transaction), rows)
+            db.session.commit()
+
+    elapsed = time.perf_counter() - started
+    print(f"Seeded {users} users x {per_user} transactions in {elapsed:.1f}s")
+
+def _relation_sizes(db, names):
+    # Bytes on disk per table/index
+    if db.engine.dialect.name == 'sqlite':
+        rows = db.session.execute(db.text("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name")).all()
+        sizes = dict(rows)
+    else:
+        sizes = {name: db.session.execute(db.text("SELECT pg_relation_size(:n)"), {"n": name}).scalar()
+                 for name in names}
+    return {name: sizes.get(name, 0) for name in names}
+
+def _time_query(db, sql, user_ids, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for uid in user_ids:
+            db.session.execute(db.text(sql), {"uid": uid}).all()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+def bench_categories():
+    """Storage and group-by time: free-text category vs. dictionary id"""
+    from app import app
+    from models import db, User
+
+    with app.app_context():
+        db.session.execute(db.text(
+            "CREATE INDEX IF NOT EXISTS ix_bench_user_category_text ON transactions (user_id, category)"
+        ))
+        db.session.commit()
+        if db.engine.dialect.name == 'sqlite':
+            db.session.execute(db.text("ANALYZE"))
+        else:
+            db.session.execute(db.text("ANALYZE transactions"))
+        db.session.commit()
+
+        rows = db.session.execute(db.text("SELECT COUNT(*) FROM transactions")).scalar()
+        sizes = _relation_sizes(db, ['ix_bench_user_category_text', 'ix_transactions_user_category'])
+        text_bytes = db.session.execute(db.text("SELECT SUM(LENGTH(category)) FROM transactions")).scalar() or 0
+
+        user_ids = [u for (u,) in db.session.query(User.id).all()]
+        by_text = _time_query(db, """
+            SELECT category, SUM(amount_cents) FROM transactions
+            WHERE user_id = :uid AND type = 'expense' GROUP BY category
+        """, user_ids)
+        by_code = _time_query(db, """
+            SELECT category_id, SUM(amount_cents) FROM transactions
+            WHERE user_id = :uid AND type = 'expense' GROUP BY category_id
+        """, user_ids)
+
+        db.session.execute(db.text("DROP INDEX ix_bench_user_category_text"))
+        db.session.commit()
+
+    print(f"Rows: {rows}, users: {len(user_ids)}")
+    print(f"Category label bytes in rows: {text_bytes / rows:.1f} avg vs 4-8 for an integer id")
+    print(f"Index (user_id, category):    {sizes['ix_bench_user_category_text'] / 1e6:8.2f} MB")
+    print(f"Index (user_id, category_id): {sizes['ix_transactions_user_category'] / 1e6:8.2f} MB")
+    print(f"Per-user category group-by, all users: text {by_text * 1000:.1f} ms, id {by_code * 1000:.1f} ms")
+
+def bench_search(terms, per_page=50, sample=50):
+    """Latency of a ranked, paginated search, per user and term"""
+    from app import app, _filtered_transactions
+    from models import db, User
+    from search import install_search, search_backend
+
+    with app.app_context():
+        started = time.perf_counter()
+        created = install_search(db.engine)
+        if created:
+            print(f"Built {search_backend(db.engine)} index in {time.perf_counter() - started:.1f}s")
+        rows = db.session.execute(db.text("SELECT COUNT(*) FROM transactions")).scalar()
+        user_ids = [u for (u,) in db.session.query(User.id).limit(sample).all()]
+        print(f"Rows: {rows}, backend: {search_backend(db.engine)}, users sampled: {len(user_ids)}")
+
+        for term in terms:
+            timings = []
+            for uid in user_ids:
+                started = time.perf_counter()
+                page = db.paginate(_filtered_transactions(uid, {'q': term}), page=1,
+                                   per_page=per_page, error_out=False)
+                timings.append(time.perf_counter() - started)
+            timings.sort()
+            p50 = timings[len(timings) // 2] * 1000
+            p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000
+            print(f"  {term!r:16} p50 {p50:7.2f} ms  p95 {p95:7.2f} ms  (last total {page.total})")
+
+# Runs in a fresh interpreter: import cost, then the /predictions hot path
+_STARTUP_PROBE = '''
+import time, resource
+started = time.perf_counter()
+import app
+imported = time.perf_counter() - started
+rss_import = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+from utils import predict_next_month_expense
+started = time.perf_counter()
+predict_next_month_expense(['m'] * 24, [1000.0 + 50 * (i % 12) for i in range(24)])
+predicted = time.perf_counter() - started
+print(imported, rss_import, predicted, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+'''
+
+def bench_startup(runs=5):
+    """Cold-start time and peak RSS of a worker importing the app"""
+    results = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-c', _STARTUP_PROBE], check=True,
+                             capture_output=True, text=True, env=os.environ).stdout.split()
+        results.append([float(x) for x in out[-4:]])
+    imported, rss_import, predicted, rss_predict = (sorted(col)[len(col) // 2] for col in zip(*results))
+    # ru_maxrss is KiB on Linux
+    print(f"import app:       {imported * 1000:7.0f} ms, peak RSS {rss_import / 1024:6.1f} MiB (median of {runs})")
+    print(f"+ first forecast: {predicted * 1000:7.0f} ms, peak RSS {rss_predict / 1024:6.1f} MiB")
+
+# One dashboard load, per way of fetching the widgets
+WIDGET_LOADS = {
+    'sync views': ['/api/transaction_stats', '/api/category_chart'],
+    'async, sequential': ['/api/async/transaction_stats', '/api/async/category_chart',
+                          '/api/async/monthly_totals'],
+    'async, gathered': ['/api/async/dashboard'],
+}
+
+def bench_widgets(levels, loads=200):
+    """Dashboard widget loads per second for one worker process at several client concurrencies.
+
+    Each client thread drives the app through its own test client, as a
+    threaded WSGI worker would with one thread per connection.
+    """
+    from app import app
+    from models import User
+    from concurrent.futures import ThreadPoolExecutor
+
+    # Test clients carry the login in a signed session cookie
+    app.secret_key = app.secret_key or 'benchmark'
+    with app.app_context():
+        user_ids = [u for (u,) in User.query.with_entities(User.id).filter(User.role != 'admin').limit(max(levels))]
+    if not user_ids:
+        print("No users; run 'seed' first.")
+        return
+
+    def client_for(uid):
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(uid)
+            session['_fresh'] = True
+        return client
+
+    print(f"{loads} dashboard loads per run, users: {len(user_ids)}")
+    for mode, urls in WIDGET_LOADS.items():
+        # Warm up: category cache, connection pools, the async-db loop
+        warm = client_for(user_ids[0])
+        for url in urls:
+            warm.get(url)
+        for level in levels:
+            clients = [client_for(user_ids[i % len(user_ids)]) for i in range(level)]
+
+            def run(i):
+                client, timings = clients[i], []
+                for _ in range(i, loads, level):
+                    started = time.perf_counter()
+                    for url in urls:
+                        if client.get(url).status_code != 200:
+                            raise RuntimeError(f"{url} failed")
+                    timings.append(time.perf_counter() - started)
+                return timings
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=level) as pool:
+                timings = sorted(t for part in pool.map(run, range(level)) for t in part)
+            wall = time.perf_counter() - started
+            p50 = timings[len(timings) // 2] * 1000
+            p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000
+            print(f"  {mode:18} x{level:<3} {len(timings) / wall:7.1f} loads/s  "
+                  f"p50 {p50:7.1f} ms  p95 {p95:7.1f} ms")
+
+def bench_ingest(levels, rows=4000, batch=100):
+    """Sustained inserts per second: the add-transaction form vs. the batched ingestion API.
+
+    Client threads post as in bench_widgets; every run inserts `rows` new
+    transactions. The API is measured with one item per post (group commit
+    alone) and with `batch` items per post.
+    """
+    from app import app
+    from models import User
+    from ingest import ingest_queue
+    from concurrent.futures import ThreadPoolExecutor
+    import secrets
+
+    app.secret_key = app.secret_key or 'benchmark'
+    with app.app_context():
+        user_ids = [u for (u,) in User.query.with_entities(User.id).filter(User.role != 'admin').limit(max(levels))]
+    if not user_ids:
+        print("No users; run 'seed' first.")
+        return
+    run_id = secrets.token_hex(4)
+    today = date.today().isoformat()
+
+    def client_for(uid):
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(uid)
+            session['_fresh'] = True
+        return client
+
+    def post_form(client, n, tag):
+        for i in range(n):
+            response = client.post('/transactions/add', data={
+                'type': 'expense', 'amount': '12.34', 'category': 'Food', 'note': tag, 'date': today})
+            if response.status_code != 302:
+                raise RuntimeError("form post failed")
+
+    def post_batches(size):
+        def post(client, n, tag):
+            for start in range(0, n, size):
+                items = [{'key': f'{tag}-{i}', 'amount': '12.34', 'category': 'Food', 'note': tag, 'date': today}
+                         for i in range(start, min(n, start + size))]
+                response = client.post('/api/transactions/batch', json=items)
+                if response.status_code != 200 or response.get_json()['counts'].get('created') != len(items):
+                    raise RuntimeError(f"ingestion post failed: {response.status_code} {response.get_data(as_text=True)[:300]}")
+        return post
+
+    modes = {'form': post_form, 'api, 1 per post': post_batches(1), f'api, {batch} per post': post_batches(batch)}
+    print(f"{rows} rows per run, users: {len(user_ids)}")
+    for mode, post in modes.items():
+        for level in levels:
+            clients = [client_for(user_ids[i % len(user_ids)]) for i in range(level)]
+            shares = [rows // level + (i < rows % level) for i in range(level)]
+            before = ingest_queue.stats()
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=level) as pool:
+                list(pool.map(lambda i: post(clients[i], shares[i], f'bench-{run_id}-{mode}-{level}-{i}'),
+                              range(level)))
+            wall = time.perf_counter() - started
+            after = ingest_queue.stats()
+            commits = after['commits'] - before['commits']
+            per_commit = f"  {rows / commits:6.1f} rows/commit" if commits else ""
+            print(f"  {mode:18} x{level:<3} {rows / wall:8.1f} rows/s{per_commit}")
+
+def bench_simulate(path_counts, horizon=120, goal_months=24):
+    """Monte Carlo savings-goal paths per second, for one user and for every user at once.
+
+    Seeded users have no goals, so each is given a target of `goal_months`
+    of their average monthly income; simulation cost does not depend on it.
+    """
+    from app import app
+    import numpy as np
+    import simulation
+
+    with app.app_context():
+        started = time.perf_counter()
+        ids, net, lengths = simulation.load_monthly_net()
+        loaded = time.perf_counter() - started
+    keep = lengths >= simulation.MIN_HISTORY_MONTHS
+    ids, net, lengths = ids[keep], net[keep], lengths[keep]
+    if not len(ids):
+        print("No users with enough history; run 'seed' first.")
+        return
+    remaining = np.maximum(np.abs(net).sum(axis=1) // np.maximum(lengths, 1), 1) * goal_months
+    rng = np.random.default_rng(0)
+    print(f"{len(ids)} users, history loaded in {loaded * 1000:.0f} ms, horizon {horizon} months")
+
+    # One user, the longest history: what the endpoint does, without its deadline
+    top = int(lengths.argmax())
+    one = slice(top, top + 1)
+    block = simulation._block_for(int(lengths[top]))
+    for paths in path_counts:
+        chunk = max(1, simulation.SIM_BLOCK_ELEMENTS // horizon)
+        best = float('inf')
+        for _ in range(3):
+            started = time.perf_counter()
+            for lo in range(0, paths, chunk):
+                simulation.simulate_months(net[one], lengths[one], remaining[one], min(chunk, paths - lo),
+                                           horizon, rng, block)
+            best = min(best, time.perf_counter() - started)
+        print(f"  1 user  {paths:>7} paths {best * 1000:8.1f} ms  {paths / best:12,.0f} paths/s")
+
+    # Batch mode: every user, simulation.BATCH_PATHS paths each
+    paths = simulation.BATCH_PATHS
+    per_pass = max(1, simulation.SIM_BLOCK_ELEMENTS // (paths * horizon))
+    started = time.perf_counter()
+    for block in (1, simulation.BLOCK_MONTHS):
+        group = np.flatnonzero([simulation._block_for(int(n)) == block for n in lengths])
+        for lo in range(0, len(group), per_pass):
+            rows = group[lo:lo + per_pass]
+            simulation.simulate_months(net[rows], lengths[rows], remaining[rows], paths, horizon, rng, block)
+    wall = time.perf_counter() - started
+    print(f"  batch   {len(ids)} users x {paths} paths {wall * 1000:8.1f} ms  "
+          f"{len(ids) * paths / wall:12,.0f} paths/s")
+
+def main():
+    parser = argparse.ArgumentParser(description="TrackFlow benchmarks")
+    parser.add_argument('--database', default=os.getenv('BENCH_DATABASE_URL', DEFAULT_DATABASE),
+                        help="Database URL to seed and measure (never your real one)")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_seed = sub.add_parser('seed', help="Insert synthetic users and transactions")
+    p_seed.add_argument('--users', type=int, default=200)
+    p_seed.add_argument('--per-user', type=int, default=5000)
+    sub.add_parser('categories', help="Category label vs. dictionary id")
+    p_search = sub.add_parser('search', help="Ranked full-text search latency")
+    p_search.add_argument('--terms', nargs='+', default=['uber', 'netflix', 'coffee shop', 'bill'])
+    sub.add_parser('startup', help="Worker cold start and memory")
+    p_widgets = sub.add_parser('widgets', help="Dashboard widget throughput, sync vs. async views")
+    p_widgets.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 64])
+    p_widgets.add_argument('--loads', type=int, default=200)
+    p_ingest = sub.add_parser('ingest', help="Insert rate, form posts vs. the batched ingestion API")
+    p_ingest.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    p_ingest.add_argument('--rows', type=int, default=4000)
+    p_ingest.add_argument('--batch', type=int, default=100)
+    p_simulate = sub.add_parser('simulate', help="Savings-goal simulation paths per second")
+    p_simulate.add_argument('--paths', type=int, nargs='+', default=[1000, 10000, 100000])
+    p_simulate.add_argument('--months', type=int, default=120)
+    args = parser.parse_args()
+
+    # Must be set before config/app are imported
+    os.environ['DATABASE_URL'] = args.database
+
+    print("TrackFlow Benchmarks")
+    print("=" * 50)
+    print("Database URL:", args.database)
+
+    if args.command == 'seed':
+        seed(args.users, args.per_user)
+    elif args.command == 'categories':
+        bench_categories()
+    elif args.command == 'search':
+        bench_search(args.terms)
+    elif args.command == 'startup':
+        bench_startup()
+    elif args.command == 'widgets':
+        bench_widgets(args.concurrency, args.loads)
+    elif args.command == 'ingest':
+        bench_ingest(args.concurrency, args.rows, args.batch)
+    elif args.command == 'simulate':
+        bench_simulate(args.paths, args.months)
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(1)
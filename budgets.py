@@ -0,0 +1,192 @@
+from models import db, User, Transaction, Budget, Category
+from categories import resolve_category
+from events import transaction_changes
+from fx import base_currency, convert, to_owner_currencies
+from money import from_cents
+from sqlalchemy import select, update, delete, func, and_, event
+from sqlalchemy.orm import Session
+from datetime import date
+import numpy as np
+
+# Monthly per-category budgets. Each budget stores what its current month has
+# spent so far; every flushed transaction write moves the budgets it touches
+# by the written amount, one indexed UPDATE per (user, category, month), so
+# the month is never re-summed on the write path. recompute_budgets() is the
+# batch mode: it re-sums whole months in two grouped queries for any number
+# of users, at month rollover (budget_status() runs it lazily for a user
+# whose budgets still point at an older month) and after bulk edits that
+# bypass the ORM.
+
+# Share of the limit, in percent, at which a new budget starts warning
+DEFAULT_ALERT_PERCENT = 80
+
+
+def month_bounds(today: date):
+    start = today.replace(day=1)
+    return start, date(start.year + start.month // 12, start.month % 12 + 1, 1)
+
+
+def _status(spent: int, limit: int, alert_percent: int) -> str:
+    if spent > limit:
+        return 'over'
+    if spent * 100 >= limit * alert_percent:
+        return 'warning'
+    return 'ok'
+
+
+def _spending_deltas(session) -> dict:
+    # {(user_id, category_id, month start): cents in the owner's base currency}
+    rows = [(values, sign) for old, new in transaction_changes(session)
+            for values, sign in ((old, -1), (new, 1))
+            if values is not None and values['type'] == 'expense' and values['category_id'] is not None]
+    if not rows:
+        return {}
+    bases = [base_currency(values['user_id']) for values, _ in rows]
+    cents = [sign * values['amount_cents'] for values, sign in rows]
+    if any(values['currency'] != base for (values, _), base in zip(rows, bases)):
+        cents = convert(cents, [values['date'] for values, _ in rows],
+                        [values['currency'] for values, _ in rows], bases).tolist()
+    deltas = {}
+    for (values, _), amount in zip(rows, cents):
+        key = (values['user_id'], values['category_id'], values['date'].replace(day=1))
+        deltas[key] = deltas.get(key, 0) + amount
+    return deltas
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_spending(session, flush_context):
+    deltas = _spending_deltas(session)
+    if not deltas:
+        return
+    conn = session.connection()
+    for (user_id, category_id, period), cents in deltas.items():
+        if not cents:
+            continue
+        # Matches nothing unless the budget exists and is on that month
+        row = conn.execute(update(Budget).where(
+            Budget.user_id == user_id, Budget.category_id == category_id, Budget.period == period
+        ).values(spent_cents=Budget.spent_cents + cents).returning(
+            Budget.category_id, Budget.spent_cents, Budget.limit_cents, Budget.alert_percent
+        )).first()
+        if row is None:
+            continue
+        before = _status(row.spent_cents - cents, row.limit_cents, row.alert_percent)
+        after = _status(row.spent_cents, row.limit_cents, row.alert_percent)
+        if after != before and after != 'ok':
+            session.info.setdefault('budget_alerts', []).append(
+                (user_id, row.category_id, after, row.spent_cents, row.limit_cents))
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_alerts(session):
+    if session.in_nested_transaction():
+        return
+    session.info.pop('budget_alerts', None)
+
+
+def pop_budget_alerts(user_id: int) -> list:
+    """Messages for user_id's budgets that crossed their warning or limit in this session."""
+    alerts = db.session.info.pop('budget_alerts', [])
+    mine = [a for a in alerts if a[0] == user_id]
+    names = dict(db.session.execute(
+        select(Category.id, Category.name).where(Category.id.in_({a[1] for a in mine}))
+    ).all()) if mine else {}
+    messages = []
+    for _, category_id, status, spent, limit in mine:
+        percent = spent * 100 // limit if limit else 100
+        if status == 'over':
+            messages.append(f"You are over your {names.get(category_id)} budget this month "
+                            f"({from_cents(spent):.2f} of {from_cents(limit):.2f}).")
+        else:
+            messages.append(f"You have used {percent}% of your {names.get(category_id)} budget this month.")
+    return messages
+
+
+def recompute_budgets(user_ids=None, today: date = None) -> int:
+    """Re-sum the current month into every budget (of `user_ids`, all users for None).
+
+    Moves each budget onto this month and commits; returns the number of
+    budgets updated.
+    """
+    start, end = month_bounds(today or date.today())
+    scope = [] if user_ids is None else [Budget.user_id.in_(list(user_ids))]
+    ids = db.session.execute(select(Budget.id).where(*scope)).scalars().all()
+    if not ids:
+        return 0
+
+    spending = select(Budget.id).join(Transaction, and_(
+        Transaction.user_id == Budget.user_id, Transaction.category_id == Budget.category_id
+    )).join(User, User.id == Budget.user_id).where(
+        *scope, Transaction.type == 'expense', Transaction.date >= start, Transaction.date < end
+    )
+    spent = dict.fromkeys(ids, 0)
+    # In the owner's base currency already: summed by the database
+    for budget_id, cents in db.session.execute(spending.add_columns(func.sum(Transaction.amount_cents)).where(
+        Transaction.currency == User.base_currency
+    ).group_by(Budget.id)):
+        spent[budget_id] += int(cents)
+    # Anything else: summed per day and converted in one pass
+    other = db.session.execute(spending.add_columns(
+        Budget.user_id, Transaction.currency, Transaction.date, func.sum(Transaction.amount_cents)
+    ).where(Transaction.currency != User.base_currency).group_by(
+        Budget.id, Budget.user_id, Transaction.currency, Transaction.date
+    )).all()
+    if other:
+        budget_ids, owners, currencies, days, cents = zip(*other)
+        converted = to_owner_currencies(np.array(cents, dtype=np.int64), days, np.array(currencies, dtype='U3'),
+                                        np.array(owners))
+        for budget_id, amount in zip(budget_ids, converted.tolist()):
+            spent[budget_id] += amount
+
+    db.session.execute(update(Budget), [
+        {'id': budget_id, 'spent_cents': cents, 'period': start} for budget_id, cents in spent.items()
+    ])
+    db.session.commit()
+    return len(spent)
+
+
+def budget_status(user_id: int, today: date = None) -> list:
+    """Every budget of a user with this month's spending, largest share of limit first."""
+    start, _ = month_bounds(today or date.today())
+    stmt = select(
+        Budget.id, Category.name, Budget.limit_cents, Budget.spent_cents, Budget.alert_percent, Budget.period
+    ).join(Category, Category.id == Budget.category_id).where(Budget.user_id == user_id)
+    rows = db.session.execute(stmt).all()
+    if any(r.period != start for r in rows):
+        # First look this month: roll the user's budgets over, then read again
+        recompute_budgets([user_id], today)
+        rows = db.session.execute(stmt).all()
+
+    budgets = [{
+        'id': r.id,
+        'category': r.name,
+        'limit': from_cents(r.limit_cents),
+        'spent': from_cents(r.spent_cents),
+        'remaining': from_cents(r.limit_cents - r.spent_cents),
+        'percent': round(r.spent_cents * 100 / r.limit_cents, 1) if r.limit_cents else 0.0,
+        'alert_percent': r.alert_percent,
+        'status': _status(r.spent_cents, r.limit_cents, r.alert_percent),
+    } for r in rows]
+    budgets.sort(key=lambda b: -b['percent'])
+    return budgets
+
+
+def set_budget(user_id: int, category: str, limit_cents: int, alert_percent: int = DEFAULT_ALERT_PERCENT):
+    """Create or change the user's budget for a category; its spending is summed once on creation."""
+    category_id, _ = resolve_category(category)
+    budget = Budget.query.filter_by(user_id=user_id, category_id=category_id).first()
+    if budget is None:
+        budget = Budget(user_id=user_id, category_id=category_id, period=date(1970, 1, 1))
+        db.session.add(budget)
+    budget.limit_cents = limit_cents
+    budget.alert_percent = alert_percent
+    db.session.commit()
+    if budget.period != month_bounds(date.today())[0]:
+        recompute_budgets([user_id])
+    return budget
+
+
+def delete_budget(user_id: int, budget_id: int) -> int:
+    result = db.session.execute(delete(Budget).where(Budget.id == budget_id, Budget.user_id == user_id))
+    db.session.commit()
+    return result.rowcount
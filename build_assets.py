@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+TrackFlow Asset Builder
+Compiles, vendors and fingerprints the static files pages load
+
+  1. Tailwind: only the classes used in templates/*.html (and static/js) are
+     compiled, minified, into static/css/tailwind.css by the Tailwind CLI
+     (a `tailwindcss` binary on PATH, or `npx tailwindcss@TAILWIND_VERSION`).
+  2. Vendoring: Chart.js and the Inter / Fira Code fonts are downloaded once
+     into static/vendor/. Commit that directory; later builds run offline.
+  3. Fingerprinting: every file under static/ is copied to static/dist/ with
+     a content hash in its name (url() references inside CSS are rewritten
+     to match) and static/dist/manifest.json maps the plain names to them.
+     The app serves these under /assets/ with an immutable Cache-Control.
+
+Run after changing templates or static files, and restart the app.
+
+Usage:
+    python build_assets.py              # all three steps
+    python build_assets.py --no-css     # keep the current static/css/tailwind.css
+    python build_assets.py --refresh    # download vendored files again
+"""
+
+import os
+import re
+import sys
+import json
+import shutil
+import hashlib
+import argparse
+import subprocess
+import tempfile
+import urllib.request
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(ROOT, 'static')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+VENDOR_DIR = os.path.join(STATIC_DIR, 'vendor')
+TAILWIND_CONFIG = os.path.join('static', 'js', 'tailwind.config.js')
+TAILWIND_OUTPUT = os.path.join(STATIC_DIR, 'css', 'tailwind.css')
+
+# Version npx installs when no tailwindcss binary is on PATH (v3, as the CDN runtime was)
+TAILWIND_VERSION = '3.4.10'
+# Stylesheet the CLI compiles
+TAILWIND_INPUT = "@tailwind base;\n@tailwind components;\n@tailwind utilities;\n"
+CHART_JS_URL = 'https://cdn.jsdelivr.net/npm/chart.js@4.4.1/dist/chart.umd.min.js'
+FONTS_URL = ('https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700;800;900'
+             '&family=Fira+Code:wght@300;400;500;600;700&display=swap')
+# Google Fonts subsets worth shipping; pages are English with ₹/€/£ amounts
+FONT_SUBSETS = ('latin', 'latin-ext')
+# Google Fonts serves woff2 only to browsers it recognises
+FONT_USER_AGENT = ('Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 '
+                   '(KHTML, like Gecko) Chrome/124.0 Safari/537.36')
+# Hex digits of the content hash kept in fingerprinted names
+HASH_LENGTH = 10
+
+CSS_URL = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+
+
+def compile_tailwind():
+    """Minified static/css/tailwind.css with only the classes the templates use"""
+    cli = shutil.which('tailwindcss')
+    if not cli and not shutil.which('npx'):
+        raise OSError("Tailwind CLI not found: install Node.js (for npx) or put a tailwindcss binary on PATH")
+    command = [cli] if cli else ['npx', '--yes', f'tailwindcss@{TAILWIND_VERSION}']
+    with tempfile.NamedTemporaryFile('w', suffix='.css', delete=False) as f:
+        f.write(TAILWIND_INPUT)
+    try:
+        subprocess.run(command + ['-c', TAILWIND_CONFIG, '-i', f.name, '-o', TAILWIND_OUTPUT, '--minify'],
+                       cwd=ROOT, check=True)
+    finally:
+        os.unlink(f.name)
+    print(f"  css/tailwind.css: {os.path.getsize(TAILWIND_OUTPUT) // 1024} KiB")
+
+
+def _download(url, headers=None):
+    request = urllib.request.Request(url, headers=headers or {})
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return response.read()
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def vendor_chart_js(refresh=False):
+    path = os.path.join(VENDOR_DIR, 'chart.umd.min.js')
+    if os.path.exists(path) and not refresh:
+        print("  vendor/chart.umd.min.js: present")
+        return
+    _write(path, _download(CHART_JS_URL))
+    print(f"  vendor/chart.umd.min.js: downloaded from {CHART_JS_URL}")
+
+
+def vendor_fonts(refresh=False):
+    """static/vendor/fonts/fonts.css and the woff2 files it points at"""
+    css_path = os.path.join(VENDOR_DIR, 'fonts', 'fonts.css')
+    if os.path.exists(css_path) and not refresh:
+        print("  vendor/fonts/fonts.css: present")
+        return
+    css = _download(FONTS_URL, {'User-Agent': FONT_USER_AGENT}).decode()
+
+    faces, files = [], {}
+    # Google's stylesheet is a "/* subset */ @font-face {...}" block per family, weight and subset
+    for subset, face in re.findall(r'/\*\s*([\w-]+)\s*\*/\s*(@font-face\s*\{[^}]*\})', css):
+        if subset not in FONT_SUBSETS:
+            continue
+        url = CSS_URL.search(face).group(2)
+        if url not in files:
+            # Variable fonts repeat one file for every weight
+            family = re.search(r"font-family:\s*'([^']+)'", face).group(1)
+            files[url] = f"{family.lower().replace(' ', '-')}-{subset}-{len(files)}.woff2"
+        faces.append(face.replace(url, files[url]))
+
+    for url, name in files.items():
+        _write(os.path.join(VENDOR_DIR, 'fonts', name), _download(url))
+    _write(css_path, ('\n'.join(faces) + '\n').encode())
+    print(f"  vendor/fonts: {len(faces)} font faces, {len(files)} files")
+
+
+def _fingerprinted(name, data):
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:HASH_LENGTH]}{ext}"
+
+
+def _rewrite_css(name, css, manifest):
+    # Point relative url()s at the fingerprinted copies of what they reference
+    base = os.path.dirname(name)
+
+    def replace(match):
+        quote, target = match.groups()
+        if re.match(r'^(?:[a-z]+:|/|#)', target):
+            return match.group(0)
+        path, suffix = re.match(r'([^?#]*)(.*)', target).groups()
+        logical = os.path.normpath(os.path.join(base, path)).replace(os.sep, '/')
+        if logical not in manifest:
+            return match.group(0)
+        hashed = os.path.relpath(manifest[logical], base or '.').replace(os.sep, '/')
+        return f"url({quote}{hashed}{suffix}{quote})"
+
+    return CSS_URL.sub(replace, css)
+
+
+def fingerprint(static_dir=STATIC_DIR, dist_dir=DIST_DIR):
+    """Copy static files into dist_dir under content-hashed names; returns the manifest"""
+    names = []
+    for folder, dirs, files in os.walk(static_dir):
+        # Never fingerprint the previous build
+        dirs[:] = [d for d in dirs if os.path.join(folder, d) != dist_dir]
+        names.extend(os.path.relpath(os.path.join(folder, f), static_dir).replace(os.sep, '/') for f in files)
+
+    shutil.rmtree(dist_dir, ignore_errors=True)
+    manifest = {}
+    # Stylesheets last, so what they reference already has its final name
+    for name in sorted(names, key=lambda n: (n.endswith('.css'), n)):
+        with open(os.path.join(static_dir, name), 'rb') as f:
+            data = f.read()
+        if name.endswith('.css'):
+            data = _rewrite_css(name, data.decode(), manifest).encode()
+        manifest[name] = _fingerprinted(name, data)
+        _write(os.path.join(dist_dir, manifest[name]), data)
+
+    with open(os.path.join(dist_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description="Compile, vendor and fingerprint static assets")
+    parser.add_argument('--no-css', action='store_true', help="skip the Tailwind CLI")
+    parser.add_argument('--refresh', action='store_true', help="download vendored files again")
+    args = parser.parse_args()
+
+    print("TrackFlow Asset Builder")
+    print("=" * 50)
+
+    try:
+        if not args.no_css:
+            print("Compiling Tailwind CSS...")
+            compile_tailwind()
+        print("Vendoring Chart.js and fonts...")
+        vendor_chart_js(args.refresh)
+        vendor_fonts(args.refresh)
+        print("Fingerprinting...")
+        manifest = fingerprint()
+        print(f"\nWrote {len(manifest)} file(s) and manifest.json to static/dist. Restart the app to serve them.")
+
+    except subprocess.CalledProcessError as e:
+        print(f"Tailwind CLI failed with exit status {e.returncode}")
+        sys.exit(1)
+    except OSError as e:
+        print(f"Could not build assets: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
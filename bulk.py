@@ -0,0 +1,107 @@
+from models import db, User, Transaction, Goal
+from categories import resolve_category, lookup_category
+from principal import forget_users
+from outbox import record_rows
+from sqlalchemy import select, update, delete, and_, or_, false
+
+# Rows touched per statement (and per commit) on large tables
+BULK_CHUNK_SIZE = 5000
+
+
+def _chunked(model, condition, make_statement, chunk_size: int, log=None) -> int:
+    # Walk the primary key in windows of chunk_size matching rows so every
+    # statement stays short, whether or not it changes what `condition` matches.
+    pk = model.id
+    last_id = 0
+    affected = 0
+    while True:
+        boundary = db.session.execute(
+            select(pk).where(condition, pk > last_id).order_by(pk).offset(chunk_size - 1).limit(1)
+        ).scalar()
+        window = pk > last_id if boundary is None else and_(pk > last_id, pk <= boundary)
+        if log is not None:
+            # Into the change log, committed with the chunk
+            log(and_(condition, window))
+        result = db.session.execute(
+            make_statement(and_(condition, window)),
+            execution_options={'synchronize_session': False}
+        )
+        db.session.commit()
+        affected += result.rowcount
+        if boundary is None:
+            return affected
+        last_id = boundary
+
+
+def chunked_delete(model, condition, chunk_size: int = BULK_CHUNK_SIZE, log: bool = False) -> int:
+    return _chunked(model, condition, lambda where: delete(model).where(where), chunk_size,
+                    (lambda where: record_rows(model, where, 'delete')) if log else None)
+
+
+def chunked_update(model, condition, values: dict, chunk_size: int = BULK_CHUNK_SIZE, log: bool = False) -> int:
+    return _chunked(model, condition, lambda where: update(model).where(where).values(**values), chunk_size,
+                    (lambda where: record_rows(model, where, 'update', values)) if log else None)
+
+
+def _like_pattern(text: str) -> str:
+    escaped = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+
+def transaction_filter(user_id=None, ttype=None, category=None, start=None, end=None):
+    """Build a WHERE clause from the admin filter form; None when nothing was given."""
+    clauses = []
+    if user_id is not None:
+        clauses.append(Transaction.user_id == user_id)
+    if ttype:
+        clauses.append(Transaction.type == ttype)
+    if category:
+        found = lookup_category(category)
+        clauses.append(Transaction.category_id == found[0] if found else false())
+    if start:
+        clauses.append(Transaction.date >= start)
+    if end:
+        clauses.append(Transaction.date <= end)
+    return and_(*clauses) if clauses else None
+
+
+def delete_transactions(condition) -> int:
+    return chunked_delete(Transaction, condition, log=True)
+
+
+def recategorize_transactions(pattern: str, new_category: str, user_id=None) -> int:
+    # Case-insensitive substring match against the note or the current category
+    like = _like_pattern(pattern)
+    category_id, name = resolve_category(new_category)
+    condition = and_(
+        or_(Transaction.note.ilike(like, escape='\\'), Transaction.category.ilike(like, escape='\\')),
+        or_(Transaction.category_id != category_id, Transaction.category_id.is_(None))
+    )
+    if user_id is not None:
+        condition = and_(condition, Transaction.user_id == user_id)
+    return chunked_update(Transaction, condition, {'category': name, 'category_id': category_id}, log=True)
+
+
+def set_user_roles(user_ids, role: str, exclude_id=None) -> int:
+    ids = [i for i in user_ids if i != exclude_id]
+    if not ids:
+        return 0
+    result = db.session.execute(
+        update(User).where(User.id.in_(ids), User.role != role).values(role=role),
+        execution_options={'synchronize_session': False}
+    )
+    db.session.commit()
+    forget_users(ids)
+    return result.rowcount
+
+
+def delete_goals(goal_ids) -> int:
+    if not goal_ids:
+        return 0
+    record_rows(Goal, Goal.id.in_(goal_ids), 'delete')
+    result = db.session.execute(
+        delete(Goal).where(Goal.id.in_(goal_ids)),
+        execution_options={'synchronize_session': False}
+    )
+    db.session.commit()
+    return result.rowcount
@@ -0,0 +1,78 @@
+from models import db, Category
+from sqlalchemy import select, event
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
+
+# Committed category rows are never renamed or deleted, so lookups are cached
+# per process. Rows created in a still-open transaction live in session.info
+# until it commits.
+_by_key = {}
+_by_id = {}
+
+
+def normalize_category(raw) -> str:
+    # Collapse whitespace; case is normalized through the dictionary key
+    return ' '.join((raw or '').split())[:50] or 'Other'
+
+
+def category_key(raw) -> str:
+    return normalize_category(raw).casefold()
+
+
+def _remember(category_id: int, key: str, name: str):
+    _by_key[key] = (category_id, name)
+    _by_id[category_id] = name
+    return category_id, name
+
+
+@event.listens_for(Session, 'after_commit')
+def _promote_new_categories(session):
+    for key, (category_id, name) in session.info.pop('new_categories', {}).items():
+        _remember(category_id, key, name)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_new_categories(session):
+    session.info.pop('new_categories', None)
+
+
+def lookup_category(raw):
+    """(id, name) for an existing category label, or None."""
+    key = category_key(raw)
+    if key in _by_key:
+        return _by_key[key]
+    pending = db.session.info.get('new_categories', {})
+    if key in pending:
+        return pending[key]
+    row = db.session.execute(select(Category.id, Category.name).where(Category.key == key)).first()
+    return _remember(row.id, key, row.name) if row else None
+
+
+def resolve_category(raw):
+    """(id, name) for a category label, creating the dictionary entry if needed."""
+    found = lookup_category(raw)
+    if found:
+        return found
+    name = normalize_category(raw)
+    key = name.casefold()
+    try:
+        with db.session.begin_nested():
+            category = Category(key=key, name=name)
+            db.session.add(category)
+    except IntegrityError:
+        # Another writer created it first
+        return lookup_category(raw)
+    db.session.info.setdefault('new_categories', {})[key] = (category.id, name)
+    return category.id, name
+
+
+def category_names(ids) -> dict:
+    """{id: name} for the given category ids."""
+    pending = {cid: name for cid, name in db.session.info.get('new_categories', {}).values()}
+    missing = [i for i in set(ids) if i is not None and i not in _by_id and i not in pending]
+    if missing:
+        for row in db.session.execute(
+            select(Category.id, Category.name).where(Category.id.in_(missing))
+        ):
+            _by_id[row.id] = row.name
+    return {i: pending.get(i) or _by_id.get(i, 'Other') for i in ids}
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+TrackFlow Change Feed
+Reads and maintains the change log of transaction, goal and user writes
+
+Consumers keep their place in the change_checkpoints table; `tail` prints a
+consumer's new changes as JSON lines and advances its checkpoint, so a
+pipeline can be fed with e.g. `python change_feed.py tail --consumer sync`.
+Derived stores inside the app use outbox.consume() directly.
+
+Usage:
+    python change_feed.py status                       # consumers and how far behind they are
+    python change_feed.py tail --consumer NAME         # print NAME's new changes, advance its checkpoint
+    python change_feed.py tail --consumer NAME --follow
+    python change_feed.py prune --keep-days 30         # drop changes every consumer has passed
+"""
+
+import sys
+import json
+import time
+import argparse
+
+from sqlalchemy.exc import SQLAlchemyError
+
+# Seconds between polls with --follow
+POLL_INTERVAL = 1
+
+def show_status(db):
+    """Print each consumer's checkpoint and the changes after it"""
+    from sqlalchemy import select, func
+    from models import ChangeLog, ChangeCheckpoint
+
+    last = db.session.execute(select(func.max(ChangeLog.id))).scalar() or 0
+    print(f"Last change: #{last}")
+    for name, position in db.session.execute(select(ChangeCheckpoint.consumer, ChangeCheckpoint.position)):
+        print(f"  {name}: at #{position}, {last - position} behind")
+
+def tail(consumer, follow):
+    """Print `consumer`'s changes as JSON lines until caught up (or forever with follow)"""
+    from outbox import consume
+
+    def emit(changes):
+        for change in changes:
+            print(json.dumps(change))
+        sys.stdout.flush()
+
+    while True:
+        if not consume(consumer, emit) and not follow:
+            return
+        if follow:
+            time.sleep(POLL_INTERVAL)
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description="Read and prune the change log")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('status', help="consumers and their lag")
+    p_tail = sub.add_parser('tail', help="print a consumer's new changes as JSON lines")
+    p_tail.add_argument('--consumer', required=True)
+    p_tail.add_argument('--follow', action='store_true', help="keep polling for new changes")
+    p_prune = sub.add_parser('prune', help="delete old changes every consumer has processed")
+    p_prune.add_argument('--keep-days', type=int, default=30)
+    args = parser.parse_args()
+
+    from app import app
+    from models import db
+
+    try:
+        with app.app_context():
+            if args.command == 'status':
+                show_status(db)
+            elif args.command == 'tail':
+                tail(args.consumer, args.follow)
+            else:
+                from outbox import prune_changes
+                removed = prune_changes(args.keep_days)
+                print(f"Deleted {removed} change(s)")
+    except SQLAlchemyError as e:
+        print(f"Database error: {e}", file=sys.stderr)
+        sys.exit(1)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
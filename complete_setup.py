@@ -42,9 +42,10 @@ def check_and_install_dependencies():
         'sqlalchemy',
         'flask-login',
         'psycopg2-binary',
+        'asgiref',
+        'aiosqlite',
+        'asyncpg',
         'python-dotenv',
-        'scikit-learn',
-        'pandas',
         'numpy',
         'werkzeug'
     ]
@@ -107,7 +108,7 @@ def setup_database():
     """Set up database schema"""
     print("\nSetting up database...")
     
-    if not run_script("fix_database.py", "Database schema fix"):
+    if not run_script("migrate.py", "Database schema migration"):
         print("Database fix failed, but continuing...")
         return False
     
@@ -182,7 +183,7 @@ def print_final_instructions():
     print("\nIf you encounter any issues:")
     print("  1. Check the error messages above")
     print("  2. Run individual scripts manually:")
-    print("     python fix_database.py")
+    print("     python migrate.py")
     print("     python create_admin.py")
     print("     python check_users.py")
     print("  3. Check your database connection")
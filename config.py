@@ -7,3 +7,31 @@ class Config:
     SECRET_KEY = os.getenv("SECRET_KEY", "dev-secret")
     SQLALCHEMY_DATABASE_URI = os.getenv("DATABASE_URL", "sqlite:///trackflow.db")
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Users with more transactions than this are deleted in the background, in chunks
+    PURGE_ASYNC_THRESHOLD = int(os.getenv("PURGE_ASYNC_THRESHOLD", "50000"))
+    PURGE_CHUNK_SIZE = int(os.getenv("PURGE_CHUNK_SIZE", "5000"))
+    TRANSACTIONS_PER_PAGE = int(os.getenv("TRANSACTIONS_PER_PAGE", "50"))
+    # Send per-widget Server-Timing headers on dashboard responses (always on in debug)
+    SERVER_TIMING = os.getenv("SERVER_TIMING", "0") == "1"
+    # redis:// URL relaying live dashboard updates between workers (optional)
+    EVENT_BROKER_URL = os.getenv("EVENT_BROKER_URL", "")
+    # Live dashboard streams per worker process, each holding a thread (keep below the thread count)
+    DASHBOARD_STREAMS = int(os.getenv("DASHBOARD_STREAMS", "16"))
+    # Password checks run on this many threads per process, with this many more waiting (the rest get 503)
+    LOGIN_HASH_WORKERS = int(os.getenv("LOGIN_HASH_WORKERS", "2"))
+    LOGIN_HASH_QUEUE = int(os.getenv("LOGIN_HASH_QUEUE", "16"))
+    # redis:// URL sharing the per-IP and per-account login throttles between workers (optional)
+    LOGIN_THROTTLE_URL = os.getenv("LOGIN_THROTTLE_URL", "")
+    # Partition transactions by 'month' or 'year' on Postgres (applied by migrate.py; empty: unpartitioned)
+    TRANSACTION_PARTITIONS = os.getenv("TRANSACTION_PARTITIONS", "")
+    # Database closed years of transactions are moved to, leaving monthly rollups behind (optional)
+    ARCHIVE_DATABASE_URL = os.getenv("ARCHIVE_DATABASE_URL", "")
+    # Calendar years kept in the main database, the current one included
+    ARCHIVE_KEEP_YEARS = int(os.getenv("ARCHIVE_KEEP_YEARS", "2"))
+    # Ingestion API group commit: rows per commit, and how long the first queued row waits for more
+    INGEST_BATCH_ROWS = int(os.getenv("INGEST_BATCH_ROWS", "500"))
+    INGEST_FLUSH_MS = int(os.getenv("INGEST_FLUSH_MS", "10"))
+    # Rows waiting per process before further ingestion posts are refused with 503
+    INGEST_QUEUE_ROWS = int(os.getenv("INGEST_QUEUE_ROWS", "20000"))
+    # Milliseconds a savings-goal simulation may take; it runs fewer paths rather than overrun
+    SIMULATION_BUDGET_MS = int(os.getenv("SIMULATION_BUDGET_MS", "250"))
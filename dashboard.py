@@ -0,0 +1,215 @@
+from models import db, Transaction, TransactionRollup
+from categories import category_names
+from money import from_cents
+from utils import predict_next_month_expense
+from events import hub
+from fx import grouped_totals, base_currency, convert
+from archive import add_rollups
+from sqlalchemy import select, func
+from contextlib import contextmanager
+from datetime import date
+import json
+import queue
+import time
+
+# Everything the dashboard shows, derived from one grouped read of the
+# user's transactions: the month cards, the trend chart, the category list
+# and the forecast come from the same snapshot, so they can never disagree,
+# and each widget is a pass over a few hundred (month, type, category) sums
+# instead of its own query. Open streams keep those sums in memory and fold
+# committed changes into them, so live updates never go back to the database.
+
+# Seconds between keep-alive comments on an idle stream
+KEEPALIVE_SECONDS = 15
+
+
+@contextmanager
+def _timed(timings: list, name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.append((name, time.perf_counter() - started))
+
+
+def server_timing(timings) -> str:
+    """Server-Timing header value for [(name, seconds), ...]."""
+    return ', '.join(f'{name};dur={seconds * 1000:.2f}' for name, seconds in timings)
+
+
+def _month_key(column=Transaction.date):
+    # 'YYYY-MM' in a single expression per row; extract() costs two casts on SQLite
+    if db.engine.dialect.name == 'sqlite':
+        return func.strftime('%Y-%m', column)
+    return func.to_char(column, 'YYYY-MM')
+
+
+def load_groups(user_id: int) -> dict:
+    """{(month, type, category_id): [cents, count]} over all of a user's transactions, in their base currency."""
+    groups = grouped_totals(select(Transaction).where(Transaction.user_id == user_id),
+                            [_month_key().label('month'), Transaction.type, Transaction.category_id],
+                            user_id)
+    # Archived years count through their monthly rollups
+    return add_rollups(groups, user_id, [_month_key(TransactionRollup.month).label('month'),
+                                         TransactionRollup.type, TransactionRollup.category_id])
+
+
+def in_base_currency(changes, base: str) -> list:
+    """(month, type, category_id, cents, count) deltas from events, converted to `base` at their own day's rate."""
+    if all(c[5] == base for c in changes):
+        return [c[:5] for c in changes]
+    cents = convert([c[3] for c in changes], [c[6] for c in changes], [c[5] for c in changes], base)
+    return [[month, kind, cid, amount, count]
+            for (month, kind, cid, _, count, *_), amount in zip(changes, cents.tolist())]
+
+
+def apply_changes(groups: dict, changes) -> set:
+    """Fold (month, type, category_id, cents, count) deltas into `groups`; returns the months touched."""
+    months = set()
+    for month, kind, cid, cents, count in changes:
+        group = groups.setdefault((month, kind, cid), [0, 0])
+        group[0] += cents
+        group[1] += count
+        if group[1] <= 0:
+            del groups[(month, kind, cid)]
+        months.add(month)
+    return months
+
+
+def dashboard_payload(groups: dict, today: date = None, timings: list = None):
+    """Dashboard widgets folded from load_groups() output."""
+    today = today or date.today()
+    current = f"{today.year}-{today.month:02d}"
+    timings = [] if timings is None else timings
+
+    with _timed(timings, 'stats'):
+        # From the start of this month on, as the month cards always counted
+        income = expense = count = 0
+        for (month, kind, _), (cents, n) in groups.items():
+            if month >= current:
+                if kind == 'income':
+                    income += cents
+                else:
+                    expense += cents
+                count += n
+        stats = {
+            'income': from_cents(income),
+            'expense': from_cents(expense),
+            'savings': round(from_cents(income) - from_cents(expense), 2),
+            'transaction_count': count
+        }
+
+    with _timed(timings, 'monthly'):
+        # Months with expenses only, as get_monthly_totals() reports them
+        spent = {}
+        for (month, kind, _), (cents, _) in groups.items():
+            if kind == 'expense':
+                spent[month] = spent.get(month, 0) + cents
+        months = sorted(spent)
+        totals = [from_cents(spent[m]) for m in months]
+
+    with _timed(timings, 'categories'):
+        by_id = {}
+        for (month, kind, cid), (cents, _) in groups.items():
+            if month == current and kind == 'expense':
+                by_id[cid] = by_id.get(cid, 0) + cents
+        names = category_names(list(by_id))
+        ranked = sorted(by_id.items(), key=lambda item: -item[1])
+        categories = {'categories': [names[c] for c, _ in ranked],
+                      'amounts': [from_cents(cents) for _, cents in ranked]}
+
+    with _timed(timings, 'forecast'):
+        forecast = predict_next_month_expense(months, totals)
+
+    return {
+        'stats': stats,
+        'monthly': {'months': months, 'totals': totals},
+        'categories': categories,
+        'forecast': forecast,
+    }
+
+
+def dashboard_snapshot(user_id: int, today: date = None):
+    """(payload, timings) for one user's dashboard from a single grouped query."""
+    timings = []
+    with _timed(timings, 'query'):
+        groups = load_groups(user_id)
+    return dashboard_payload(groups, today, timings), timings
+
+
+def _sse(name: str, data) -> str:
+    return f"event: {name}\ndata: {json.dumps(data)}\n\n"
+
+
+def _load_settled(user_id: int, stream: queue.Queue) -> dict:
+    # Reload until no change arrived during the load, so none is counted twice
+    while True:
+        groups = load_groups(user_id)
+        if stream.empty():
+            return groups
+        while not stream.empty():
+            stream.get_nowait()
+
+
+def dashboard_stream(user_id: int):
+    """Server-sent events for one user's dashboard.
+
+    Sends the full payload as a `snapshot` event, then a `delta` event per
+    burst of committed changes: new stats, categories and forecast, plus the
+    monthly totals of the months that changed (null when a month is gone).
+    The snapshot is built before this returns, so a full worker raises
+    events.StreamLimit here rather than after the response has started.
+    """
+    events = _dashboard_events(user_id)
+    first = next(events)
+
+    def resumed():
+        try:
+            yield first
+            yield from events
+        finally:
+            events.close()
+    return resumed()
+
+
+def _dashboard_events(user_id: int):
+    stream = hub.subscribe(user_id)
+    try:
+        base = base_currency(user_id)
+        groups = _load_settled(user_id, stream)
+        payload = dashboard_payload(groups)
+        # Do not hold a pooled connection for the life of the stream
+        db.session.close()
+        yield _sse('snapshot', payload)
+
+        while True:
+            try:
+                messages = [stream.get(timeout=KEEPALIVE_SECONDS)]
+            except queue.Empty:
+                yield ': keepalive\n\n'
+                continue
+            while not stream.empty():
+                messages.append(stream.get_nowait())
+
+            if any(m['kind'] == 'resync' for m in messages):
+                base = base_currency(user_id)
+                groups = _load_settled(user_id, stream)
+                payload = dashboard_payload(groups)
+                db.session.close()
+                yield _sse('snapshot', payload)
+                continue
+
+            touched = set()
+            for message in messages:
+                touched |= apply_changes(groups, in_base_currency(message['changes'], base))
+            payload = dashboard_payload(groups)
+            db.session.close()
+            monthly = dict(zip(payload['monthly']['months'], payload['monthly']['totals']))
+            yield _sse('delta', {
+                'stats': payload['stats'],
+                'categories': payload['categories'],
+                'forecast': payload['forecast'],
+                'months': {month: monthly.get(month) for month in sorted(touched)},
+            })
+    finally:
+        hub.unsubscribe(user_id, stream)
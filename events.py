@@ -0,0 +1,210 @@
+from models import Transaction
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+import json
+import queue
+import threading
+
+# Live dashboard updates. Committed Transaction changes become per-user
+# (month, type, category_id, cents, count, currency, day) deltas and are handed to the
+# dashboard streams open for that user. Streams live in the worker that
+# accepted them; with EVENT_BROKER_URL set (redis://...), deltas travel
+# through a Redis channel so a change committed in one worker reaches
+# streams held by the others.
+#
+# Nothing is collected while no stream is open and no broker is configured.
+#
+# Under WSGI each open stream holds a worker thread while it waits for
+# changes, so a worker accepts at most DASHBOARD_STREAMS of them at once;
+# keep that below its thread count so ordinary requests still get through.
+
+# Redis channel the workers share
+BROKER_CHANNEL = 'trackflow:dashboard'
+
+# Columns a dashboard delta depends on
+_TRACKED = ('user_id', 'date', 'type', 'category_id', 'amount_cents', 'currency')
+
+
+class StreamLimit(Exception):
+    """This worker already holds its DASHBOARD_STREAMS open streams."""
+
+
+class EventHub:
+    """Per-user fan-out of messages to the dashboard streams open in this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._streams = {}  # user_id -> set of queue.Queue
+        self._open = 0
+        self._redis = None
+        self._listener = None
+        self.broker_url = None
+        self.max_streams = 16
+
+    def configure(self, broker_url, max_streams: int = 16):
+        self.broker_url = broker_url or None
+        self.max_streams = max_streams
+
+    def active(self) -> bool:
+        return bool(self._streams) or self.broker_url is not None
+
+    def subscribe(self, user_id: int) -> queue.Queue:
+        """A queue receiving user_id's messages; raises StreamLimit when max_streams are open."""
+        stream = queue.Queue()
+        with self._lock:
+            if self._open >= self.max_streams:
+                raise StreamLimit(f'{self._open} dashboard streams already open')
+            self._open += 1
+            self._streams.setdefault(user_id, set()).add(stream)
+        if self.broker_url:
+            self._start_listener()
+        return stream
+
+    def unsubscribe(self, user_id: int, stream: queue.Queue):
+        with self._lock:
+            streams = self._streams.get(user_id, set())
+            if stream in streams:
+                self._open -= 1
+            streams.discard(stream)
+            if not streams:
+                self._streams.pop(user_id, None)
+
+    def publish(self, user_id, message: dict):
+        """Send `message` to user_id's streams (every stream for None), in every worker."""
+        if self.broker_url:
+            self._client().publish(BROKER_CHANNEL, json.dumps([user_id, message]))
+        else:
+            self._deliver(user_id, message)
+
+    def _deliver(self, user_id, message):
+        with self._lock:
+            if user_id is None:
+                targets = [s for streams in self._streams.values() for s in streams]
+            else:
+                targets = list(self._streams.get(user_id, ()))
+        for stream in targets:
+            stream.put(message)
+
+    def _client(self):
+        if self._redis is None:
+            import redis  # only needed with EVENT_BROKER_URL
+            self._redis = redis.Redis.from_url(self.broker_url)
+        return self._redis
+
+    def _start_listener(self):
+        with self._lock:
+            if self._listener is not None:
+                return
+            pubsub = self._client().pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(BROKER_CHANNEL)
+            self._listener = threading.Thread(target=self._listen, args=(pubsub,),
+                                              name='event-broker', daemon=True)
+            self._listener.start()
+
+    def _listen(self, pubsub):
+        for item in pubsub.listen():
+            user_id, message = json.loads(item['data'])
+            self._deliver(user_id, message)
+
+
+hub = EventHub()
+
+
+def resync(user_id=None):
+    """Ask user_id's streams (every stream for None) to reload, after changes made outside the ORM."""
+    if hub.active():
+        hub.publish(user_id, {'kind': 'resync'})
+
+
+def _delta(values: dict, sign: int):
+    d = values['date']
+    return [f"{d.year}-{d.month:02d}", values['type'], values['category_id'],
+            sign * values['amount_cents'], sign, values['currency'], d.isoformat()]
+
+
+def _keep_old_value(target, value, oldvalue, initiator):
+    return value
+
+
+_with_history = set()  # (model, column) pairs given a listener by keep_history()
+
+
+def keep_history(model, columns):
+    """Load the replaced value when an expired column of `model` is assigned.
+
+    An edit made after a commit then still knows what it replaced (e.g.
+    which month/category an amount moves out of). Each column gets one
+    listener however many modules ask for it.
+    """
+    for key in columns:
+        if (model, key) not in _with_history:
+            _with_history.add((model, key))
+            event.listen(getattr(model, key), 'set', _keep_old_value, active_history=True, retval=True)
+
+
+def history_before(obj, columns) -> dict:
+    """`columns` of `obj` as they were before the flush in progress (needs keep_history())."""
+    attrs = inspect(obj).attrs
+    values = {}
+    for key in columns:
+        history = attrs[key].history
+        values[key] = (history.deleted or history.unchanged or [getattr(obj, key)])[0]
+    return values
+
+
+keep_history(Transaction, _TRACKED)
+
+
+def _committed(tx) -> dict:
+    return history_before(tx, _TRACKED)
+
+
+def _current(tx) -> dict:
+    return {key: getattr(tx, key) for key in _TRACKED}
+
+
+def transaction_changes(session):
+    """(before, after) tracked values of each Transaction written by the flush in progress.
+
+    `before` is None for inserts and `after` is None for deletes. Call from
+    an after_flush hook, while the session still holds the pre-flush state.
+    """
+    for tx in session.new:
+        if isinstance(tx, Transaction):
+            yield None, _current(tx)
+    for tx in session.deleted:
+        if isinstance(tx, Transaction):
+            yield _committed(tx), None
+    for tx in session.dirty:
+        if isinstance(tx, Transaction) and session.is_modified(tx):
+            old, new = _committed(tx), _current(tx)
+            if old != new:
+                yield old, new
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changes(session, flush_context):
+    if not hub.active():
+        return
+    pending = session.info.setdefault('dashboard_changes', {})
+    for old, new in transaction_changes(session):
+        if old is not None:
+            pending.setdefault(old['user_id'], []).append(_delta(old, -1))
+        if new is not None:
+            pending.setdefault(new['user_id'], []).append(_delta(new, 1))
+
+
+@event.listens_for(Session, 'after_commit')
+def _publish_changes(session):
+    if session.in_nested_transaction():
+        # A savepoint was released; the outer transaction can still roll back
+        return
+    for user_id, changes in session.info.pop('dashboard_changes', {}).items():
+        hub.publish(user_id, {'kind': 'changes', 'changes': changes})
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_changes(session):
+    if session.in_nested_transaction():
+        return
+    session.info.pop('dashboard_changes', None)
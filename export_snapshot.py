@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+TrackFlow Snapshot Exporter
+Writes transactions, users and goals to Parquet for offline analysis
+
+Transactions are split by year and month of their date; rows are streamed
+from the database in batches, so the export needs little memory however
+large the tables are. Needs pyarrow (pip install -r requirements-analytics.txt).
+
+Load a snapshot in a notebook with:
+    from snapshots import read_snapshot
+    df = read_snapshot('snapshot', 'transactions', columns=['user_id', 'date', 'amount_cents'],
+                       filters=[('year', '>=', 2025)]).to_pandas()
+
+Usage:
+    python export_snapshot.py                        # full snapshot into ./snapshot
+    python export_snapshot.py --incremental          # add what changed since the last one
+    python export_snapshot.py --dir /data/trackflow
+"""
+
+import sys
+import time
+import argparse
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import SQLAlchemyError
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description="Write transactions, users and goals to Parquet")
+    parser.add_argument('--dir', default='snapshot', help="snapshot directory (default: ./snapshot)")
+    parser.add_argument('--incremental', action='store_true',
+                        help="append transactions changed since the last snapshot instead of starting over")
+    args = parser.parse_args()
+
+    print("TrackFlow Snapshot Exporter")
+    print("=" * 50)
+
+    from config import Config
+    from snapshots import take_snapshot
+
+    try:
+        db_url = Config.SQLALCHEMY_DATABASE_URI
+        print("Database URL:", db_url)
+        started = time.perf_counter()
+        entry = take_snapshot(create_engine(db_url), args.dir, incremental=args.incremental)
+        since = f" (changed since {entry['since']})" if entry['since'] else ""
+        print(f"Snapshot #{entry['seq']}, {entry['mode']}{since}:")
+        for table, rows in entry['rows'].items():
+            print(f"  {table}: {rows} row(s) in {entry['files'][table]} file(s)")
+        print(f"Written to {args.dir} in {time.perf_counter() - started:.2f} s")
+
+    except SQLAlchemyError as e:
+        print(f"Database error: {e}")
+        sys.exit(1)
+    except OSError as e:
+        print(f"Could not write snapshot: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
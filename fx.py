@@ -0,0 +1,255 @@
+from models import db, User, Transaction, FxRate
+from money import DEFAULT_CURRENCY
+from principal import load_principal
+from sqlalchemy import select, func
+from collections import OrderedDict
+import threading
+import time
+import numpy as np
+
+# Currency conversion against the daily rates in fx_rates (load_fx_rates.py;
+# nothing is fetched over the network). Every rate is quoted against PIVOT,
+# so an amount moves from A to B on a day as amount / rate_A * rate_B, using
+# each currency's latest quote on or before that day (its first quote for
+# days before it). Amounts are converted as arrays, one pass per currency
+# pair. Each currency's rate history is read once into memory and kept in a
+# small LRU cache whose entries expire after CACHE_TTL, so rates loaded by
+# another process are picked up without a restart. The list of currencies
+# with rates is cached the same way, so validating a code costs no query.
+
+# Currency every stored rate is quoted against (ECB reference rates are per EUR)
+PIVOT = 'EUR'
+# Currencies whose rate histories are kept in memory
+CACHE_SIZE = 32
+# Seconds before a cached rate history is read again
+CACHE_TTL = 3600
+# Above this many users, owner base currencies are read for every user at once
+OWNER_LOOKUP_LIMIT = 500
+# Display symbols; other currencies are shown by their code
+CURRENCY_SYMBOLS = {'INR': '₹', 'USD': '$', 'EUR': '€', 'GBP': '£', 'JPY': '¥'}
+
+
+class RateCache:
+    """Least-recently-used cache of (days, rates) arrays per currency, with a time-to-live."""
+
+    def __init__(self, size: int = CACHE_SIZE, ttl: float = CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self.hits = self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # currency -> (loaded_at, days, rates)
+
+    def get(self, currency: str, load):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(currency)
+            if entry is not None and now - entry[0] < self.ttl:
+                self._entries.move_to_end(currency)
+                self.hits += 1
+                return entry[1], entry[2]
+        # Read outside the lock; two threads missing together both load, harmlessly
+        days, rates = load(currency)
+        with self._lock:
+            self.misses += 1
+            self._entries[currency] = (now, days, rates)
+            self._entries.move_to_end(currency)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return days, rates
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+rate_cache = RateCache()
+
+
+class CurrencyCache:
+    """The currency codes with loaded rates, read again once they are CACHE_TTL old."""
+
+    def __init__(self, ttl: float = CACHE_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entry = None  # (loaded_at, codes)
+
+    def get(self, load) -> frozenset:
+        now = time.monotonic()
+        with self._lock:
+            if self._entry is not None and now - self._entry[0] < self.ttl:
+                return self._entry[1]
+        codes = frozenset(load())
+        with self._lock:
+            self._entry = (now, codes)
+        return codes
+
+    def clear(self):
+        with self._lock:
+            self._entry = None
+
+
+currency_cache = CurrencyCache()
+
+
+def clear_caches():
+    """Forget cached rates and currencies, e.g. after loading new rates in this process."""
+    rate_cache.clear()
+    currency_cache.clear()
+
+
+def _load_history(currency: str, bind=None):
+    stmt = select(FxRate.day, FxRate.rate).where(FxRate.currency == currency).order_by(FxRate.day)
+    if bind is None:
+        rows = db.session.execute(stmt).all()
+    else:
+        with bind.connect() as conn:
+            rows = conn.execute(stmt).all()
+    return (np.array([r[0] for r in rows], dtype='datetime64[D]'),
+            np.array([r[1] for r in rows], dtype=np.float64))
+
+
+def _load_currencies():
+    return db.session.execute(select(FxRate.currency).distinct()).scalars().all()
+
+
+def known_currencies() -> list:
+    """Currency codes amounts can be entered in: the default, and the pivot and every loaded one."""
+    loaded = currency_cache.get(_load_currencies)
+    if DEFAULT_CURRENCY != PIVOT and DEFAULT_CURRENCY not in loaded:
+        # Amounts in the default currency cannot be converted to anything yet
+        return [DEFAULT_CURRENCY]
+    return sorted({PIVOT, DEFAULT_CURRENCY, *loaded})
+
+
+def normalize_currency(value, known=None) -> str:
+    """'usd ' -> 'USD'; raises ValueError for codes without rates.
+
+    `known` is known_currencies(), for callers validating many values at once.
+    """
+    code = (value or '').strip().upper()
+    if code not in (known if known is not None else known_currencies()):
+        raise ValueError(f'Unknown currency: {value!r}')
+    return code
+
+
+def currency_symbol(code: str) -> str:
+    return CURRENCY_SYMBOLS.get(code, f'{code} ')
+
+
+def rates_on(currency: str, days, bind=None):
+    """Units of `currency` per one PIVOT on each of `days`."""
+    days = np.asarray(days, dtype='datetime64[D]')
+    if currency == PIVOT:
+        return np.ones(len(days))
+    history, rates = rate_cache.get(currency, lambda c: _load_history(c, bind))
+    if not len(history):
+        raise ValueError(f"No FX rates loaded for '{currency}'")
+    idx = np.searchsorted(history, days, side='right') - 1
+    return rates[np.maximum(idx, 0)]
+
+
+def convert(cents, days, currencies, to, bind=None):
+    """int64 cents in `to` for amounts in `currencies` on `days`.
+
+    `currencies` and `to` are codes or per-row arrays of codes. Amounts
+    already in their target currency are returned unchanged.
+    """
+    cents = np.asarray(cents, dtype=np.int64)
+    days = np.asarray(days, dtype='datetime64[D]')
+    source = np.broadcast_to(np.asarray(currencies, dtype='U3'), cents.shape)
+    target = np.broadcast_to(np.asarray(to, dtype='U3'), cents.shape)
+    pairs, inverse = np.unique(np.char.add(source, target), return_inverse=True)
+    factor = np.ones(len(cents))
+    for i, pair in enumerate(pairs):
+        src, dst = pair[:3], pair[3:]
+        if src == dst:
+            continue
+        rows = inverse == i
+        factor[rows] = rates_on(dst, days[rows], bind) / rates_on(src, days[rows], bind)
+    return np.rint(cents * factor).astype(np.int64)
+
+
+def base_currency(user_id: int) -> str:
+    # Cached with the user's login principal, so this is usually free
+    principal = load_principal(user_id)
+    return principal.base_currency if principal is not None else DEFAULT_CURRENCY
+
+
+def to_owner_currencies(cents, days, currencies, owners):
+    """Convert rows belonging to many users, each into its owner's base currency."""
+    ids, inverse = np.unique(owners, return_inverse=True)
+    stmt = select(User.id, User.base_currency)
+    if len(ids) <= OWNER_LOOKUP_LIMIT:
+        stmt = stmt.where(User.id.in_(ids.tolist()))
+    bases = dict(db.session.execute(stmt).all())
+    target = np.array([bases.get(int(u), DEFAULT_CURRENCY) for u in ids], dtype='U3')[inverse]
+    if np.array_equal(currencies, target):
+        return cents
+    return convert(cents, days, currencies, target)
+
+
+# Grouped sums in a base currency. Most users keep every amount in their base
+# currency; one index probe finds that out and they get the plain grouped
+# query. Otherwise base-currency rows are still summed by the database, and
+# the rest are summed per group, currency and day and converted in one pass.
+
+def other_currencies_stmt(user_id: int, base: str):
+    """Whether user_id has amounts outside `base`, as two range probes on (user_id, currency)."""
+    def probe(condition):
+        return select(Transaction.id).where(Transaction.user_id == user_id, condition).exists()
+    return select(probe(Transaction.currency < base) | probe(Transaction.currency > base))
+
+
+def sums_stmt(stmt, keys):
+    """(*keys, cents, count) per group over the rows `stmt` selects."""
+    return stmt.with_only_columns(
+        *keys, func.sum(Transaction.amount_cents), func.count(Transaction.id)
+    ).order_by(None).group_by(*keys)
+
+
+def by_day_stmt(stmt, keys):
+    """(*keys, currency, date, cents, count) per group, currency and day."""
+    return stmt.with_only_columns(
+        *keys, Transaction.currency, Transaction.date,
+        func.sum(Transaction.amount_cents), func.count(Transaction.id)
+    ).order_by(None).group_by(*keys, Transaction.currency, Transaction.date)
+
+
+def split_by_currency(stmt, base: str):
+    """(rows in `base`, rows in any other currency) of `stmt`."""
+    return stmt.where(Transaction.currency == base), stmt.where(Transaction.currency != base)
+
+
+def fold_sums(rows, n_keys: int) -> dict:
+    return {tuple(row[:n_keys]): [int(row[n_keys]), row[n_keys + 1]] for row in rows}
+
+
+def add_converted(groups: dict, rows, n_keys: int, base: str, bind=None):
+    """Fold by_day_stmt() rows into `groups`, converted to `base` in one pass."""
+    if not rows:
+        return groups
+    cents = convert([r[n_keys + 2] for r in rows], [r[n_keys + 1] for r in rows],
+                    [r[n_keys] for r in rows], base, bind)
+    for row, amount in zip(rows, cents.tolist()):
+        group = groups.setdefault(tuple(row[:n_keys]), [0, 0])
+        group[0] += amount
+        group[1] += row[n_keys + 3]
+    return groups
+
+
+def has_other_currencies(user_id: int, base: str) -> bool:
+    return db.session.execute(other_currencies_stmt(user_id, base)).scalar()
+
+
+def grouped_totals(stmt, keys, user_id: int, base: str = None) -> dict:
+    """{keys: [cents, count]} in `base` (user_id's base currency by default) over the rows `stmt` selects.
+
+    `stmt` contributes only its FROM and WHERE clauses and must be limited
+    to user_id's transactions, e.g. ``select(Transaction).where(Transaction.user_id == 1)``.
+    """
+    base = base or base_currency(user_id)
+    if not has_other_currencies(user_id, base):
+        return fold_sums(db.session.execute(sums_stmt(stmt, keys)).all(), len(keys))
+    same, other = split_by_currency(stmt, base)
+    groups = fold_sums(db.session.execute(sums_stmt(same, keys)).all(), len(keys))
+    return add_converted(groups, db.session.execute(by_day_stmt(other, keys)).all(), len(keys), base)
@@ -0,0 +1,261 @@
+from models import db, Transaction, IngestKey
+from categories import resolve_category
+from money import to_cents
+from fx import normalize_currency, known_currencies
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from concurrent.futures import Future
+from collections import deque
+from datetime import datetime, date
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# Batched transaction ingestion for bank feeds (POST /api/transactions/batch).
+# Items are validated on the request thread, then queued for one writer
+# thread per process, which commits whatever is queued together: a commit is
+# made once INGEST_BATCH_ROWS rows are waiting, or INGEST_FLUSH_MS after the
+# first of them arrived. Concurrent posts therefore share commits (and their
+# fsync) instead of paying one each, as the form does. At most
+# INGEST_QUEUE_ROWS rows wait per process; a post that does not fit is
+# refused whole, with 503.
+#
+# Every item carries a client-chosen idempotency key, unique per user. A key
+# already used, in an earlier post or earlier in the same batch, is not
+# inserted again; its item reports the first transaction instead, so a feed
+# can safely retry a post whose response it never saw. Rows go through the
+# ORM, so budgets, live dashboards and other flush hooks see them as they
+# see a form submission.
+
+# Items accepted per post
+INGEST_MAX_ITEMS = 1000
+# Longest an idempotency key may be
+KEY_LENGTH = 64
+# Seconds a post waits for its rows to be committed
+INGEST_WAIT_SECONDS = 30
+
+TRANSACTION_TYPES = ('income', 'expense')
+
+batch_rows = 500
+flush_seconds = 0.01
+queue_rows = 20000
+
+
+class IngestBusy(Exception):
+    """The queue has no room for a post; the client should retry later."""
+
+
+def configure(config):
+    """Apply INGEST_BATCH_ROWS, INGEST_FLUSH_MS and INGEST_QUEUE_ROWS from the app config."""
+    global batch_rows, flush_seconds, queue_rows
+    batch_rows = config['INGEST_BATCH_ROWS']
+    flush_seconds = config['INGEST_FLUSH_MS'] / 1000
+    queue_rows = config['INGEST_QUEUE_ROWS']
+
+
+class _Item:
+    __slots__ = ('user_id', 'key', 'values', 'future')
+
+    def __init__(self, user_id: int, key: str, values: dict):
+        self.user_id = user_id
+        self.key = key
+        self.values = values
+        self.future = Future()
+
+
+def parse_item(raw, default_currency: str, known=None):
+    """(key, Transaction column values) for one posted item; raises ValueError naming what is wrong.
+
+    `known` is fx.known_currencies(), read once per post rather than per item.
+    """
+    if not isinstance(raw, dict):
+        raise ValueError('Item must be an object')
+    key = raw.get('key')
+    if not isinstance(key, str) or not key.strip() or len(key.strip()) > KEY_LENGTH:
+        raise ValueError(f'key must be a non-empty string of at most {KEY_LENGTH} characters')
+    ttype = raw.get('type', 'expense')
+    if ttype not in TRANSACTION_TYPES:
+        raise ValueError(f"type must be one of {', '.join(TRANSACTION_TYPES)}")
+    if raw.get('amount') is None:
+        raise ValueError('amount is required')
+    amount_cents = to_cents(raw['amount'])
+    if amount_cents <= 0:
+        raise ValueError('Amount must be positive')
+    currency = normalize_currency(raw.get('currency') or default_currency, known)
+    day = raw.get('date')
+    try:
+        tdate = datetime.strptime(day, '%Y-%m-%d').date() if day else date.today()
+    except (TypeError, ValueError):
+        raise ValueError('date must be YYYY-MM-DD')
+    return key.strip(), {
+        'type': ttype,
+        'amount_cents': amount_cents,
+        'currency': currency,
+        'category': str(raw.get('category') or 'Other').strip() or 'Other',
+        'note': str(raw.get('note') or '').strip(),
+        'date': tdate,
+    }
+
+
+def _failed() -> dict:
+    return {'status': 'error', 'error': 'Could not be saved'}
+
+
+class IngestQueue:
+    """Bounded queue of parsed items, committed in groups by one writer thread."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._items = deque()
+        self._writer = None
+        self._app = None
+        self.commits = 0
+        self.rows = 0
+
+    def submit(self, app, user_id: int, entries) -> list:
+        """Queue (key, values) pairs of user_id's; one Future per entry, resolving to its result dict."""
+        items = [_Item(user_id, key, values) for key, values in entries]
+        with self._cond:
+            if len(self._items) + len(items) > queue_rows:
+                raise IngestBusy(f'{len(self._items)} rows already waiting')
+            self._items.extend(items)
+            self._cond.notify()
+            if self._writer is None:
+                # Started on first use, so workers forked after import each get their own
+                self._app = app
+                self._writer = threading.Thread(target=self._run, name='ingest-writer', daemon=True)
+                self._writer.start()
+        return [item.future for item in items]
+
+    def stats(self) -> dict:
+        with self._cond:
+            waiting = len(self._items)
+        return {'waiting': waiting, 'commits': self.commits, 'rows': self.rows,
+                'rows_per_commit': round(self.rows / self.commits, 1) if self.commits else 0}
+
+    def _take(self) -> list:
+        with self._cond:
+            while not self._items:
+                self._cond.wait()
+            deadline = time.monotonic() + flush_seconds
+            while len(self._items) < batch_rows:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return [self._items.popleft() for _ in range(min(batch_rows, len(self._items)))]
+
+    def _run(self):
+        with self._app.app_context():
+            while True:
+                batch = self._take()
+                try:
+                    results = self._write(batch)
+                except Exception:
+                    log.exception('Ingestion batch of %d row(s) failed', len(batch))
+                    results = [_failed() for _ in batch]
+                finally:
+                    db.session.remove()
+                for item, result in zip(batch, results):
+                    item.future.set_result(result)
+
+    def _write(self, batch) -> list:
+        for _ in range(2):
+            try:
+                return self._commit(batch)
+            except IntegrityError:
+                # Usually another worker committed one of the keys meanwhile:
+                # the retry finds it
+                db.session.rollback()
+            except Exception:
+                # Not a key race (e.g. a value the database cannot store): no retry
+                db.session.rollback()
+                break
+        # Something else in the group is refused, e.g. a user deleted since
+        # posting: commit each user's items apart, so only theirs fail
+        log.warning('Ingestion group commit of %d row(s) failed; committing per user', len(batch))
+        results, by_user = [None] * len(batch), {}
+        for i, item in enumerate(batch):
+            by_user.setdefault(item.user_id, []).append(i)
+        for user_id, slots in by_user.items():
+            try:
+                written = self._commit([batch[i] for i in slots])
+            except Exception:
+                db.session.rollback()
+                log.exception('Ingestion of %d row(s) for user %d failed', len(slots), user_id)
+                written = [_failed() for _ in slots]
+            for i, result in zip(slots, written):
+                results[i] = result
+        return results
+
+    def _commit(self, batch) -> list:
+        keys = {(item.user_id, item.key) for item in batch}
+        used = {(row.user_id, row.key): row.transaction_id for row in db.session.execute(
+            select(IngestKey.user_id, IngestKey.key, IngestKey.transaction_id).where(
+                IngestKey.user_id.in_({user_id for user_id, _ in keys}),
+                IngestKey.key.in_({key for _, key in keys}))
+        ) if (row.user_id, row.key) in keys}
+
+        created = {}  # (user_id, key) -> Transaction, first item with the key
+        for item in batch:
+            pair = (item.user_id, item.key)
+            if pair in used or pair in created:
+                continue
+            category_id, category = resolve_category(item.values['category'])
+            created[pair] = Transaction(user_id=item.user_id, **{**item.values, 'category': category},
+                                        category_id=category_id)
+        db.session.add_all(created.values())
+        db.session.flush()
+        # Read before the commit expires them
+        ids = {pair: tx.id for pair, tx in created.items()}
+        db.session.add_all(IngestKey(user_id=user_id, key=key, transaction_id=tx_id)
+                           for (user_id, key), tx_id in ids.items())
+        db.session.commit()
+        self.commits += 1
+        self.rows += len(ids)
+
+        results, reported = [], set()
+        for item in batch:
+            pair = (item.user_id, item.key)
+            if pair in ids and pair not in reported:
+                reported.add(pair)
+                results.append({'status': 'created', 'id': ids[pair]})
+            else:
+                results.append({'status': 'duplicate', 'id': used.get(pair) or ids[pair]})
+        return results
+
+
+ingest_queue = IngestQueue()
+
+
+def ingest(app, user_id: int, raw_items, default_currency: str) -> list:
+    """Validate, queue and wait for a post's items; one result dict per item, in order.
+
+    Raises IngestBusy when the queue cannot take the post.
+    """
+    results, entries, slots = [], [], []
+    known = known_currencies()
+    for i, raw in enumerate(raw_items):
+        try:
+            entries.append(parse_item(raw, default_currency, known))
+            slots.append(i)
+            results.append(None)
+        except ValueError as e:
+            results.append({'status': 'invalid', 'error': str(e)})
+    if entries:
+        futures = ingest_queue.submit(app, user_id, entries)
+        # Hand this request's connection back while it waits: enough waiting
+        # posts would otherwise hold the whole pool and starve the writer
+        db.session.close()
+        for i, future in zip(slots, futures):
+            try:
+                results[i] = future.result(timeout=INGEST_WAIT_SECONDS)
+            except TimeoutError:
+                # Still queued: retrying with the same keys is safe
+                results[i] = {'status': 'pending', 'error': 'Not committed yet; retry with the same key'}
+    for raw, result in zip(raw_items, results):
+        if isinstance(raw, dict) and 'key' in raw:
+            result['key'] = raw['key']
+    return results
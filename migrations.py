@@ -0,0 +1,311 @@
+from sqlalchemy import text, inspect
+from sqlalchemy.exc import OperationalError
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+# Versioned schema changes. A Revision has an id, an up step and, where the
+# change can be undone, a down step; applied revisions are recorded in
+# REVISION_TABLE and upgrade() runs the others in order (migrate.py lists
+# them). Steps receive an Operations object whose helpers keep large tables
+# writable while they run:
+#
+#   create_index()  CREATE INDEX CONCURRENTLY on Postgres, outside any
+#                   transaction (partition by partition on a partitioned
+#                   table); an invalid index left by a failed build is
+#                   dropped and built again
+#   ddl()           short statements under lock_timeout, retried, so they
+#                   never queue every writer behind a long transaction
+#   backfill()      an UPDATE in windows of BACKFILL_BATCH primary keys,
+#                   each committed on its own, with a pause in between and
+#                   progress reported as it goes
+#
+# A step that fails part way is run again from the start by the next
+# upgrade, so steps must be safe to repeat (IF NOT EXISTS, WHERE ... IS
+# NULL). Revisions marked `always` run on every upgrade: they depend on
+# configuration and check for themselves what is left to do.
+
+# Rows updated per backfill batch (and per commit)
+BACKFILL_BATCH = 5000
+# Seconds slept between backfill batches, leaving room for other writers
+BACKFILL_PAUSE = 0.05
+# Seconds between backfill progress lines
+PROGRESS_INTERVAL = 5
+# How long DDL waits for its table lock before giving up (Postgres)
+LOCK_TIMEOUT = '5s'
+# Attempts at DDL that keeps timing out on its lock
+DDL_ATTEMPTS = 5
+REVISION_TABLE = 'schema_revisions'
+
+
+class IrreversibleRevision(Exception):
+    """Raised when a downgrade reaches a revision without a down step."""
+
+
+class Revision:
+    """One schema change: `up(op)` applies it, `down(op)` (optional) undoes it."""
+
+    def __init__(self, id: str, name: str, up, down=None, always: bool = False):
+        self.id = id
+        self.name = name
+        self.up = up
+        self.down = down
+        self.always = always
+
+    def __repr__(self):
+        return f'<Revision {self.id} {self.name}>'
+
+
+class Operations:
+    """Schema helpers handed to revision steps."""
+
+    def __init__(self, engine, progress=print):
+        self.engine = engine
+        self.dialect = engine.dialect.name
+        self.report = progress
+
+    def columns(self, table: str) -> list:
+        with self.engine.connect() as conn:
+            return [c['name'] for c in inspect(conn).get_columns(table)]
+
+    def has_table(self, table: str) -> bool:
+        return inspect(self.engine).has_table(table)
+
+    def execute(self, sql: str, params: dict = None):
+        """Run one statement in its own transaction."""
+        with self.engine.begin() as conn:
+            return conn.execute(text(sql), params or {})
+
+    def ddl(self, sql: str):
+        """Run a DDL statement that needs a table lock, without holding up other writers for long.
+
+        On Postgres the lock is given up after LOCK_TIMEOUT and the statement
+        retried, instead of waiting behind a long transaction while every
+        later query on the table waits behind it.
+        """
+        for attempt in range(1, DDL_ATTEMPTS + 1):
+            try:
+                with self.engine.begin() as conn:
+                    if self.dialect == 'postgresql':
+                        conn.execute(text(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'"))
+                    conn.execute(text(sql))
+                return
+            except OperationalError as e:
+                # 55P03: lock_not_available
+                if getattr(e.orig, 'pgcode', None) != '55P03' or attempt == DDL_ATTEMPTS:
+                    raise
+                self.report(f"  Lock not granted within {LOCK_TIMEOUT}, retrying ({attempt}/{DDL_ATTEMPTS})...")
+                time.sleep(attempt)
+
+    def add_column(self, table: str, name: str, definition: str) -> bool:
+        """Add a column unless present; True when added.
+
+        Keep it cheap on large tables: nullable, or with a constant default
+        (Postgres 11+ then only updates the catalog); fill it with backfill().
+        """
+        if name in self.columns(table):
+            return False
+        self.report(f"  Adding '{table}.{name}' column...")
+        self.ddl(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+        return True
+
+    def drop_column(self, table: str, name: str):
+        if name in self.columns(table):
+            self.report(f"  Dropping '{table}.{name}' column...")
+            self.ddl(f"ALTER TABLE {table} DROP COLUMN {name}")
+
+    def _pg_index_state(self, conn, name: str):
+        # None if missing, else (valid, partitioned)
+        row = conn.execute(text("""
+            SELECT x.indisvalid, c.relkind = 'I' FROM pg_index x
+            JOIN pg_class c ON c.oid = x.indexrelid WHERE c.relname = :name
+        """), {"name": name}).first()
+        return None if row is None else tuple(row)
+
+    def _pg_build_index(self, conn, name: str, table: str, definition: str):
+        state = self._pg_index_state(conn, name)
+        if state is not None and not state[0]:
+            # Left invalid by an interrupted CONCURRENTLY build
+            conn.execute(text(f'DROP INDEX CONCURRENTLY "{name}"'))
+        conn.execute(text(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{name}" ON {table} {definition}'))
+
+    def create_index(self, name: str, table: str, columns: str, using: str = None):
+        """Create an index unless present, without blocking writes on Postgres.
+
+        `columns` is the column list, e.g. 'user_id, category_id'.
+        """
+        definition = f"{'USING ' + using + ' ' if using else ''}({columns})"
+        if self.dialect != 'postgresql':
+            self.execute(f'CREATE INDEX IF NOT EXISTS "{name}" ON {table} {definition}')
+            return
+        # CONCURRENTLY cannot run inside a transaction block
+        with self.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            if self._pg_index_state(conn, name) == (True, False):
+                return
+            partitions = conn.execute(text("""
+                SELECT c.relname FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                JOIN pg_class p ON p.oid = i.inhparent
+                JOIN pg_partitioned_table pt ON pt.partrelid = p.oid
+                WHERE p.relname = :table
+            """), {"table": table}).scalars().all()
+            if not partitions:
+                self.report(f"  Building index {name} on {table} (concurrently)...")
+                self._pg_build_index(conn, name, table, definition)
+                return
+            # Postgres cannot build a partitioned index concurrently: an invalid
+            # parent index on ONLY the parent becomes valid once every
+            # partition's index, each built concurrently, is attached to it
+            conn.execute(text(f'CREATE INDEX IF NOT EXISTS "{name}" ON ONLY {table} {definition}'))
+            for partition in partitions:
+                child = f"{partition}_{name}"[:63]
+                self.report(f"  Building index {child} on {partition} (concurrently)...")
+                self._pg_build_index(conn, child, partition, definition)
+                attached = conn.execute(text("""
+                    SELECT 1 FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid WHERE c.relname = :child
+                """), {"child": child}).first()
+                if not attached:
+                    conn.execute(text(f'ALTER INDEX "{name}" ATTACH PARTITION "{child}"'))
+
+    def drop_index(self, name: str):
+        if self.dialect != 'postgresql':
+            self.execute(f'DROP INDEX IF EXISTS "{name}"')
+            return
+        with self.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            state = self._pg_index_state(conn, name)
+            if state is None:
+                return
+            # Indexes of partitioned tables cannot be dropped concurrently
+            conn.execute(text(f'DROP INDEX {"" if state[1] else "CONCURRENTLY "}"{name}"'))
+
+    def backfill(self, table: str, assignments: str, where: str = None, params: dict = None,
+                 key: str = 'id', batch: int = BACKFILL_BATCH, pause: float = BACKFILL_PAUSE) -> int:
+        """UPDATE `table` SET `assignments` [WHERE `where`] in committed windows of `batch` keys.
+
+        Returns the number of rows updated. Windows walk `key` (an indexed,
+        unique column), so each statement locks at most `batch` rows.
+        """
+        with self.engine.connect() as conn:
+            low, high = conn.execute(text(f"SELECT min({key}), max({key}) FROM {table}")).one()
+        if low is None:
+            return 0
+        condition = f"({where}) AND " if where else ""
+        updated, last = 0, low - 1
+        started = reported = time.monotonic()
+        while True:
+            with self.engine.begin() as conn:
+                bound = conn.execute(text(
+                    f"SELECT {key} FROM {table} WHERE {key} > :last ORDER BY {key} LIMIT 1 OFFSET :skip"
+                ), {"last": last, "skip": batch - 1}).scalar()
+                window = f"{key} > :last" if bound is None else f"{key} > :last AND {key} <= :bound"
+                updated += conn.execute(text(f"UPDATE {table} SET {assignments} WHERE {condition}{window}"),
+                                        {**(params or {}), "last": last, "bound": bound}).rowcount
+            if bound is None:
+                break
+            last = bound
+            now = time.monotonic()
+            if now - reported >= PROGRESS_INTERVAL:
+                done = (last - low + 1) / (high - low + 1)
+                self.report(f"  {table}: {updated} row(s) updated, {done:.0%} through, "
+                            f"{updated / (now - started):.0f} rows/s")
+                reported = now
+            time.sleep(pause)
+        self.report(f"  {table}: {updated} row(s) updated in {time.monotonic() - started:.1f} s")
+        return updated
+
+
+def _ensure_revision_table(engine):
+    with engine.begin() as conn:
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {REVISION_TABLE} ("
+            "revision VARCHAR(32) PRIMARY KEY, name VARCHAR(200) NOT NULL, "
+            "applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP)"
+        ))
+
+
+def applied_revisions(engine) -> dict:
+    """{revision id: applied_at} of the revisions recorded as applied."""
+    if not inspect(engine).has_table(REVISION_TABLE):
+        return {}
+    with engine.connect() as conn:
+        return dict(conn.execute(text(f"SELECT revision, applied_at FROM {REVISION_TABLE}")).all())
+
+
+def _record(engine, revision: Revision):
+    with engine.begin() as conn:
+        conn.execute(text(f"DELETE FROM {REVISION_TABLE} WHERE revision = :id"), {"id": revision.id})
+        conn.execute(text(f"INSERT INTO {REVISION_TABLE} (revision, name) VALUES (:id, :name)"),
+                     {"id": revision.id, "name": revision.name})
+
+
+def _index(revisions, target):
+    ids = [r.id for r in revisions]
+    if target not in ids:
+        raise ValueError(f"Unknown revision {target!r}")
+    return ids.index(target)
+
+
+def pending_revisions(engine, revisions) -> list:
+    applied = applied_revisions(engine)
+    return [r for r in revisions if r.id not in applied]
+
+
+def upgrade(engine, revisions, target: str = None, progress=print) -> list:
+    """Apply pending revisions up to `target` (all by default) and `always` ones; returns those run."""
+    _ensure_revision_table(engine)
+    op = Operations(engine, progress)
+    applied = applied_revisions(engine)
+    stop = len(revisions) if target is None else _index(revisions, target) + 1
+    ran = []
+    for revision in revisions[:stop]:
+        if revision.id in applied and not revision.always:
+            continue
+        progress(f"[{revision.id}] {revision.name}")
+        started = time.monotonic()
+        revision.up(op)
+        _record(engine, revision)
+        progress(f"  done in {time.monotonic() - started:.1f} s")
+        ran.append(revision)
+    return ran
+
+
+def downgrade(engine, revisions, target: str, progress=print) -> list:
+    """Undo applied revisions after `target` ('base': all of them), newest first; returns those undone."""
+    applied = applied_revisions(engine)
+    keep = -1 if target == 'base' else _index(revisions, target)
+    undo = [r for r in reversed(revisions[keep + 1:]) if r.id in applied]
+    # Refuse before undoing anything rather than stop half way
+    for revision in undo:
+        if revision.down is None:
+            raise IrreversibleRevision(f"Revision {revision.id} ({revision.name}) cannot be undone")
+    undone = []
+    for revision in undo:
+        progress(f"[{revision.id}] undoing {revision.name}")
+        revision.down(Operations(engine, progress))
+        with engine.begin() as conn:
+            conn.execute(text(f"DELETE FROM {REVISION_TABLE} WHERE revision = :id"), {"id": revision.id})
+        undone.append(revision)
+    return undone
+
+
+def stamp(engine, revisions, target: str = None):
+    """Record revisions up to `target` (all by default) as applied without running them."""
+    _ensure_revision_table(engine)
+    applied = applied_revisions(engine)
+    stop = len(revisions) if target is None else _index(revisions, target) + 1
+    for revision in revisions[:stop]:
+        if revision.id not in applied:
+            _record(engine, revision)
+
+
+def prepare_database(engine, metadata, revisions):
+    """At start-up: create an empty database at the latest revision; warn when an existing one is behind."""
+    if not inspect(engine).has_table('users'):
+        metadata.create_all(engine)
+        stamp(engine, revisions)
+        return
+    pending = pending_revisions(engine, revisions)
+    if pending:
+        log.warning('Database schema is %d revision(s) behind (%s); run python migrate.py',
+                    len(pending), ', '.join(r.id for r in pending))
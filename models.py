@@ -1,10 +1,23 @@
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
+from sqlalchemy import event, func
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.hybrid import hybrid_property
+from money import to_cents, from_cents, DEFAULT_CURRENCY
 from datetime import date
+import sqlite3
 
 db = SQLAlchemy()
 
+@event.listens_for(Engine, 'connect')
+def _enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    # SQLite ignores FOREIGN KEY / ON DELETE clauses unless asked per connection
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
+
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
     id = db.Column(db.Integer, primary_key=True)
@@ -13,9 +26,16 @@ class User(UserMixin, db.Model):
     password_hash = db.Column(db.String(255), nullable=False)
     role = db.Column(db.String(20), default='user')  # new column for role
     created_at = db.Column(db.Date, default=date.today)
+    # Currency totals, charts and forecasts are reported in
+    base_currency = db.Column(db.String(3), nullable=False, default=DEFAULT_CURRENCY)
 
-    transactions = db.relationship('Transaction', backref='user', lazy=True)
-    goals = db.relationship('Goal', uselist=False, backref='user', lazy=True)
+    # Children are removed by the database (ON DELETE CASCADE), never loaded for deletion
+    transactions = db.relationship('Transaction', backref='user', lazy=True,
+                                   cascade='all, delete-orphan', passive_deletes=True)
+    goals = db.relationship('Goal', uselist=False, backref='user', lazy=True,
+                            cascade='all, delete-orphan', passive_deletes=True)
+    budgets = db.relationship('Budget', backref='user', lazy=True,
+                              cascade='all, delete-orphan', passive_deletes=True)
 
     def set_password(self, password: str):
         self.password_hash = generate_password_hash(password)
@@ -23,22 +43,153 @@ class User(UserMixin, db.Model):
     def check_password(self, password: str) -> bool:
         return check_password_hash(self.password_hash, password)
 
+class Category(db.Model):
+    # Global dictionary of category labels; transactions group on the integer id
+    __tablename__ = 'categories'
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(50), unique=True, nullable=False)  # casefolded, single-spaced
+    name = db.Column(db.String(50), nullable=False)  # display form, as first written
+
 class Transaction(db.Model):
     __tablename__ = 'transactions'
+    __table_args__ = (db.Index('ix_transactions_user_category', 'user_id', 'category_id'),
+                      db.Index('ix_transactions_user_currency', 'user_id', 'currency'),
+                      db.Index('ix_transactions_updated_at', 'updated_at'))
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
     type = db.Column(db.String(10), nullable=False, default='expense')  # 'income' or 'expense'
-    amount = db.Column(db.Float, nullable=False)
+    amount_cents = db.Column(db.BigInteger, nullable=False)
+    currency = db.Column(db.String(3), nullable=False, default=DEFAULT_CURRENCY)  # ISO 4217 code of amount_cents
     category = db.Column(db.String(50), nullable=False, default='Other')
+    category_id = db.Column(db.Integer, db.ForeignKey('categories.id'), nullable=True)
     note = db.Column(db.String(255), nullable=True)
     date = db.Column(db.Date, nullable=False, default=date.today)
+    # Database time of the last insert or update through SQLAlchemy (NULL for rows older than the column)
+    updated_at = db.Column(db.DateTime, nullable=True, default=func.now(), onupdate=func.now())
+
+    # Amounts are stored in integer minor units; `amount` is the decimal view
+    @hybrid_property
+    def amount(self):
+        return from_cents(self.amount_cents)
+
+    @amount.setter
+    def amount(self, value):
+        self.amount_cents = to_cents(value)
+
+    @amount.expression
+    def amount(cls):
+        return cls.amount_cents / 100.0
+
+class TransactionRollup(db.Model):
+    # Per-month sums of transactions moved to the archive store by
+    # archive.py, so totals over closed years never need their rows
+    __tablename__ = 'transaction_rollups'
+    __table_args__ = (db.Index('ix_transaction_rollups_user_month', 'user_id', 'month'),)
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    month = db.Column(db.Date, nullable=False)  # first day of the month
+    type = db.Column(db.String(10), nullable=False)
+    category_id = db.Column(db.Integer, db.ForeignKey('categories.id'), nullable=True)
+    currency = db.Column(db.String(3), nullable=False)
+    amount_cents = db.Column(db.BigInteger, nullable=False)
+    count = db.Column(db.Integer, nullable=False)
+
+class IngestKey(db.Model):
+    # Idempotency keys of rows posted to the ingestion API (ingest.py): a
+    # retried post with a key already used gets the first post's transaction
+    __tablename__ = 'ingest_keys'
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    key = db.Column(db.String(64), primary_key=True)
+    # No foreign key: a partitioned transactions table has no unique id alone
+    transaction_id = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=func.now())
+
+class ChangeLog(db.Model):
+    # Outbox of writes to transactions, goals and users, inserted in the
+    # same database transaction as the write itself (outbox.py); consumers
+    # read it in id order from their checkpoint
+    __tablename__ = 'change_log'
+    __table_args__ = {'sqlite_autoincrement': True}  # ids never reused, even after pruning
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    entity = db.Column(db.String(20), nullable=False)  # 'transaction', 'goal' or 'user'
+    entity_id = db.Column(db.Integer, nullable=False)
+    # Owner; no foreign key, so a user's deletion stays in the log
+    user_id = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(10), nullable=False)  # 'insert', 'update' or 'delete'
+    before = db.Column(db.JSON(none_as_null=True), nullable=True)  # tracked columns; None for inserts
+    after = db.Column(db.JSON(none_as_null=True), nullable=True)  # None for deletes
+    created_at = db.Column(db.DateTime, nullable=False, default=func.now())
+
+class ChangeCheckpoint(db.Model):
+    # Last change_log id each named consumer has processed
+    __tablename__ = 'change_checkpoints'
+    consumer = db.Column(db.String(100), primary_key=True)
+    position = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=func.now(), onupdate=func.now())
+
+class FxRate(db.Model):
+    # Daily exchange rates, loaded from a file by load_fx_rates.py
+    __tablename__ = 'fx_rates'
+    currency = db.Column(db.String(3), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    rate = db.Column(db.Float, nullable=False)  # units of `currency` per one fx.PIVOT
 
 class Goal(db.Model):
     __tablename__ = 'goals'
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, unique=True)
-    monthly_savings_target = db.Column(db.Float, nullable=False, default=0.0)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False, unique=True)
+    monthly_savings_target_cents = db.Column(db.BigInteger, nullable=False, default=0)
     # Optional columns that will be added by the fix script
     name = db.Column(db.String(100), nullable=True, default='Monthly Savings')
-    target_amount = db.Column(db.Float, nullable=True, default=0.0)
-    achieved = db.Column(db.Float, nullable=True, default=0.0)
+    target_amount_cents = db.Column(db.BigInteger, nullable=True, default=0)
+    achieved_cents = db.Column(db.BigInteger, nullable=True, default=0)
+
+    @hybrid_property
+    def monthly_savings_target(self):
+        return from_cents(self.monthly_savings_target_cents)
+
+    @monthly_savings_target.setter
+    def monthly_savings_target(self, value):
+        self.monthly_savings_target_cents = to_cents(value)
+
+    @hybrid_property
+    def target_amount(self):
+        return None if self.target_amount_cents is None else from_cents(self.target_amount_cents)
+
+    @target_amount.setter
+    def target_amount(self, value):
+        self.target_amount_cents = to_cents(value)
+
+    @hybrid_property
+    def achieved(self):
+        return None if self.achieved_cents is None else from_cents(self.achieved_cents)
+
+    @achieved.setter
+    def achieved(self, value):
+        self.achieved_cents = to_cents(value)
+
+class Budget(db.Model):
+    # Monthly spending limit for one category, in the user's base currency.
+    # spent_cents is what the month starting at `period` has spent so far,
+    # kept current on every transaction write by budgets.py
+    __tablename__ = 'budgets'
+    __table_args__ = (db.UniqueConstraint('user_id', 'category_id', name='uq_budgets_user_category'),)
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    category_id = db.Column(db.Integer, db.ForeignKey('categories.id'), nullable=False)
+    limit_cents = db.Column(db.BigInteger, nullable=False)
+    alert_percent = db.Column(db.Integer, nullable=False, default=80)  # warn at this share of the limit
+    period = db.Column(db.Date, nullable=False)
+    spent_cents = db.Column(db.BigInteger, nullable=False, default=0)
+
+    @hybrid_property
+    def limit(self):
+        return from_cents(self.limit_cents)
+
+    @limit.setter
+    def limit(self, value):
+        self.limit_cents = to_cents(value)
+
+    @hybrid_property
+    def spent(self):
+        return from_cents(self.spent_cents)
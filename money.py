@@ -0,0 +1,42 @@
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+# Money is stored as integer minor units (paise/cents). Values cross this
+# boundary once: to_cents() on the way in from forms/JSON, from_cents() on
+# the way out to templates and API responses.
+
+_CENT = Decimal('0.01')
+
+# ISO 4217 code for amounts and users that do not name a currency
+DEFAULT_CURRENCY = 'INR'
+
+# Largest amount accepted, in cents: thousands of them still sum within BIGINT
+MAX_CENTS = 10 ** 15
+
+
+def to_cents(value) -> int:
+    """Exact conversion of '12.34', 12.34 or Decimal('12.34') to 1234.
+
+    Raises ValueError for anything that is not a finite number, or whose
+    size exceeds MAX_CENTS.
+    """
+    if isinstance(value, int) and not isinstance(value, bool):
+        cents = value * 100
+    else:
+        try:
+            amount = Decimal(str(value).strip())
+            if not amount.is_finite():
+                raise ValueError
+            cents = int(amount.quantize(_CENT, rounding=ROUND_HALF_UP) * 100)
+        except (InvalidOperation, ValueError):
+            raise ValueError(f'Not a valid amount: {value!r}')
+    if abs(cents) > MAX_CENTS:
+        raise ValueError(f'Amount too large: {value!r}')
+    return cents
+
+
+def from_cents(cents) -> float:
+    return 0.0 if cents is None else int(cents) / 100
+
+
+def cents_to_decimal(cents) -> Decimal:
+    return (Decimal(int(cents or 0)) * _CENT).quantize(_CENT)
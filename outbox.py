@@ -0,0 +1,217 @@
+from models import db, User, Transaction, Goal, ChangeLog, ChangeCheckpoint
+from events import keep_history, history_before
+from sqlalchemy import select, insert, delete, update, event, func, cast, text, DateTime
+from sqlalchemy.orm import Session
+from datetime import date, timedelta
+
+# Change feed for anything derived from transactions (totals, breakdowns,
+# forecasts, caches). Every flushed insert, update or delete of a
+# Transaction, Goal or User adds a change_log row in the same database
+# transaction, carrying the tracked columns before and after, so a change
+# is in the log exactly when it is committed. Writes that bypass the ORM
+# record themselves: bulk.py logs the rows it touches chunk by chunk, and a
+# user purged in the background logs one 'user' delete, which stands for
+# all of that user's rows. Archiving (archive.py) is not logged: it leaves
+# totals as they were.
+#
+# Consumers read in id order from a checkpoint (read_changes, consume) and
+# may see a change more than once after a crash. On Postgres ids are taken
+# at flush but become visible at commit, so a lower id can appear after a
+# higher one. Reading stops at a gap in the ids until no transaction that
+# was open when the row after the gap was written is still open (going by
+# pg_stat_activity); by then the missing id was either committed, and is
+# read, or rolled back, and is skipped. A transaction left open anywhere
+# in the database therefore holds the feed at the next gap until it ends.
+# This relies on the app's database role seeing its own sessions in
+# pg_stat_activity (roles see their own sessions by default) and on no
+# prepared (two-phase) transactions. SQLite commits one writer at a time,
+# in id order, so its gaps are final at once.
+
+# Tracked columns, per model: (entity name, columns)
+TRACKED = {
+    Transaction: ('transaction', ('user_id', 'date', 'type', 'category_id', 'amount_cents', 'currency')),
+    Goal: ('goal', ('user_id', 'name', 'monthly_savings_target_cents', 'target_amount_cents', 'achieved_cents')),
+    User: ('user', ('base_currency',)),
+}
+# Changes returned per read
+CHANGE_BATCH = 1000
+
+
+# So an update made after a commit still logs what it replaced
+for _model, (_entity, _columns) in TRACKED.items():
+    keep_history(_model, _columns)
+
+
+def _plain(value):
+    return value.isoformat() if isinstance(value, date) else value
+
+
+def _before(obj, columns) -> dict:
+    return {key: _plain(value) for key, value in history_before(obj, columns).items()}
+
+
+def _after(obj, columns) -> dict:
+    return {key: _plain(getattr(obj, key)) for key in columns}
+
+
+def _owner(entity: str, obj_id: int, values: dict) -> int:
+    return obj_id if entity == 'user' else values['user_id']
+
+
+def _flush_time(bind):
+    # When the row was written, not when its transaction began (Postgres now())
+    return func.clock_timestamp() if bind.dialect.name == 'postgresql' else func.now()
+
+
+def _db_now(bind):
+    # The database's clock, comparable with created_at
+    return cast(func.now(), DateTime) if bind.dialect.name == 'postgresql' else func.now()
+
+
+def _insert(conn, rows: list):
+    if rows:
+        conn.execute(insert(ChangeLog).values(created_at=_flush_time(conn)), rows)
+
+
+def _row(entity: str, entity_id: int, user_id: int, op: str, before=None, after=None) -> dict:
+    return {'entity': entity, 'entity_id': entity_id, 'user_id': user_id, 'op': op,
+            'before': before, 'after': after}
+
+
+@event.listens_for(Session, 'after_flush')
+def _log_flush(session, flush_context):
+    rows = []
+    for obj in session.new:
+        tracked = TRACKED.get(type(obj))
+        if tracked:
+            entity, columns = tracked
+            after = _after(obj, columns)
+            rows.append(_row(entity, obj.id, _owner(entity, obj.id, after), 'insert', after=after))
+    for obj in session.deleted:
+        tracked = TRACKED.get(type(obj))
+        if tracked:
+            entity, columns = tracked
+            before = _before(obj, columns)
+            rows.append(_row(entity, obj.id, _owner(entity, obj.id, before), 'delete', before=before))
+    for obj in session.dirty:
+        tracked = TRACKED.get(type(obj))
+        if tracked and session.is_modified(obj):
+            entity, columns = tracked
+            before, after = _before(obj, columns), _after(obj, columns)
+            if before != after:
+                rows.append(_row(entity, obj.id, _owner(entity, obj.id, after), 'update', before, after))
+    _insert(session.connection(), rows)
+
+
+def record(entity: str, entity_id: int, user_id: int, op: str, before=None, after=None):
+    """Log a change made outside the ORM, in the current session's transaction."""
+    _insert(db.session.connection(), [_row(entity, entity_id, user_id, op, before, after)])
+
+
+def record_rows(model, condition, op: str, values: dict = None) -> int:
+    """Log `op` on every `model` row `condition` matches, before a Core UPDATE/DELETE of the same rows.
+
+    `values` are the columns an update sets. Rows are locked (on Postgres)
+    until the caller commits, so the log and the statement see the same rows.
+    """
+    entity, columns = TRACKED[model]
+    rows = []
+    for row in db.session.execute(
+        select(model.id, *(getattr(model, c) for c in columns)).where(condition).with_for_update()
+    ):
+        before = {key: _plain(getattr(row, key)) for key in columns}
+        after = None if op == 'delete' else {**before, **{k: _plain(v) for k, v in (values or {}).items()
+                                                           if k in before}}
+        if after != before:
+            rows.append(_row(entity, row.id, _owner(entity, row.id, before), op, before, after))
+    _insert(db.session.connection(), rows)
+    return len(rows)
+
+
+# Reading
+
+def _as_dict(change: ChangeLog) -> dict:
+    return {'id': change.id, 'entity': change.entity, 'entity_id': change.entity_id,
+            'user_id': change.user_id, 'op': change.op, 'before': change.before, 'after': change.after,
+            'at': change.created_at.isoformat()}
+
+
+def _open_transactions(conn):
+    # (now, start of the oldest other transaction open in this database or None)
+    conn.execute(text('SELECT pg_stat_clear_snapshot()'))
+    return conn.execute(text("""
+        SELECT CAST(clock_timestamp() AS timestamp), CAST(min(xact_start) AS timestamp)
+        FROM pg_stat_activity
+        WHERE datname = current_database() AND pid <> pg_backend_pid()
+    """)).one()
+
+
+def _gap_final(change: ChangeLog, now, oldest) -> bool:
+    # Whoever holds an id below `change`'s took it, inside an open
+    # transaction, before `change` was written. If `change` predates the
+    # sample and every transaction open at the sample began after it, that
+    # holder has finished.
+    return change.created_at < now and (oldest is None or oldest > change.created_at)
+
+
+def read_changes(after: int = 0, limit: int = CHANGE_BATCH) -> list:
+    """Up to `limit` changes with ids above `after`, oldest first, as dicts.
+
+    Stops before a gap in the ids that may still be filled by a transaction
+    that has not committed yet.
+    """
+    conn = db.session.connection()
+    # Sampled before the rows are read: a transaction that commits in between is then read
+    open_since = _open_transactions(conn) if conn.dialect.name == 'postgresql' else None
+    changes, expected = [], after + 1
+    for change in db.session.execute(
+        select(ChangeLog).where(ChangeLog.id > after).order_by(ChangeLog.id).limit(limit)
+    ).scalars():
+        if change.id != expected and open_since is not None and not _gap_final(change, *open_since):
+            break
+        changes.append(_as_dict(change))
+        expected = change.id + 1
+    return changes
+
+
+def checkpoint(consumer: str) -> int:
+    """Id of the last change `consumer` has processed (0 before the first)."""
+    return db.session.execute(
+        select(ChangeCheckpoint.position).where(ChangeCheckpoint.consumer == consumer)
+    ).scalar() or 0
+
+
+def set_checkpoint(consumer: str, position: int):
+    """Record that `consumer` has processed every change up to `position`, and commit."""
+    if not db.session.execute(update(ChangeCheckpoint).where(ChangeCheckpoint.consumer == consumer)
+                              .values(position=position)).rowcount:
+        db.session.add(ChangeCheckpoint(consumer=consumer, position=position))
+    db.session.commit()
+
+
+def consume(consumer: str, handler, limit: int = CHANGE_BATCH) -> int:
+    """Pass `consumer`'s next batch of changes to `handler`, then advance its checkpoint.
+
+    Returns how many changes were handled (0 when caught up). The checkpoint
+    moves only after `handler` returns, so a batch whose handling crashed is
+    handed over again: handlers must cope with seeing a change twice (each
+    has a unique, increasing id). A handler that writes to this database
+    can leave its writes uncommitted: they commit with the checkpoint.
+    """
+    changes = read_changes(checkpoint(consumer), limit)
+    if changes:
+        handler(changes)
+        set_checkpoint(consumer, changes[-1]['id'])
+    return len(changes)
+
+
+def prune_changes(keep_days: int) -> int:
+    """Delete changes older than `keep_days` that every consumer has processed; commits."""
+    oldest = db.session.execute(select(func.min(ChangeCheckpoint.position))).scalar()
+    cutoff = db.session.execute(select(_db_now(db.session.connection()))).scalar() - timedelta(days=keep_days)
+    condition = [ChangeLog.created_at < cutoff]
+    if oldest is not None:
+        condition.append(ChangeLog.id <= oldest)
+    removed = db.session.execute(delete(ChangeLog).where(*condition)).rowcount
+    db.session.commit()
+    return removed
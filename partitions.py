@@ -0,0 +1,192 @@
+from sqlalchemy import text
+from datetime import date
+import re
+
+# Declarative range partitioning of `transactions` by `date` on Postgres,
+# one partition per month or per year (TRANSACTION_PARTITIONS). Queries that
+# bound `date` with plain range predicates (date >= start AND date < end)
+# only touch the partitions in that range, each partition keeps its own
+# small indexes, and a closed period leaves the table by dropping its
+# partition instead of deleting and vacuuming its rows (archive.py). The
+# primary key becomes (id, date), as Postgres requires the partition key in
+# it; ids still come from the one sequence, so they stay unique.
+#
+# Rows dated outside every partition land in DEFAULT_PARTITION rather than
+# failing. archive_transactions.py keeps PARTITIONS_AHEAD months of
+# partitions created ahead of today, and moves any such rows when it
+# creates their partition.
+
+# Partition sizes TRANSACTION_PARTITIONS accepts
+INTERVALS = ('month', 'year')
+# Months of partitions kept created ahead of today
+PARTITIONS_AHEAD = 3
+DEFAULT_PARTITION = 'transactions_default'
+
+_BOUNDS = re.compile(r"FROM \('([\d-]+)'\) TO \('([\d-]+)'\)")
+
+
+def add_months(day: date, months: int) -> date:
+    """First day of the month `months` after day's month."""
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_bounds(day: date, interval: str):
+    """[start, end) of the partition holding `day`."""
+    if interval == 'year':
+        return date(day.year, 1, 1), date(day.year + 1, 1, 1)
+    start = day.replace(day=1)
+    return start, add_months(start, 1)
+
+
+def partition_name(start: date, interval: str) -> str:
+    if interval == 'year':
+        return f'transactions_p{start.year}'
+    return f'transactions_p{start.year}_{start.month:02d}'
+
+
+def is_partitioned(conn) -> bool:
+    return conn.execute(text("""
+        SELECT EXISTS (SELECT 1 FROM pg_partitioned_table pt
+                       JOIN pg_class c ON c.oid = pt.partrelid
+                       WHERE c.relname = 'transactions')
+    """)).scalar()
+
+
+def list_partitions(conn) -> list:
+    """[(name, start, end), ...] of the range partitions, oldest first; the default one is left out."""
+    found = []
+    for name, bound in conn.execute(text("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = 'transactions'
+    """)):
+        match = _BOUNDS.search(bound)
+        if match:
+            found.append((name, date.fromisoformat(match.group(1)), date.fromisoformat(match.group(2))))
+    return sorted(found, key=lambda p: p[1])
+
+
+def partition_interval(conn):
+    """'month' or 'year', from the existing partitions; None if there are none."""
+    partitions = list_partitions(conn)
+    if not partitions:
+        return None
+    _, start, end = partitions[-1]
+    return 'year' if (end - start).days > 31 else 'month'
+
+
+def _insertable_columns(conn, table: str) -> str:
+    # Generated columns (a search vector added before it became a plain column) are computed, never inserted
+    return ', '.join(conn.execute(text("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_name = :table AND is_generated = 'NEVER'
+        ORDER BY ordinal_position
+    """), {"table": table}).scalars())
+
+
+def _create_partition(conn, name: str, start: date, end: date):
+    stray = conn.execute(text(
+        f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} WHERE date >= :start AND date < :end)"
+    ), {"start": start, "end": end}).scalar()
+    if not stray:
+        conn.execute(text(
+            f"CREATE TABLE {name} PARTITION OF transactions FOR VALUES FROM ('{start}') TO ('{end}')"
+        ))
+        return
+    # Postgres refuses a partition whose rows still sit in the default one: move them across
+    columns = _insertable_columns(conn, 'transactions')
+    conn.execute(text(
+        f"CREATE TEMP TABLE transactions_stray ON COMMIT DROP AS "
+        f"SELECT {columns} FROM {DEFAULT_PARTITION} WHERE date >= :start AND date < :end"
+    ), {"start": start, "end": end})
+    conn.execute(text(f"DELETE FROM {DEFAULT_PARTITION} WHERE date >= :start AND date < :end"),
+                 {"start": start, "end": end})
+    conn.execute(text(
+        f"CREATE TABLE {name} PARTITION OF transactions FOR VALUES FROM ('{start}') TO ('{end}')"
+    ))
+    conn.execute(text(f"INSERT INTO transactions ({columns}) SELECT {columns} FROM transactions_stray"))
+
+
+def ensure_partitions(conn, start: date, end: date, interval: str) -> list:
+    """Create the missing partitions covering [start, end); returns their names. The caller commits."""
+    existing = {name for name, _, _ in list_partitions(conn)}
+    created = []
+    lo = partition_bounds(start, interval)[0]
+    while lo < end:
+        hi = partition_bounds(lo, interval)[1]
+        name = partition_name(lo, interval)
+        if name not in existing:
+            _create_partition(conn, name, lo, hi)
+            created.append(name)
+        lo = hi
+    return created
+
+
+def drop_partition(conn, name: str):
+    # Detached first, so the parent is locked only while the partition is unhooked
+    conn.execute(text(f"ALTER TABLE transactions DETACH PARTITION {name}"))
+    conn.execute(text(f"DROP TABLE {name}"))
+
+
+def convert_to_partitioned(conn, interval: str, today: date = None) -> list:
+    """Rebuild `transactions` as a table partitioned by `date`; returns the partitions created.
+
+    Copies every row in one transaction, holding an exclusive lock on the
+    table throughout: run it in a maintenance window. The caller commits.
+    """
+    today = today or date.today()
+    conn.execute(text("LOCK TABLE transactions IN ACCESS EXCLUSIVE MODE"))
+    columns = _insertable_columns(conn, 'transactions')
+    sequence = conn.execute(text("SELECT pg_get_serial_sequence('transactions', 'id')")).scalar()
+    indexes = conn.execute(text("""
+        SELECT i.relname, pg_get_indexdef(x.indexrelid)
+        FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid
+        WHERE x.indrelid = 'transactions'::regclass AND NOT x.indisprimary
+    """)).all()
+    foreign_keys = conn.execute(text("""
+        SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+        WHERE conrelid = 'transactions'::regclass AND contype = 'f'
+    """)).all()
+    # Row triggers (the search vector's) stay with the old table; BEFORE ROW
+    # triggers on a partitioned table need Postgres 13+
+    triggers = conn.execute(text("""
+        SELECT pg_get_triggerdef(oid) FROM pg_trigger
+        WHERE tgrelid = 'transactions'::regclass AND NOT tgisinternal
+    """)).scalars().all()
+    first, last = conn.execute(text("SELECT min(date), max(date) FROM transactions")).one()
+
+    conn.execute(text("ALTER TABLE transactions RENAME TO transactions__unpartitioned"))
+    # Their names are reused on the new table
+    for name, _ in indexes:
+        conn.execute(text(f'DROP INDEX "{name}"'))
+    for name, _ in foreign_keys:
+        conn.execute(text(f'ALTER TABLE transactions__unpartitioned DROP CONSTRAINT "{name}"'))
+
+    conn.execute(text(
+        "CREATE TABLE transactions (LIKE transactions__unpartitioned "
+        "INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING CONSTRAINTS) PARTITION BY RANGE (date)"
+    ))
+    conn.execute(text("ALTER TABLE transactions ADD PRIMARY KEY (id, date)"))
+    for name, definition in foreign_keys:
+        conn.execute(text(f'ALTER TABLE transactions ADD CONSTRAINT "{name}" {definition}'))
+    # Created on the parent, so every partition gets them; the definitions name public.transactions
+    for _, definition in indexes:
+        conn.execute(text(definition))
+    conn.execute(text(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF transactions DEFAULT"))
+    created = ensure_partitions(conn, min(first or today, today),
+                                add_months(max(last or today, today), PARTITIONS_AHEAD + 1), interval)
+
+    conn.execute(text(
+        f"INSERT INTO transactions ({columns}) SELECT {columns} FROM transactions__unpartitioned"
+    ))
+    # After the copy, which brings the values they would compute
+    for definition in triggers:
+        conn.execute(text(definition))
+    if sequence:
+        # The sequence would otherwise be dropped with the old table
+        conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY transactions.id"))
+    conn.execute(text("DROP TABLE transactions__unpartitioned"))
+    return created
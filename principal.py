@@ -0,0 +1,133 @@
+from flask_login import UserMixin
+from models import db, User
+from sqlalchemy import select, event
+from sqlalchemy.orm import Session
+from collections import OrderedDict
+import threading
+import time
+
+# Flask-Login's view of the logged-in user. Every authenticated request
+# (every /api poll included) needs the user's id and role, and every page
+# their base currency. These come from a small per-process cache of
+# Principals instead of a users query and a User object per request. The
+# User row is loaded only when a view reads something else
+# (current_user.email) or changes the user (current_user.user). Users
+# changed through the ORM in this process are forgotten when the change
+# commits; bulk statements call forget_users() themselves. Other worker
+# processes see changes within PRINCIPAL_TTL.
+
+# Seconds a cached principal is served before it is read again
+PRINCIPAL_TTL = 30
+# Principals kept per process
+PRINCIPAL_CACHE_SIZE = 10000
+
+
+class Principal(UserMixin):
+    """id, username, role and base_currency of a user; any other attribute is read from their User row."""
+
+    __slots__ = ('id', 'username', 'role', 'base_currency')
+
+    def __init__(self, id: int, username: str, role: str, base_currency: str):
+        self.id = id
+        self.username = username
+        self.role = role
+        self.base_currency = base_currency
+
+    @property
+    def user(self) -> User:
+        # Not kept on the principal, which is shared between requests; the
+        # session's identity map makes repeated calls within a request free
+        return db.session.get(User, self.id)
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.user, name)
+
+
+class PrincipalCache:
+    """Least-recently-used cache of Principals by user id, with a time-to-live."""
+
+    def __init__(self, size: int = PRINCIPAL_CACHE_SIZE, ttl: float = PRINCIPAL_TTL):
+        self.size = size
+        self.ttl = ttl
+        self.hits = self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # user_id -> (loaded_at, Principal)
+        self._epoch = 0  # bumped by forget()
+
+    def get(self, user_id: int, load):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and now - entry[0] < self.ttl:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            epoch = self._epoch
+        principal = load(user_id)
+        with self._lock:
+            self.misses += 1
+            # Not kept if missing (ids can be reused) or if a forget() ran while
+            # it was read: it may predate the change that was forgotten
+            if principal is not None and epoch == self._epoch:
+                self._entries[user_id] = (now, principal)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self.size:
+                    self._entries.popitem(last=False)
+        return principal
+
+    def forget(self, user_ids):
+        with self._lock:
+            self._epoch += 1
+            for user_id in user_ids:
+                self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._entries.clear()
+
+
+principals = PrincipalCache()
+
+
+def _load(user_id: int):
+    row = db.session.execute(
+        select(User.id, User.username, User.role, User.base_currency).where(User.id == user_id)
+    ).first()
+    return Principal(*row) if row is not None else None
+
+
+def load_principal(user_id: int):
+    """The Principal of user_id, None if there is no such user."""
+    return principals.get(user_id, _load)
+
+
+def forget_users(user_ids):
+    """Drop cached principals of users changed or deleted outside the ORM; call after the commit."""
+    principals.forget(user_ids)
+
+
+@event.listens_for(Session, 'after_flush')
+def _note_changed_users(session, flush_context):
+    ids = {u.id for u in (*session.dirty, *session.deleted) if isinstance(u, User)}
+    if ids:
+        session.info.setdefault('changed_users', set()).update(ids)
+
+
+@event.listens_for(Session, 'after_commit')
+def _forget_changed_users(session):
+    if session.in_nested_transaction():
+        # A savepoint was released; the change is not committed yet
+        return
+    ids = session.info.pop('changed_users', None)
+    if ids:
+        forget_users(ids)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_changed_users(session):
+    if session.in_nested_transaction():
+        return
+    session.info.pop('changed_users', None)
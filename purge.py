@@ -0,0 +1,77 @@
+from models import db, User, Transaction
+from principal import forget_users
+from archive import delete_archived
+from outbox import record
+from sqlalchemy import select, delete
+from flask import current_app
+import threading
+import logging
+
+log = logging.getLogger(__name__)
+
+
+def _has_more_transactions_than(user_id: int, n: int) -> bool:
+    # Probe for row n+1 instead of COUNT(*) over the whole history
+    row = db.session.execute(
+        select(Transaction.id).where(Transaction.user_id == user_id).offset(n).limit(1)
+    ).first()
+    return row is not None
+
+
+def purge_user_transactions(user_id: int, chunk_size: int) -> int:
+    """Delete a user's transactions in short, separately committed chunks."""
+    removed = 0
+    while True:
+        ids = select(Transaction.id).where(Transaction.user_id == user_id).limit(chunk_size)
+        result = db.session.execute(
+            delete(Transaction).where(Transaction.id.in_(ids)),
+            execution_options={'synchronize_session': False}
+        )
+        db.session.commit()
+        if not result.rowcount:
+            return removed
+        removed += result.rowcount
+
+
+def _purge_in_background(app, user_id: int, chunk_size: int):
+    with app.app_context():
+        try:
+            removed = purge_user_transactions(user_id, chunk_size)
+            # Remaining children (goal) go with the user row through ON DELETE CASCADE
+            db.session.execute(delete(User).where(User.id == user_id))
+            # One entry for the user and everything they owned
+            record('user', user_id, user_id, 'delete')
+            db.session.commit()
+            forget_users([user_id])
+            delete_archived(user_id)
+            log.info('Purged user %s (%s transactions)', user_id, removed)
+        except Exception:
+            db.session.rollback()
+            log.exception('Purge of user %s failed', user_id)
+
+
+def delete_user_account(user: User) -> bool:
+    """Delete a user and everything they own.
+
+    Small accounts are deleted inline and the database cascades to their
+    transactions, rollups and goal; archived transactions are deleted from
+    the archive after the commit. Accounts above PURGE_ASYNC_THRESHOLD are purged by a
+    background thread in chunks; returns True when that happened.
+    """
+    app = current_app._get_current_object()
+    threshold = app.config.get('PURGE_ASYNC_THRESHOLD', 50000)
+    if not _has_more_transactions_than(user.id, threshold):
+        user_id = user.id
+        db.session.delete(user)
+        db.session.commit()
+        delete_archived(user_id)
+        return False
+
+    worker = threading.Thread(
+        target=_purge_in_background,
+        args=(app, user.id, app.config.get('PURGE_CHUNK_SIZE', 5000)),
+        name=f'purge-user-{user.id}',
+        daemon=True
+    )
+    worker.start()
+    return True
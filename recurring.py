@@ -0,0 +1,261 @@
+from models import db, Transaction
+from categories import category_names
+from money import from_cents
+from txframe import CHUNK_SIZE
+from anomalies import group_median
+from fx import to_owner_currencies
+from sqlalchemy import select
+from datetime import date
+import numpy as np
+import re
+
+# Recurring bills and income, and a day-by-day cash-flow projection built on
+# them. Transactions are grouped by a hash of (user, type, normalized note,
+# category, currency, amount band); each group's dates are sorted once and the
+# gaps between consecutive rows decide its period. No pairs of rows are
+# compared. Amounts are banded in the currency they were paid in and
+# projected in the owner's base currency.
+
+# Fewest occurrences before a group counts as recurring
+MIN_OCCURRENCES = 3
+# Relative width of an amount band (amounts within ~10% share a band)
+AMOUNT_BAND = 0.10
+# Days of non-recurring history averaged into the daily variable flow
+VARIABLE_DAYS = 90
+# Projection length bounds, in days
+MIN_HORIZON, MAX_HORIZON = 30, 90
+
+# name: (step, unit, typical gap in days, tolerance in days)
+PERIODS = {
+    'weekly':    (7, 'D', 7.0, 1.5),
+    'biweekly':  (14, 'D', 14.0, 2.0),
+    'monthly':   (1, 'M', 30.44, 3.5),
+    'quarterly': (3, 'M', 91.31, 7.0),
+    'yearly':    (12, 'M', 365.25, 10.0),
+}
+_PERIOD_NAMES = list(PERIODS)
+
+# Reference numbers, dates and punctuation that vary between occurrences
+_NOTE_NOISE = re.compile(r'[\d#*/\\\-_.:,()]+')
+
+
+def normalize_note(note) -> str:
+    return ' '.join(_NOTE_NOISE.sub(' ', (note or '').casefold()).split())
+
+
+def _load_rows(user_ids=None):
+    # Columns for every transaction of the given users (all users for None), oldest first
+    stmt = select(
+        Transaction.user_id, Transaction.date, Transaction.amount_cents, Transaction.type,
+        Transaction.category_id, Transaction.note, Transaction.currency
+    ).order_by(Transaction.date, Transaction.id)
+    if user_ids is not None:
+        stmt = stmt.where(Transaction.user_id.in_(user_ids))
+
+    owners, dates, cents, incomes, keys, notes, currencies = [], [], [], [], [], [], []
+    key_codes = {}
+    band_base = np.log1p(AMOUNT_BAND)
+    for rows in db.session.execute(stmt).partitions(CHUNK_SIZE):
+        n = len(rows)
+        u, d, a, t, c, o, cur = zip(*rows)
+        a = np.fromiter(a, dtype=np.int64, count=n)
+        bands = np.rint(np.log(np.maximum(a, 1)) / band_base).astype(np.int64)
+        owners.append(np.fromiter(u, dtype=np.int64, count=n))
+        dates.append(np.array(d, dtype='datetime64[D]'))
+        cents.append(a)
+        incomes.append(np.fromiter((x == 'income' for x in t), dtype=bool, count=n))
+        # Hash grouping: one dict lookup per row
+        keys.append(np.fromiter(
+            (key_codes.setdefault((ui, ti, normalize_note(oi), ci, xi, int(bi)), len(key_codes))
+             for ui, ti, oi, ci, xi, bi in zip(u, t, o, c, cur, bands)),
+            dtype=np.int64, count=n
+        ))
+        notes.extend(o)
+        currencies.append(np.array(cur, dtype='U3'))
+
+    if not owners:
+        return None
+    key_list = list(key_codes)
+    owner, day = np.concatenate(owners), np.concatenate(dates)
+    return {
+        'owner': owner,
+        'date': day,
+        'cents': to_owner_currencies(np.concatenate(cents), day, np.concatenate(currencies), owner),
+        'income': np.concatenate(incomes),
+        'key': np.concatenate(keys),
+        'category_id': [k[3] for k in key_list],
+        'notes': notes,
+        'n_keys': len(key_list),
+    }
+
+
+def _classify(gaps):
+    # Period index per median gap, -1 where none fits
+    table = np.array([(p[2], p[3]) for p in PERIODS.values()])
+    distance = np.abs(gaps[:, None] - table[None, :, 0])
+    best = distance.argmin(axis=1)
+    fits = distance[np.arange(len(gaps)), best] <= table[best, 1]
+    return np.where(fits, best, -1)
+
+
+def find_recurring(rows, today: date):
+    """Recurring groups among loaded rows, as parallel arrays keyed by group.
+
+    A group recurs when it has MIN_OCCURRENCES rows, its median gap matches
+    one of PERIODS, the gaps stay within that period's tolerance, and it is
+    not overdue by more than half a period.
+    """
+    key, dates = rows['key'], rows['date'].astype(np.int64)
+    n = rows['n_keys']
+    # Rows arrive in date order, so a stable sort by key keeps each group sorted
+    order = np.argsort(key, kind='stable')
+    k, d = key[order], dates[order]
+    same = k[1:] == k[:-1]
+    gap_keys, gaps = k[1:][same], np.diff(d)[same].astype(np.float64)
+
+    counts = np.bincount(key, minlength=n)
+    median_gap, _ = group_median(gap_keys, gaps, n)
+    spread, _ = group_median(gap_keys, np.abs(gaps - median_gap[gap_keys]), n)
+    period = _classify(median_gap)
+    tolerance = np.array([p[3] for p in PERIODS.values()])[period]
+    typical = np.array([p[2] for p in PERIODS.values()])[period]
+
+    # Rows are in date order, so the highest row index is the latest occurrence
+    last_row = np.zeros(n, dtype=np.int64)
+    np.maximum.at(last_row, key, np.arange(len(key)))
+    last = dates[last_row]
+    overdue = np.datetime64(today, 'D').astype(np.int64) - last
+
+    recurring = ((counts >= MIN_OCCURRENCES) & (period >= 0) & (spread <= tolerance) &
+                 (overdue <= typical * 1.5))
+    groups = np.flatnonzero(recurring)
+    amount, _ = group_median(key, rows['cents'].astype(np.float64), n)
+    return {
+        'group': groups,
+        'owner': rows['owner'][last_row[groups]],
+        'income': rows['income'][last_row[groups]],
+        'period': period[groups],
+        'amount': np.rint(amount[groups]).astype(np.int64),
+        'last': last[groups].astype('datetime64[D]'),
+        'last_row': last_row[groups],
+        'count': counts[groups],
+    }
+
+
+def _occurrences(series, today: date, horizon: int):
+    # (series index, day offset 1..horizon) for every projected occurrence
+    start = np.datetime64(today, 'D')
+    end = start + horizon
+    steps = np.array([p[0] for p in PERIODS.values()])[series['period']]
+    by_month = np.array([p[1] == 'M' for p in PERIODS.values()])[series['period']]
+    # Upper bound on occurrences per series inside the horizon (plus catch-up)
+    gap = np.where(by_month, steps * 28, steps)
+    n_k = ((end - series['last']).astype(np.int64) // gap + 1).clip(min=0)
+    idx = np.repeat(np.arange(len(n_k)), n_k)
+    k = np.arange(n_k.sum()) - np.repeat(np.cumsum(n_k) - n_k, n_k) + 1
+
+    last = series['last'][idx]
+    by_day = last + k * steps[idx]
+    # Calendar stepping for month-based periods, same day of month (clamped)
+    month = last.astype('datetime64[M]') + k * steps[idx]
+    dom = (last - last.astype('datetime64[M]').astype('datetime64[D]')).astype(np.int64)
+    month_len = ((month + 1).astype('datetime64[D]') - month.astype('datetime64[D]')).astype(np.int64)
+    by_cal = month.astype('datetime64[D]') + np.minimum(dom, month_len - 1)
+    when = np.where(by_month[idx], by_cal, by_day)
+
+    offset = (when - start).astype(np.int64)
+    keep = (offset >= 1) & (offset <= horizon)
+    return idx[keep], offset[keep]
+
+
+def _project(rows, series, owners, today: date, horizon: int):
+    # (len(owners), horizon) projected end-of-day balances plus their inputs;
+    # owners is sorted
+    owners = np.asarray(owners, dtype=np.int64)
+    n = len(owners)
+    owner_idx = np.searchsorted(owners, rows['owner'])
+    signed = np.where(rows['income'], rows['cents'], -rows['cents'])
+    balance = np.bincount(owner_idx, weights=signed, minlength=n)
+
+    # Everything that is not part of a recurring group, averaged per day
+    recurring_row = np.zeros(rows['n_keys'], dtype=bool)
+    recurring_row[series['group']] = True
+    since = np.datetime64(today, 'D') - VARIABLE_DAYS
+    variable = ~recurring_row[rows['key']] & (rows['date'] > since)
+    daily = np.bincount(owner_idx[variable], weights=signed[variable], minlength=n) / VARIABLE_DAYS
+
+    flow = np.tile(daily[:, None], (1, horizon))
+    idx, offset = _occurrences(series, today, horizon)
+    series_owner = np.searchsorted(owners, series['owner'])
+    series_signed = np.where(series['income'], series['amount'], -series['amount'])
+    np.add.at(flow, (series_owner[idx], offset - 1), series_signed[idx])
+    return balance, daily, balance[:, None] + np.cumsum(flow, axis=1), (idx, offset)
+
+
+def _clamp_horizon(days) -> int:
+    return max(MIN_HORIZON, min(MAX_HORIZON, int(days)))
+
+
+def cash_flow_projection(user_id: int, days: int = 60, today: date = None):
+    """Recurring transactions and a day-by-day projected balance for one user."""
+    today = today or date.today()
+    horizon = _clamp_horizon(days)
+    start = np.datetime64(today, 'D')
+    dates = [str(d) for d in start + np.arange(1, horizon + 1)]
+
+    rows = _load_rows([user_id])
+    if rows is None:
+        return {'days': horizon, 'start_balance': 0.0, 'daily_variable': 0.0,
+                'dates': dates, 'balance': [0.0] * horizon, 'recurring': []}
+
+    series = find_recurring(rows, today)
+    balance, daily, curve, (idx, offset) = _project(rows, series, [user_id], today, horizon)
+
+    next_offset = np.full(len(series['group']), horizon + 1)
+    np.minimum.at(next_offset, idx, offset)
+    names = category_names([rows['category_id'][g] for g in series['group']])
+    recurring = [{
+        'label': rows['notes'][series['last_row'][i]] or names[rows['category_id'][g]],
+        'category': names[rows['category_id'][g]],
+        'type': 'income' if series['income'][i] else 'expense',
+        'amount': from_cents(series['amount'][i]),
+        'period': _PERIOD_NAMES[series['period'][i]],
+        'last_date': str(series['last'][i]),
+        'next_date': str(start + next_offset[i]) if next_offset[i] <= horizon else None,
+        'occurrences': int(series['count'][i]),
+    } for i, g in enumerate(series['group'])]
+    recurring.sort(key=lambda r: (r['next_date'] is None, r['next_date'] or '', -r['amount']))
+
+    return {
+        'days': horizon,
+        'start_balance': from_cents(balance[0]),
+        'daily_variable': round(daily[0] / 100, 2),
+        'dates': dates,
+        'balance': [round(float(b) / 100, 2) for b in curve[0]],
+        'recurring': recurring,
+    }
+
+
+def batch_cash_flow(user_ids=None, days: int = 60, today: date = None):
+    """Projected end and lowest balances for many users from one load and one projection.
+
+    Returns {user_id: {'end_balance', 'min_balance', 'min_date', 'recurring'}}.
+    """
+    today = today or date.today()
+    horizon = _clamp_horizon(days)
+    rows = _load_rows(None if user_ids is None else list(user_ids))
+    if rows is None:
+        return {}
+    owners = np.unique(rows['owner'])
+    series = find_recurring(rows, today)
+    _, _, curve, _ = _project(rows, series, owners, today, horizon)
+
+    start = np.datetime64(today, 'D')
+    lowest = curve.argmin(axis=1)
+    per_owner = np.bincount(np.searchsorted(owners, series['owner']), minlength=len(owners))
+    return {int(u): {
+        'end_balance': round(float(curve[i, -1]) / 100, 2),
+        'min_balance': round(float(curve[i, lowest[i]]) / 100, 2),
+        'min_date': str(start + int(lowest[i]) + 1),
+        'recurring': int(per_owner[i]),
+    } for i, u in enumerate(owners)}
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+TrackFlow Budget Rollover
+Re-sums this month's spending into every budget in one batch
+
+Budgets roll over lazily the first time their owner looks at them in a new
+month; run this from cron on the 1st to do it for everyone at once, or after
+changing transactions directly in the database.
+
+Usage:
+    python rollover_budgets.py
+"""
+
+import sys
+import time
+
+from sqlalchemy.exc import SQLAlchemyError
+
+def main():
+    """Main function"""
+    print("TrackFlow Budget Rollover")
+    print("=" * 50)
+
+    from app import app
+    from budgets import recompute_budgets
+
+    try:
+        with app.app_context():
+            print("Database URL:", app.config['SQLALCHEMY_DATABASE_URI'])
+            started = time.perf_counter()
+            updated = recompute_budgets()
+            print(f"Recomputed {updated} budget(s) in {time.perf_counter() - started:.2f} s")
+    except SQLAlchemyError as e:
+        print(f"Database error: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+from models import db, Transaction
+from sqlalchemy import select, text, table, literal_column, func, or_
+import re
+
+# Full-text search over Transaction.note and Transaction.category.
+#
+#   Postgres: tsvector column kept current by a trigger + GIN index; on a
+#             table with rows, migrate.py fills it in batches and builds
+#             the index concurrently, and search stays on LIKE until the
+#             index is valid
+#   SQLite:   contentless FTS5 table kept in sync by triggers; the owning
+#             user is indexed as a token so one user's matches are found
+#             inside the index instead of across every user's rows
+#   other:    case-insensitive LIKE fallback (unindexed)
+
+SQLITE_FTS_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS transactions_fts USING fts5(
+        user_id, note, category, content='',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS transactions_fts_ai AFTER INSERT ON transactions BEGIN
+        INSERT INTO transactions_fts (rowid, user_id, note, category)
+        VALUES (new.id, new.user_id, new.note, new.category);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS transactions_fts_ad AFTER DELETE ON transactions BEGIN
+        INSERT INTO transactions_fts (transactions_fts, rowid, user_id, note, category)
+        VALUES ('delete', old.id, old.user_id, old.note, old.category);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS transactions_fts_au AFTER UPDATE OF user_id, note, category ON transactions BEGIN
+        INSERT INTO transactions_fts (transactions_fts, rowid, user_id, note, category)
+        VALUES ('delete', old.id, old.user_id, old.note, old.category);
+        INSERT INTO transactions_fts (rowid, user_id, note, category)
+        VALUES (new.id, new.user_id, new.note, new.category);
+    END""",
+]
+
+# Rows that predate the FTS table
+SQLITE_FTS_FILL = """INSERT INTO transactions_fts (rowid, user_id, note, category)
+    SELECT id, user_id, note, category FROM transactions"""
+
+
+# The indexed text, over the row itself or, inside the trigger, over NEW
+POSTGRES_SEARCH_VECTOR = "to_tsvector('simple', coalesce({row}note, '') || ' ' || coalesce({row}category, ''))"
+
+POSTGRES_FTS_FUNCTION = f"""CREATE OR REPLACE FUNCTION transactions_search_vector() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector := {POSTGRES_SEARCH_VECTOR.format(row='NEW.')};
+        RETURN NEW;
+    END $$ LANGUAGE plpgsql"""
+
+# CREATE TRIGGER has no IF NOT EXISTS before Postgres 14
+POSTGRES_FTS_TRIGGER = """DO $$ BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger
+                   WHERE tgname = 'transactions_search_vector' AND tgrelid = 'transactions'::regclass) THEN
+        CREATE TRIGGER transactions_search_vector BEFORE INSERT OR UPDATE OF note, category
+            ON transactions FOR EACH ROW EXECUTE FUNCTION transactions_search_vector();
+    END IF;
+END $$"""
+
+# Only for an empty table: migrate.py does the same without blocking writers
+POSTGRES_FTS_DDL = [
+    "ALTER TABLE transactions ADD COLUMN IF NOT EXISTS search_vector tsvector",
+    POSTGRES_FTS_FUNCTION,
+    POSTGRES_FTS_TRIGGER,
+    f"UPDATE transactions SET search_vector = {POSTGRES_SEARCH_VECTOR.format(row='')} WHERE search_vector IS NULL",
+    "CREATE INDEX IF NOT EXISTS ix_transactions_search ON transactions USING GIN (search_vector)",
+]
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+_ready = {}
+
+
+def search_backend(engine) -> str:
+    if engine.dialect.name == 'postgresql':
+        return 'tsvector'
+    if engine.dialect.name == 'sqlite':
+        return 'fts5'
+    return 'like'
+
+
+def _installed(conn, backend) -> bool:
+    if backend == 'fts5':
+        return conn.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE name = 'transactions_fts'"
+        ).first() is not None
+    if backend == 'tsvector':
+        # Not before the index is built: the column is filled first
+        return bool(conn.execute(text("""
+            SELECT x.indisvalid FROM pg_index x JOIN pg_class c ON c.oid = x.indexrelid
+            WHERE c.relname = 'ix_transactions_search'
+        """)).scalar())
+    return True
+
+
+def install_search(engine, only_if_cheap=False) -> bool:
+    """Create the search index structures if missing; True when something was created.
+
+    With only_if_cheap, Postgres tables that already hold rows are left alone:
+    filling the column and building the index takes as long as the table is
+    big, so that goes through migrate.py instead of worker start-up.
+    """
+    backend = search_backend(engine)
+    with engine.connect() as conn:
+        if _installed(conn, backend):
+            _ready[engine.url] = True
+            return False
+        if backend == 'fts5':
+            for ddl in SQLITE_FTS_DDL:
+                conn.exec_driver_sql(ddl)
+            conn.exec_driver_sql(SQLITE_FTS_FILL)
+        elif backend == 'tsvector':
+            if only_if_cheap and conn.execute(text("SELECT 1 FROM transactions LIMIT 1")).first():
+                return False
+            for ddl in POSTGRES_FTS_DDL:
+                conn.execute(text(ddl))
+        conn.commit()
+    _ready[engine.url] = True
+    return True
+
+
+def search_ready(engine) -> bool:
+    if engine.url not in _ready:
+        with engine.connect() as conn:
+            _ready[engine.url] = _installed(conn, search_backend(engine))
+    return _ready[engine.url]
+
+
+def _fts5_query(q: str, user_id: int) -> str:
+    # Every word must match note or category as a prefix; user input never
+    # reaches FTS syntax
+    words = ' '.join(f'"{w}"*' for w in _WORD.findall(q))
+    return f'user_id : "{int(user_id)}" AND {{note category}} : ({words})'
+
+
+def apply_search(query, q: str, user_id: int):
+    """Restrict an ORM query on user_id's transactions to rows matching `q`, best match first.
+
+    Returns the query unchanged when `q` has no searchable words.
+    """
+    if not _WORD.search(q or ''):
+        return query
+    backend = search_backend(db.engine) if search_ready(db.engine) else 'like'
+
+    if backend == 'fts5':
+        fts = select(
+            literal_column('rowid').label('id'),
+            # user_id weighted 0 so it does not skew relevance
+            literal_column('bm25(transactions_fts, 0.0, 1.0, 1.0)').label('rank')
+        ).select_from(table('transactions_fts')).where(
+            text('transactions_fts MATCH :fts_query').bindparams(fts_query=_fts5_query(q, user_id))
+        ).cte().prefix_with('MATERIALIZED')
+        # Materialized so SQLite runs the MATCH once instead of once per candidate
+        # row when the query is wrapped for counting; bm25() is lower-is-better
+        return query.join(fts, fts.c.id == Transaction.id).order_by(fts.c.rank)
+
+    if backend == 'tsvector':
+        tsquery = func.websearch_to_tsquery('simple', q)
+        vector = literal_column('transactions.search_vector')
+        return query.filter(vector.op('@@')(tsquery)).order_by(func.ts_rank_cd(vector, tsquery).desc())
+
+    pattern = f"%{q.strip()}%"
+    return query.filter(or_(Transaction.note.ilike(pattern), Transaction.category.ilike(pattern)))
@@ -23,7 +23,7 @@ def main():
     
     # Step 1: Fix database schema
     print("\n📊 Step 1: Fixing database schema...")
-    if not run_command("python fix_database.py", "Database schema fix"):
+    if not run_command("python migrate.py", "Database schema migration"):
         print("❌ Database fix failed. Please check your database connection.")
         return False
     
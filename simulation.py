@@ -0,0 +1,261 @@
+from models import db, User, Transaction, TransactionRollup, Goal
+from money import from_cents
+from fx import to_owner_currencies, OWNER_LOOKUP_LIMIT
+from txframe import month_labels
+from sqlalchemy import select, func
+from datetime import date
+import archive
+import time
+import numpy as np
+
+# Monte Carlo time-to-goal for savings goals. A user's completed months of
+# net savings (income minus expenses, in their base currency) are resampled
+# in blocks of consecutive months, so a costly December or a quarterly bill
+# stays together, into many simulated futures at once: one (users, paths,
+# months) array of draws, one cumulative sum, and the first month each path
+# covers what is left of Goal.target_amount. There is no per-path Python.
+#
+# The per-user endpoint runs paths in chunks against SIMULATION_BUDGET_MS
+# (measured from the start of the call, history loading included) and stops
+# before a chunk that would overrun it, reporting how many paths it managed.
+# Batch mode stacks every user with a goal into blocks of SIM_BLOCK_ELEMENTS
+# draws instead and has no deadline.
+
+# Completed months of history resampled (older months are ignored)
+HISTORY_MONTHS = 36
+# Fewest completed months before a goal is simulated
+MIN_HISTORY_MONTHS = 3
+# Consecutive months drawn together, once a user has SEASONAL_HISTORY months
+BLOCK_MONTHS = 3
+SEASONAL_HISTORY = 12
+# Paths per user: endpoint default and cap, and per user in batch mode
+DEFAULT_PATHS = 10000
+MAX_PATHS = 100000
+BATCH_PATHS = 1000
+# Months simulated ahead: default and cap
+DEFAULT_HORIZON = 120
+MAX_HORIZON = 360
+# Draws held in memory at once (8 bytes each, plus their indices)
+SIM_BLOCK_ELEMENTS = 1_000_000
+# Reported quantiles of the months until a goal is reached
+QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+
+budget_seconds = 0.25
+
+
+def configure(config):
+    """Apply SIMULATION_BUDGET_MS from the app config."""
+    global budget_seconds
+    budget_seconds = config['SIMULATION_BUDGET_MS'] / 1000
+
+
+def _this_month(today: date) -> np.datetime64:
+    return np.datetime64(today, 'M')
+
+
+def load_monthly_net(user_ids=None, today: date = None):
+    """Completed months of net savings per user (all users for None), in base-currency cents.
+
+    Returns (user ids, net, lengths): net is (users, HISTORY_MONTHS) with
+    the last completed month in the last column, and a user's series starts
+    lengths[i] columns from the end, at their first month with any
+    transaction. Months inside that span without transactions count as 0.
+    """
+    end = _this_month(today or date.today())
+    start = end - HISTORY_MONTHS
+    bounds = (Transaction.date >= start.astype(date), Transaction.date < end.astype(date))
+    if user_ids is not None:
+        bounds += (Transaction.user_id.in_(list(user_ids)),)
+    total = func.sum(Transaction.amount_cents)
+
+    owners, incomes, months, cents = [], [], [], []
+
+    def collect(rows, convert):
+        if not rows:
+            return
+        u, t, cur, d, a = zip(*rows)
+        u = np.fromiter(u, dtype=np.int64, count=len(rows))
+        d = np.array(d, dtype='datetime64[D]')
+        a = np.fromiter(a, dtype=np.int64, count=len(rows))
+        owners.append(u)
+        incomes.append(np.array(t) == 'income')
+        months.append(d.astype('datetime64[M]'))
+        cents.append(to_owner_currencies(a, d, np.array(cur, dtype='U3'), u) if convert else a)
+
+    # Base-currency rows summed per month by the database; the rest per day, then converted
+    month = archive.month_start(Transaction.date)
+    collect(db.session.execute(
+        select(Transaction.user_id, Transaction.type, User.base_currency, month, total)
+        .join(User, User.id == Transaction.user_id)
+        .where(Transaction.currency == User.base_currency, *bounds)
+        .group_by(Transaction.user_id, Transaction.type, User.base_currency, month)
+    ).all(), False)
+    collect(db.session.execute(
+        select(Transaction.user_id, Transaction.type, Transaction.currency, Transaction.date, total)
+        .join(User, User.id == Transaction.user_id)
+        .where(Transaction.currency != User.base_currency, *bounds)
+        .group_by(Transaction.user_id, Transaction.type, Transaction.currency, Transaction.date)
+    ).all(), True)
+    if archive.enabled():
+        # Archived months, converted at the rate of their first day as archive.py does
+        where = [TransactionRollup.month >= start.astype(date), TransactionRollup.month < end.astype(date)]
+        if user_ids is not None:
+            where.append(TransactionRollup.user_id.in_(list(user_ids)))
+        keys = [TransactionRollup.user_id, TransactionRollup.type, TransactionRollup.currency,
+                TransactionRollup.month]
+        collect(db.session.execute(
+            select(*keys, func.sum(TransactionRollup.amount_cents)).where(*where).group_by(*keys)
+        ).all(), True)
+
+    if not owners:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, HISTORY_MONTHS), dtype=np.int64), np.zeros(0, dtype=np.int64)
+    owner = np.concatenate(owners)
+    amount = np.where(np.concatenate(incomes), 1, -1) * np.concatenate(cents)
+    column = (np.concatenate(months) - start).astype(np.int64)
+    ids, user_idx = np.unique(owner, return_inverse=True)
+    net = np.zeros((len(ids), HISTORY_MONTHS), dtype=np.int64)
+    np.add.at(net, (user_idx, column), amount)
+    first = np.full(len(ids), HISTORY_MONTHS)
+    np.minimum.at(first, user_idx, column)
+    return ids, net, HISTORY_MONTHS - first
+
+
+def simulate_months(net, lengths, remaining, paths: int, horizon: int, rng, block: int = 1):
+    """Months until each simulated path has saved `remaining` cents, inf when it does not within `horizon`.
+
+    `net` and `lengths` are as load_monthly_net() returns them, for the
+    users being simulated; `remaining` holds one amount per user. Each path
+    strings together random runs of `block` consecutive months, wrapping
+    around the end of the user's history. Returns a (users, paths) array.
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    n_users, width = net.shape
+    rows = np.arange(n_users)[:, None]
+    # Each history followed by its first block - 1 months, so a run starting
+    # near the end wraps around without a modulo over every draw
+    wrapped = np.concatenate([net, net[rows, (width - lengths)[:, None] + np.arange(block - 1)]], axis=1)
+    first = (rows[:, 0] * wrapped.shape[1] + width - lengths)[:, None, None]
+
+    n_blocks = -(-horizon // block)
+    # float32 draws are plenty for a history of at most HISTORY_MONTHS months
+    starts = (rng.random((n_users, paths, n_blocks), dtype=np.float32) * lengths[:, None, None]).astype(np.int64)
+    flat = (starts + first)[..., None] + np.arange(block)
+    draws = np.take(wrapped.ravel(), flat.reshape(n_users, paths, -1)[..., :horizon])
+    balance = np.cumsum(draws, axis=2, out=draws)
+    hit = balance >= np.asarray(remaining)[:, None, None]
+    return np.where(hit.any(axis=2), hit.argmax(axis=2) + 1.0, np.inf)
+
+
+def _block_for(length: int) -> int:
+    return BLOCK_MONTHS if length >= SEASONAL_HISTORY else 1
+
+
+def _quantiles(months, quantiles, axis=-1):
+    # Months by which each share of paths has reached the goal (inf: that share never does)
+    return np.quantile(months, quantiles, axis=axis, method='inverted_cdf')
+
+
+def _goal_amounts(goal) -> tuple:
+    return goal.target_amount_cents or 0, goal.achieved_cents or 0
+
+
+def simulate_goal(user_id: int, paths: int = DEFAULT_PATHS, horizon: int = DEFAULT_HORIZON,
+                  today: date = None, seed=None) -> dict:
+    """Chance and likely time of reaching user_id's savings goal, within SIMULATION_BUDGET_MS.
+
+    `status` is 'simulated', or says why not: 'no_goal' (no target amount
+    set), 'reached', or 'insufficient_history'.
+    """
+    started = time.perf_counter()
+    deadline = started + budget_seconds
+    paths = max(1, min(paths, MAX_PATHS))
+    horizon = max(1, min(horizon, MAX_HORIZON))
+    today = today or date.today()
+
+    goal = db.session.execute(select(Goal).where(Goal.user_id == user_id)).scalar()
+    target, achieved = _goal_amounts(goal) if goal else (0, 0)
+    result = {'target': from_cents(target), 'achieved': from_cents(achieved),
+              'remaining': from_cents(max(0, target - achieved))}
+    if target <= 0:
+        return {'status': 'no_goal', **result}
+    if achieved >= target:
+        return {'status': 'reached', **result}
+
+    _, net, lengths = load_monthly_net([user_id], today)
+    n_months = int(lengths[0]) if len(lengths) else 0
+    result['history_months'] = n_months
+    if n_months < MIN_HISTORY_MONTHS:
+        return {'status': 'insufficient_history', 'min_history_months': MIN_HISTORY_MONTHS, **result}
+
+    # Chunks of paths until done, or until the next chunk would overrun the budget
+    rng = np.random.default_rng(seed)
+    chunk = max(1, SIM_BLOCK_ELEMENTS // horizon)
+    block, remaining = _block_for(n_months), np.array([target - achieved])
+    done, parts = 0, []
+    while done < paths:
+        chunk_started = time.perf_counter()
+        size = min(chunk, paths - done)
+        parts.append(simulate_months(net, lengths, remaining, size, horizon, rng, block)[0])
+        done += size
+        if done < paths and time.perf_counter() + (time.perf_counter() - chunk_started) > deadline:
+            break
+    months = np.concatenate(parts)
+
+    this_month = _this_month(today)
+    labels = month_labels(this_month + np.arange(horizon))
+    monthly_target = goal.monthly_savings_target_cents or 0
+    history = net[0, -n_months:]
+    return {
+        'status': 'simulated',
+        **result,
+        'mean_monthly_net': from_cents(int(round(float(history.mean())))),
+        'paths': done,
+        'truncated': done < paths,
+        'horizon_months': horizon,
+        'probability': round(float(np.isfinite(months).mean()), 4),
+        # The current month is month 1
+        'quantiles': [{
+            'q': q,
+            'months': int(m) if np.isfinite(m) else None,
+            'month': labels[int(m) - 1] if np.isfinite(m) else None,
+        } for q, m in zip(QUANTILES, _quantiles(months, QUANTILES))],
+        'months_at_target_pace': -(-(target - achieved) // monthly_target) if monthly_target > 0 else None,
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+def batch_goal_simulations(paths: int = BATCH_PATHS, horizon: int = DEFAULT_HORIZON,
+                           today: date = None, seed=None) -> dict:
+    """Time-to-goal for every user with an unreached goal and enough history, a block of users per pass.
+
+    Returns {user_id: {'probability', 'median_months', 'p10_months', 'p90_months'}};
+    months are None where that share of paths does not reach the goal within `horizon`.
+    """
+    paths = max(1, min(paths, MAX_PATHS))
+    horizon = max(1, min(horizon, MAX_HORIZON))
+    goals = {u: t - a for u, t, a in db.session.execute(
+        select(Goal.user_id, Goal.target_amount_cents, func.coalesce(Goal.achieved_cents, 0))
+        .where(Goal.target_amount_cents > 0)
+    ) if a < t}
+    if not goals:
+        return {}
+    ids, net, lengths = load_monthly_net(goals if len(goals) <= OWNER_LOOKUP_LIMIT else None, today)
+    remaining = np.array([goals.get(int(u), 0) for u in ids], dtype=np.int64)
+    keep = (remaining > 0) & (lengths >= MIN_HISTORY_MONTHS)
+    ids, net, lengths, remaining = ids[keep], net[keep], lengths[keep], remaining[keep]
+
+    rng = np.random.default_rng(seed)
+    per_pass = max(1, SIM_BLOCK_ELEMENTS // (paths * horizon))
+    results = {}
+    for block in {_block_for(int(n)) for n in lengths}:
+        group = np.flatnonzero([_block_for(int(n)) == block for n in lengths])
+        for lo in range(0, len(group), per_pass):
+            rows = group[lo:lo + per_pass]
+            months = simulate_months(net[rows], lengths[rows], remaining[rows], paths, horizon, rng, block)
+            probability = np.isfinite(months).mean(axis=1)
+            q = _quantiles(months, (0.1, 0.5, 0.9), axis=1)
+            for i, user_id in enumerate(ids[rows]):
+                p10, median, p90 = (int(m) if np.isfinite(m) else None for m in q[:, i])
+                results[int(user_id)] = {'probability': round(float(probability[i]), 4),
+                                         'median_months': median, 'p10_months': p10, 'p90_months': p90}
+    return results
@@ -0,0 +1,227 @@
+from models import User, Transaction, Goal
+from sqlalchemy import select, func
+from datetime import datetime, timedelta
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import json
+import os
+import shutil
+
+# Columnar snapshots of transactions, users and goals for offline analysis.
+# Rows stream from a server-side cursor in SNAPSHOT_BATCH_ROWS batches and
+# are written straight into Parquet, so neither the database client nor the
+# writer ever holds a whole table. Transactions are split into Hive-style
+# year=/month= directories by their date; users and goals are small and are
+# written whole. Password hashes are never exported.
+#
+# A full snapshot replaces the directory. An incremental one appends, for
+# every month touched, a file with only the transactions whose updated_at
+# is at or after the previous snapshot's start (less SNAPSHOT_OVERLAP, for
+# writes that were still uncommitted then), and rewrites users and goals.
+# A transaction changed several times is therefore in several files:
+# read_snapshot() keeps the version from the newest snapshot. Deleted
+# transactions stay until the next full snapshot.
+#
+#   snapshot/
+#     _snapshot.json                          snapshots taken, newest last
+#     transactions/year=2025/month=3/part-00002.parquet
+#     users/part-00002.parquet
+#     goals/part-00002.parquet
+
+# Rows fetched per cursor round-trip
+SNAPSHOT_BATCH_ROWS = 50000
+# Transaction rows held across months before they are written out
+SNAPSHOT_BUFFER_ROWS = 200000
+# How far before the previous snapshot's start an incremental one looks back
+SNAPSHOT_OVERLAP = timedelta(minutes=10)
+MANIFEST = '_snapshot.json'
+
+TRANSACTION_SCHEMA = pa.schema([
+    ('id', pa.int64()), ('user_id', pa.int64()), ('type', pa.string()), ('amount_cents', pa.int64()),
+    ('currency', pa.string()), ('category', pa.string()), ('category_id', pa.int64()),
+    ('note', pa.string()), ('date', pa.date32()), ('updated_at', pa.timestamp('us')),
+    ('_snapshot', pa.int32()),
+])
+USER_SCHEMA = pa.schema([
+    ('id', pa.int64()), ('username', pa.string()), ('email', pa.string()), ('role', pa.string()),
+    ('created_at', pa.date32()), ('base_currency', pa.string()), ('_snapshot', pa.int32()),
+])
+GOAL_SCHEMA = pa.schema([
+    ('id', pa.int64()), ('user_id', pa.int64()), ('name', pa.string()),
+    ('monthly_savings_target_cents', pa.int64()), ('target_amount_cents', pa.int64()),
+    ('achieved_cents', pa.int64()), ('_snapshot', pa.int32()),
+])
+# table: (model, schema)
+TABLES = {'transactions': (Transaction, TRANSACTION_SCHEMA), 'users': (User, USER_SCHEMA),
+          'goals': (Goal, GOAL_SCHEMA)}
+
+
+def load_manifest(directory: str) -> dict:
+    try:
+        with open(os.path.join(directory, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'snapshots': []}
+
+
+def _save_manifest(directory: str, manifest: dict):
+    path = os.path.join(directory, MANIFEST)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def _stream(conn, stmt):
+    # Server-side cursor: one batch of rows in memory at a time
+    result = conn.execution_options(stream_results=True, yield_per=SNAPSHOT_BATCH_ROWS).execute(stmt)
+    yield from result.partitions()
+
+
+def _batch(schema, rows, seq: int):
+    columns = list(zip(*rows))
+    arrays = [pa.array(values, type=field.type) for values, field in zip(columns, schema)]
+    return pa.record_batch(arrays + [pa.array(np.full(len(rows), seq, dtype=np.int32))], schema=schema)
+
+
+class _MonthWriters:
+    """One Parquet file per (year, month) directory, buffered so row groups are not tiny."""
+
+    def __init__(self, root: str, name: str):
+        self.root = root
+        self.name = name
+        self.rows = 0
+        self._writers = {}
+        self._buffers = {}
+        self._buffered = 0
+
+    def add(self, batch):
+        days = batch.column('date').to_numpy(zero_copy_only=False).astype('datetime64[D]')
+        months = days.astype('datetime64[M]').astype(np.int64)  # months since 1970-01
+        keys, inverse = np.unique(months, return_inverse=True)
+        for i, key in enumerate(keys.tolist()):
+            rows = batch.filter(pa.array(inverse == i))
+            self._buffers.setdefault(key, []).append(rows)
+        self._buffered += batch.num_rows
+        self.rows += batch.num_rows
+        if self._buffered >= SNAPSHOT_BUFFER_ROWS:
+            self.flush()
+
+    def flush(self):
+        for key, batches in self._buffers.items():
+            writer = self._writers.get(key)
+            if writer is None:
+                folder = os.path.join(self.root, f'year={1970 + key // 12}', f'month={key % 12 + 1}')
+                os.makedirs(folder, exist_ok=True)
+                writer = self._writers[key] = pq.ParquetWriter(os.path.join(folder, self.name),
+                                                               TRANSACTION_SCHEMA)
+            writer.write_table(pa.Table.from_batches(batches, TRANSACTION_SCHEMA))
+        self._buffers, self._buffered = {}, 0
+
+    def close(self):
+        self.flush()
+        for writer in self._writers.values():
+            writer.close()
+        return len(self._writers)
+
+
+def _write_transactions(conn, root: str, name: str, seq: int, since=None):
+    columns = [Transaction.__table__.c[f.name] for f in TRANSACTION_SCHEMA if f.name != '_snapshot']
+    stmt = select(*columns)
+    if since is not None:
+        stmt = stmt.where(Transaction.updated_at >= since)
+    writers = _MonthWriters(root, name)
+    try:
+        for rows in _stream(conn, stmt):
+            writers.add(_batch(TRANSACTION_SCHEMA, rows, seq))
+    finally:
+        files = writers.close()
+    return writers.rows, files
+
+
+def _write_whole(conn, root: str, name: str, seq: int, model, schema):
+    columns = [model.__table__.c[f.name] for f in schema if f.name != '_snapshot']
+    os.makedirs(root, exist_ok=True)
+    rows = 0
+    with pq.ParquetWriter(os.path.join(root, name), schema) as writer:
+        for batch in _stream(conn, select(*columns)):
+            writer.write_batch(_batch(schema, batch, seq))
+            rows += len(batch)
+    return rows
+
+
+def _remove_files(directory: str, name: str):
+    # Left by an interrupted run that would have had the same number
+    for folder, _, files in os.walk(directory):
+        if name in files:
+            os.remove(os.path.join(folder, name))
+
+
+def take_snapshot(engine, directory: str, incremental: bool = False) -> dict:
+    """Write a snapshot of transactions, users and goals under `directory`; returns its manifest entry.
+
+    Falls back to a full snapshot when there is no earlier one to add to.
+    """
+    manifest = load_manifest(directory) if incremental else {'snapshots': []}
+    previous = manifest['snapshots'][-1] if manifest['snapshots'] else None
+    seq = previous['seq'] + 1 if previous else 1
+    name = f'part-{seq:05d}.parquet'
+    if previous:
+        target = directory
+        _remove_files(directory, name)
+    else:
+        # A full snapshot is written beside the old one and swapped in at the end
+        target = directory.rstrip(os.sep) + '.new'
+        shutil.rmtree(target, ignore_errors=True)
+
+    with engine.connect() as conn:
+        # The database's clock, which stamps updated_at
+        started = conn.execute(select(func.now())).scalar()
+        since = datetime.fromisoformat(previous['started_at']) - SNAPSHOT_OVERLAP if previous else None
+        entry = {'seq': seq, 'mode': 'incremental' if previous else 'full', 'started_at': started.isoformat(),
+                 'since': since.isoformat() if since else None, 'rows': {}, 'files': {}}
+        rows, files = _write_transactions(conn, os.path.join(target, 'transactions'), name, seq, since)
+        entry['rows']['transactions'], entry['files']['transactions'] = rows, files
+        for table in ('users', 'goals'):
+            model, schema = TABLES[table]
+            root = os.path.join(target, table)
+            entry['rows'][table] = _write_whole(conn, root, name, seq, model, schema)
+            entry['files'][table] = 1
+            # Rewritten whole: only the newest file is kept
+            for old in os.listdir(root):
+                if old != name:
+                    os.remove(os.path.join(root, old))
+
+    manifest['snapshots'].append(entry)
+    _save_manifest(target, manifest)
+    if not previous:
+        shutil.rmtree(directory, ignore_errors=True)
+        os.replace(target, directory)
+    return entry
+
+
+def read_snapshot(directory: str, table: str, columns=None, filters=None):
+    """One table of a snapshot as a pyarrow.Table, files memory-mapped.
+
+    `columns` limits what is read (the year/month partition columns are
+    available for transactions); `filters` are pyarrow.parquet filters,
+    e.g. [('year', '=', 2025)], and skip whole directories where they can.
+    Transactions appear once, as of the newest snapshot holding them. Call
+    .to_pandas() on the result for a DataFrame.
+    """
+    path = os.path.join(directory, table)
+    wanted = None if columns is None else list(columns)
+    read = None if wanted is None else list(dict.fromkeys(wanted + ['id', '_snapshot']))
+    data = pq.read_table(path, columns=read, filters=filters, memory_map=True, partitioning='hive')
+    if data.num_rows:
+        ids = data.column('id').to_numpy()
+        seqs = data.column('_snapshot').to_numpy()
+        order = np.lexsort((seqs, ids))
+        # The last row of each id in (id, snapshot) order is its newest version
+        newest = np.ones(len(order), dtype=bool)
+        newest[:-1] = ids[order][1:] != ids[order][:-1]
+        if not newest.all():
+            data = data.take(np.sort(order[newest]))
+    if wanted is not None:
+        data = data.select(wanted)
+    return data
@@ -0,0 +1,54 @@
+// Theme shared by the compiled stylesheet (build_assets.py runs the Tailwind
+// CLI with this file) and the in-browser compiler that unbuilt checkouts
+// fall back to.
+const theme = {
+  extend: {
+    fontFamily: {
+      'sans': ['Inter', 'system-ui', '-apple-system', 'sans-serif'],
+      'mono': ['Fira Code', 'Monaco', 'Inconsolata', 'monospace'],
+    },
+    colors: {
+      'primary': {
+        50: '#e0e7ff',
+        100: '#c7d2fe',
+        400: '#a5b4fc',
+        500: '#6366f1',
+        600: '#4f46e5',
+        700: '#4338ca',
+        800: '#3730a3',
+        900: '#312e81',
+      },
+      'dark': {
+        50: '#f8fafc',
+        100: '#f1f5f9',
+        800: '#1e293b',
+        900: '#0f172a',
+        950: '#020617',
+      }
+    },
+    animation: {
+      'fade-up': 'fadeUp 0.6s ease-out',
+      'glow': 'glow 2s ease-in-out infinite alternate',
+    },
+    keyframes: {
+      fadeUp: {
+        '0%': { opacity: '0', transform: 'translateY(20px)' },
+        '100%': { opacity: '1', transform: 'translateY(0)' },
+      },
+      glow: {
+        '0%': { 'box-shadow': '0 0 20px rgba(99, 102, 241, 0.3)' },
+        '100%': { 'box-shadow': '0 0 30px rgba(99, 102, 241, 0.6)' },
+      }
+    }
+  }
+};
+
+if (typeof module !== 'undefined') {
+  // Tailwind CLI, run from the project root: only classes these files use are emitted
+  module.exports = {
+    content: ['templates/**/*.html', 'static/js/**/*.js'],
+    theme,
+  };
+} else {
+  tailwind.config = { theme };
+}
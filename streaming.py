@@ -0,0 +1,84 @@
+from flask import Response, get_flashed_messages, stream_template
+from models import db
+from math import ceil
+
+# Pages whose tables grow with the data (the transaction list, the admin
+# tables) are rendered while they are sent. The template is streamed in
+# STREAM_CHUNK_SIZE pieces and its rows are read from server-side cursors
+# STREAM_YIELD_PER at a time, only when the template reaches them, so the
+# page head leaves before any row is fetched and neither the rows nor the
+# HTML are ever held whole.
+
+# Characters of rendered HTML sent per chunk
+STREAM_CHUNK_SIZE = 16 * 1024
+# Rows fetched per cursor round-trip
+STREAM_YIELD_PER = 500
+
+
+def stream_rows(stmt, yield_per: int = STREAM_YIELD_PER):
+    """ORM entities selected by `stmt`, read lazily from a server-side cursor."""
+    yield from db.session.execute(stmt.execution_options(yield_per=yield_per)).scalars()
+
+
+def _chunked(pieces, size: int):
+    buffer, length = [], 0
+    for piece in pieces:
+        buffer.append(piece)
+        length += len(piece)
+        if length >= size:
+            yield ''.join(buffer)
+            buffer, length = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def stream_page(template_name: str, **context) -> Response:
+    """Response rendering `template_name` as it is sent, instead of render_template()."""
+    # Templates pop the flashed messages; do it now, while the session cookie can still be updated
+    get_flashed_messages(with_categories=True)
+    return Response(_chunked(stream_template(template_name, **context), STREAM_CHUNK_SIZE),
+                    mimetype='text/html', headers={'X-Accel-Buffering': 'no'})
+
+
+class StreamedPage:
+    """One page of `stmt` for templates: Pagination's attributes, with rows streamed.
+
+    `total` is supplied by the caller, so no COUNT query is run. Iterating
+    reads the page's rows from a cursor; len() is the number on this page.
+    """
+
+    def __init__(self, stmt, page: int, per_page: int, total: int):
+        self.page = max(page, 1)
+        self.per_page = per_page
+        self.total = total
+        offset = (self.page - 1) * per_page
+        self._stmt = stmt.limit(per_page).offset(offset)
+        self._count = max(0, min(per_page, total - offset))
+        self.first = offset + 1 if self._count else 0
+        self.last = max(self.first, self.first + self._count - 1)
+
+    @property
+    def pages(self) -> int:
+        return ceil(self.total / self.per_page) if self.total else 0
+
+    @property
+    def has_prev(self) -> bool:
+        return self.page > 1
+
+    @property
+    def prev_num(self):
+        return self.page - 1 if self.has_prev else None
+
+    @property
+    def has_next(self) -> bool:
+        return self.page < self.pages
+
+    @property
+    def next_num(self):
+        return self.page + 1 if self.has_next else None
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        return stream_rows(self._stmt, min(self.per_page, STREAM_YIELD_PER))
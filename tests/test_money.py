@@ -0,0 +1,31 @@
+import pytest
+
+from money import to_cents, MAX_CENTS
+from ingest import parse_item
+
+
+def test_to_cents_exact():
+    assert to_cents('12.34') == 1234
+    assert to_cents(12.345) == 1235
+    assert to_cents(7) == 700
+
+
+@pytest.mark.parametrize('value', ['abc', 'nan', 'inf', '', None, '1e30', 1e300])
+def test_to_cents_rejects_non_numbers_and_overflow(value):
+    with pytest.raises(ValueError):
+        to_cents(value)
+
+
+@pytest.mark.parametrize('value', ['1e17', -10 ** 14, str(MAX_CENTS // 100 + 1)])
+def test_to_cents_rejects_amounts_beyond_cap(value):
+    with pytest.raises(ValueError):
+        to_cents(value)
+
+
+def test_to_cents_accepts_the_cap():
+    assert to_cents(str(MAX_CENTS // 100)) == MAX_CENTS
+
+
+def test_ingest_item_with_huge_amount_is_invalid():
+    with pytest.raises(ValueError):
+        parse_item({'key': 'k', 'amount': '1e30'}, 'INR', {'INR'})
@@ -0,0 +1,123 @@
+from models import db, Transaction
+from categories import category_names
+from money import from_cents
+from fx import base_currency, has_other_currencies, convert
+from sqlalchemy import select
+import numpy as np
+
+# Rows fetched per round-trip while filling the column buffers
+CHUNK_SIZE = 10000
+
+
+class TransactionFrame:
+    """Columnar view of a user's transactions.
+
+    Holds only what the analytics paths read: ``ids`` (int64),
+    ``dates`` (datetime64[D]), ``amount_cents`` (int64), ``is_income`` (bool)
+    and ``category_codes`` (int32 indexes into ``categories``). Amounts are in the user's
+    base currency. Sums are taken in cents and turned into currency units once, on the way out.
+    """
+
+    __slots__ = ('ids', 'dates', 'amount_cents', 'is_income', 'category_codes', 'categories')
+
+    def __init__(self, ids, dates, amount_cents, is_income, category_codes, categories):
+        self.ids = ids
+        self.dates = dates
+        self.amount_cents = amount_cents
+        self.is_income = is_income
+        self.category_codes = category_codes
+        self.categories = categories
+
+    def __len__(self):
+        return len(self.amount_cents)
+
+    @property
+    def nbytes(self):
+        return (self.ids.nbytes + self.dates.nbytes + self.amount_cents.nbytes +
+                self.is_income.nbytes + self.category_codes.nbytes)
+
+    def mask(self, start=None, end=None, kind=None):
+        # Boolean row filter; start is inclusive, end exclusive
+        m = np.ones(len(self), dtype=bool)
+        if start is not None:
+            m &= self.dates >= np.datetime64(start, 'D')
+        if end is not None:
+            m &= self.dates < np.datetime64(end, 'D')
+        if kind == 'income':
+            m &= self.is_income
+        elif kind == 'expense':
+            m &= ~self.is_income
+        return m
+
+    def totals(self, mask=None):
+        # (income, expense) sums over the selected rows
+        cents, is_income = self.amount_cents, self.is_income
+        if mask is not None:
+            cents, is_income = cents[mask], is_income[mask]
+        return from_cents(cents[is_income].sum()), from_cents(cents[~is_income].sum())
+
+    def by_month(self, mask=None):
+        # Income and expense per calendar month, ordered by month
+        dates, cents, is_income = self.dates, self.amount_cents, self.is_income
+        if mask is not None:
+            dates, cents, is_income = dates[mask], cents[mask], is_income[mask]
+        keys, inv = np.unique(dates.astype('datetime64[M]'), return_inverse=True)
+        # float64 bincount is exact for integer cents below 2**53
+        income = np.bincount(inv, weights=np.where(is_income, cents, 0), minlength=len(keys))
+        expense = np.bincount(inv, weights=np.where(is_income, 0, cents), minlength=len(keys))
+        return keys, income / 100, expense / 100
+
+    def by_category(self, mask=None):
+        # {category: total} over the selected rows, in first-seen order
+        codes, cents = self.category_codes, self.amount_cents
+        if mask is not None:
+            codes, cents = codes[mask], cents[mask]
+        sums = np.bincount(codes, weights=cents, minlength=len(self.categories))
+        present = np.bincount(codes, minlength=len(self.categories)) > 0
+        return {self.categories[i]: from_cents(sums[i]) for i in np.flatnonzero(present)}
+
+
+def month_labels(keys):
+    # datetime64[M] keys -> ['YYYY-MM', ...]
+    return [str(k) for k in np.datetime_as_string(keys, unit='M')]
+
+
+def load_transaction_frame(user_id: int, start=None, end=None, kind=None):
+    """Load a user's transactions into a TransactionFrame with a Core select."""
+    base = base_currency(user_id)
+    # Users with every amount in their base currency skip the currency column
+    mixed = has_other_currencies(user_id, base)
+    columns = [Transaction.id, Transaction.date, Transaction.amount_cents, Transaction.type, Transaction.category_id]
+    stmt = select(*columns, *([Transaction.currency] if mixed else [])).where(Transaction.user_id == user_id)
+    if start is not None:
+        stmt = stmt.where(Transaction.date >= start)
+    if end is not None:
+        stmt = stmt.where(Transaction.date < end)
+    if kind is not None:
+        stmt = stmt.where(Transaction.type == kind)
+
+    ids, dates, amounts, is_income, codes, currencies = [], [], [], [], [], []
+    lookup = {}
+    result = db.session.execute(stmt)
+    for rows in result.partitions(CHUNK_SIZE):
+        n = len(rows)
+        i, d, a, t, c, *cur = zip(*rows)
+        ids.append(np.fromiter(i, dtype=np.int64, count=n))
+        dates.append(np.array(d, dtype='datetime64[D]'))
+        amounts.append(np.fromiter(a, dtype=np.int64, count=n))
+        is_income.append(np.fromiter((x == 'income' for x in t), dtype=bool, count=n))
+        codes.append(np.fromiter((lookup.setdefault(x, len(lookup)) for x in c), dtype=np.int32, count=n))
+        if mixed:
+            currencies.append(np.array(cur[0], dtype='U3'))
+
+    if not dates:
+        return TransactionFrame(np.empty(0, dtype=np.int64), np.empty(0, dtype='datetime64[D]'),
+                                np.empty(0, dtype=np.int64), np.empty(0, dtype=bool),
+                                np.empty(0, dtype=np.int32), [])
+    dates, amounts = np.concatenate(dates), np.concatenate(amounts)
+    if mixed:
+        amounts = convert(amounts, dates, np.concatenate(currencies), base)
+    names = category_names(list(lookup))
+    return TransactionFrame(np.concatenate(ids), dates, amounts,
+                            np.concatenate(is_income), np.concatenate(codes),
+                            [names[i] for i in lookup])
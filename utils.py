@@ -1,158 +1,235 @@
-from models import db, Transaction, Goal
+from models import db, Transaction, TransactionRollup, Goal
+from categories import category_names
+from money import from_cents
+from fx import grouped_totals
+from archive import add_rollups
+from budgets import month_bounds
 from sqlalchemy import extract
 from datetime import date
-import pandas as pd
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 
-def get_monthly_totals(user_id: int):
-    # Aggregate expenses per month (expenses only)
-    rows = db.session.query(
-        extract('year', Transaction.date).label('year'),
-        extract('month', Transaction.date).label('month'),
-        db.func.sum(Transaction.amount).label('total')
-    ).filter(
+def _year_month(column):
+    return [extract('year', column).label('year'), extract('month', column).label('month')]
+
+def monthly_totals_source(user_id: int):
+    # (rows, group keys) behind get_monthly_totals(), for fx.grouped_totals()
+    return db.select(Transaction).where(
         Transaction.user_id==user_id,
         Transaction.type=='expense'
-    ).group_by('year','month').order_by('year','month').all()
+    ), _year_month(Transaction.date)
+
+def monthly_rollups_source(user_id: int):
+    # (group keys, filter) over archived months, for archive.add_rollups()
+    return _year_month(TransactionRollup.month), TransactionRollup.type=='expense'
 
+def monthly_totals_from_groups(groups):
+    # Expense totals per month (expenses only), oldest first
     months = []
     totals = []
-    for r in rows:
-        y, m, t = int(r.year), int(r.month), float(r.total)
-        months.append(f"{y}-{m:02d}")
-        totals.append(round(t, 2))
+    for (y, m), (cents, _) in sorted(groups.items()):
+        months.append(f"{int(y)}-{int(m):02d}")
+        totals.append(from_cents(cents))  # exact integer sum, no rounding needed
 
     return months, totals
 
+def get_monthly_totals(user_id: int):
+    stmt, keys = monthly_totals_source(user_id)
+    groups = grouped_totals(stmt, keys, user_id)
+    return monthly_totals_from_groups(add_rollups(groups, user_id, *monthly_rollups_source(user_id)))
+
+# Forecast components. Each takes one series or a (series, months) matrix of
+# monthly expense cents and returns next month's forecast per series, so the
+# backtest can score many users' histories in a single call.
+
+# Months per seasonal cycle
+SEASON = 12
+# Exponential smoothing factor
+SMOOTHING = 0.3
+
+def _as_rows(y):
+    return np.atleast_2d(np.asarray(y, dtype=np.float64))
+
+def _fit_line(x, y):
+    # Centred closed-form least squares per row; a flat row fits exactly
+    xc = x - x.mean()
+    y_mean = y.mean(axis=1)
+    slope = ((y - y_mean[:, None]) @ xc) / (xc @ xc)
+    return slope, y_mean - slope * x.mean()
+
+def _linear_trend(y):
+    # Line over the month index: (next month's value, in-sample R^2) per row
+    n = y.shape[1]
+    x = np.arange(n, dtype=np.float64)
+    slope, intercept = _fit_line(x, y)
+    fitted = slope[:, None] * x + intercept[:, None]
+    ss_res = np.sum((y - fitted) ** 2, axis=1)
+    ss_tot = np.sum((y - y.mean(axis=1, keepdims=True)) ** 2, axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r2 = np.where(ss_tot == 0, np.where(ss_res == 0, 1.0, 0.0), 1 - ss_res / ss_tot)
+    return slope * n + intercept, r2
+
+def _last_seasonal(y, period=SEASON):
+    # Additive decomposition: seasonal component of the last month. The trend
+    # is a centred 2x12 moving average, extended linearly over the half-year
+    # at each end that the average cannot reach. Needs two full cycles.
+    n = y.shape[1]
+    kernel = np.r_[0.5, np.ones(period - 1), 0.5] / period
+    half = period // 2
+    trend = np.empty_like(y)
+    trend[:, half:n - half] = sliding_window_view(y, period + 1, axis=1) @ kernel
+    front, back = half, n - half - 1
+
+    stop = min(front + period, back)
+    slope, intercept = _fit_line(np.arange(front, stop, dtype=np.float64), trend[:, front:stop])
+    trend[:, :front] = slope[:, None] * np.arange(front) + intercept[:, None]
+    start = max(front, back - period)
+    slope, intercept = _fit_line(np.arange(start, back, dtype=np.float64), trend[:, start:back])
+    trend[:, back + 1:] = slope[:, None] * np.arange(back + 1, n) + intercept[:, None]
+
+    detrended = y - trend
+    averages = np.stack([detrended[:, i::period].mean(axis=1) for i in range(period)], axis=1)
+    averages -= averages.mean(axis=1, keepdims=True)
+    return averages[:, (n - 1) % period]
+
+def _smoothed(y, alpha=SMOOTHING):
+    # Closed form of smoothing from the last month back to the first: the
+    # oldest months end up with the largest weights
+    n = y.shape[1]
+    weights = np.empty(n)
+    weights[:-1] = alpha * (1 - alpha) ** np.arange(n - 1)
+    weights[-1] = (1 - alpha) ** (n - 1)
+    return y @ weights
+
+def forecast_weighted_average(y):
+    """Exponentially weighted mean; the latest month weighs e times the first."""
+    y = _as_rows(y)
+    weights = np.exp(np.linspace(-1, 0, y.shape[1]))
+    return y @ (weights / weights.sum())
+
+def forecast_linear(y):
+    """Linear trend extended one month."""
+    return _linear_trend(_as_rows(y))[0]
+
+def forecast_seasonal(y):
+    """Linear trend plus last year's seasonal offset (needs 2 * SEASON months)."""
+    y = _as_rows(y)
+    return _linear_trend(y)[0] + _last_seasonal(y)
+
+def _blend(y):
+    # 0.6 * (trend, seasonally adjusted when possible) + 0.4 * smoothing
+    pred_lr, r2 = _linear_trend(y)
+    if y.shape[1] >= 2 * SEASON:
+        pred_lr = pred_lr + _last_seasonal(y)
+    return 0.6 * pred_lr + 0.4 * _smoothed(y), r2
+
+def forecast_blended(y):
+    """The blend the predictions page uses once it has 3+ months."""
+    return _blend(_as_rows(y))[0]
+
+def forecast_confidence(r2, n_months):
+    # 0-100 score shown with a blended forecast
+    confidence = np.minimum(95, np.trunc(np.asarray(r2) * 70 + n_months)).astype(int)
+    return confidence + (5 if n_months >= SEASON else 0)
+
+def forecast_production(y):
+    """What the predictions page answers per row: (forecasts, confidences, kind).
+
+    kind is 'trend_average' under 3 months, 'weighted_average' for one to two
+    years of history, 'blended' otherwise.
+    """
+    y = _as_rows(y)
+    n = y.shape[1]
+    if n < 3:
+        # Average with recent trend
+        trend = y[:, -1] - y[:, 0] if n > 1 else 0
+        return y.mean(axis=1) + trend / 2, np.full(len(y), min(50 + n * 10, 70)), 'trend_average'
+    if SEASON <= n < 2 * SEASON:
+        # Too long for the plain trend, too short for a seasonal fit
+        return forecast_weighted_average(y), np.full(len(y), 65), 'weighted_average'
+    prediction, r2 = _blend(y)
+    return prediction, forecast_confidence(r2, n), 'blended'
+
+# name: (forecaster, fewest months of history it accepts)
+FORECASTERS = {
+    'weighted_average': (forecast_weighted_average, 1),
+    'linear': (forecast_linear, 2),
+    'seasonal': (forecast_seasonal, 2 * SEASON),
+    'blended': (forecast_blended, 3),
+}
+
+def _cents_prediction(value) -> float:
+    # Single conversion back to currency units for the response
+    return max(0.0, from_cents(int(round(float(value)))))
+
 def predict_next_month_expense(months, totals):
     if len(totals) == 0:
         return {'method':'none','prediction':0.0,'note':'No expense data yet.','confidence':0}
-    if len(totals) < 3:
-        # Fallback: average with recent trend
-        avg = float(np.mean(totals))
-        trend = totals[-1] - totals[0] if len(totals) > 1 else 0
-        prediction = avg + (trend / 2)
-        prediction = max(0.0, round(prediction, 2))
-        confidence = 50 + (len(totals) * 10)  # Confidence increases with more data
+
+    # Monthly totals are exact cents sums; model them as int64 minor units
+    cents = np.rint(np.asarray(totals, dtype=np.float64) * 100).astype(np.int64)
+    forecast, confidence, kind = forecast_production(cents)
+    prediction, confidence = _cents_prediction(forecast[0]), int(confidence[0])
+
+    if kind == 'trend_average':
         return {
             'method': 'weighted_average',
             'prediction': prediction,
             'note': 'Using weighted average with trend analysis.',
-            'confidence': min(confidence, 70)  # Cap confidence at 70% for limited data
-        }
-
-    try:
-        from sklearn.linear_model import LinearRegression
-        from sklearn.metrics import r2_score
-        import statsmodels.api as sm
-
-        # Prepare data
-        X = np.arange(len(totals)).reshape(-1,1)
-        y = np.array(totals)
-
-        # Linear regression with confidence interval
-        model = LinearRegression()
-        model.fit(X, y)
-        next_idx = np.array([[len(totals)]])
-        pred_lr = float(model.predict(next_idx)[0])
-
-        # Calculate R-squared for model quality
-        r2 = r2_score(y, model.predict(X))
-
-        # Time series decomposition for seasonal patterns
-        if len(totals) >= 12:
-            decomposition = sm.tsa.seasonal_decompose(y, period=12, extrapolate_trend='freq')
-            seasonal = decomposition.seasonal[-1]  # Use last seasonal component
-            trend = decomposition.trend[-1]  # Use last trend component
-            pred_adjusted = pred_lr + seasonal
-        else:
-            pred_adjusted = pred_lr
-
-        # Exponential smoothing for recent trends
-        alpha = 0.3  # Smoothing factor
-        exp_smoothed = totals[-1]
-        for i in range(len(totals)-2, -1, -1):
-            exp_smoothed = alpha * totals[i] + (1-alpha) * exp_smoothed
-
-        # Combine predictions with weights
-        final_pred = 0.6 * pred_adjusted + 0.4 * exp_smoothed
-        final_pred = max(0.0, round(final_pred, 2))
-
-        # Calculate confidence score (0-100)
-        confidence = min(95, int(r2 * 70 + len(totals)))
-        if len(totals) >= 12:
-            confidence += 5  # Bonus for seasonal data
-
-        # Determine prediction quality
-        if confidence >= 90:
-            quality = "High confidence prediction"
-        elif confidence >= 75:
-            quality = "Good confidence prediction"
-        else:
-            quality = "Moderate confidence prediction"
-
-        return {
-            'method': 'advanced_ml',
-            'prediction': final_pred,
-            'note': f'{quality} using ML and time series analysis.',
             'confidence': confidence
         }
-
-    except Exception as e:
-        # Enhanced fallback using weighted average
-        weights = np.exp(np.linspace(-1, 0, len(totals)))  # Exponential weights
-        weights = weights / weights.sum()
-        weighted_avg = float(np.sum(weights * totals))
-        prediction = max(0.0, round(weighted_avg, 2))
-        
+    if kind == 'weighted_average':
         return {
             'method': 'weighted_average',
             'prediction': prediction,
             'note': 'Using exponentially weighted average.',
-            'confidence': 65
+            'confidence': confidence
         }
 
+    # Determine prediction quality
+    if confidence >= 90:
+        quality = "High confidence prediction"
+    elif confidence >= 75:
+        quality = "Good confidence prediction"
+    else:
+        quality = "Moderate confidence prediction"
+
+    return {
+        'method': 'advanced_ml',
+        'prediction': prediction,
+        'note': f'{quality} using ML and time series analysis.',
+        'confidence': confidence
+    }
+
 def category_breakdown(user_id: int):
     # Sum expenses by category for the current month
-    today = date.today()
-    rows = db.session.query(
-        Transaction.category,
-        db.func.sum(Transaction.amount).label('total')
-    ).filter(
+    start, end = month_bounds(date.today())
+    # Plain date bounds, so the (user_id, date) range and partitions are pruned
+    groups = grouped_totals(db.select(Transaction).where(
         Transaction.user_id==user_id,
         Transaction.type=='expense',
-        extract('year', Transaction.date)==today.year,
-        extract('month', Transaction.date)==today.month
-    ).group_by(Transaction.category).all()
+        Transaction.date>=start,
+        Transaction.date<end
+    ), [Transaction.category_id], user_id)
 
-    return {r.category: float(r.total) for r in rows}
+    names = category_names([cid for cid, in groups])
+    return {names[cid]: from_cents(cents) for (cid,), (cents, _) in groups.items()}
 
 def saving_tips(user_id: int):
     # Analyze this month's expenses vs. incomes and produce simple tips
-    today = date.today()
-    expenses = db.session.query(db.func.sum(Transaction.amount)).filter(
+    start, end = month_bounds(date.today())
+    # Per (type, category) sums for this month, in the user's base currency
+    groups = grouped_totals(db.select(Transaction).where(
         Transaction.user_id==user_id,
-        Transaction.type=='expense',
-        extract('year', Transaction.date)==today.year,
-        extract('month', Transaction.date)==today.month
-    ).scalar() or 0.0
+        Transaction.date>=start,
+        Transaction.date<end
+    ), [Transaction.type, Transaction.category_id], user_id)
 
-    incomes = db.session.query(db.func.sum(Transaction.amount)).filter(
-        Transaction.user_id==user_id,
-        Transaction.type=='income',
-        extract('year', Transaction.date)==today.year,
-        extract('month', Transaction.date)==today.month
-    ).scalar() or 0.0
-
-    breakdown = db.session.query(
-        Transaction.category,
-        db.func.sum(Transaction.amount).label('total')
-    ).filter(
-        Transaction.user_id==user_id,
-        Transaction.type=='expense',
-        extract('year', Transaction.date)==today.year,
-        extract('month', Transaction.date)==today.month
-    ).group_by(Transaction.category).order_by(db.desc('total')).all()
+    incomes = from_cents(sum(cents for (kind, _), (cents, _) in groups.items() if kind == 'income'))
+    expenses = from_cents(sum(cents for (kind, _), (cents, _) in groups.items() if kind == 'expense'))
+    breakdown = sorted(((cid, cents) for (kind, cid), (cents, _) in groups.items() if kind == 'expense'),
+                       key=lambda b: b[1], reverse=True)
+    names = category_names([cid for cid, _ in breakdown])
 
     goal = Goal.query.filter_by(user_id=user_id).first()
     # Safely access target_amount with fallback to monthly_savings_target
@@ -171,7 +248,7 @@ def saving_tips(user_id: int):
 
     # Suggest cutting top category by 10-20%
     if breakdown:
-        top_cat, top_total = breakdown[0].category, float(breakdown[0].total)
+        top_cat, top_total = names[breakdown[0][0]], from_cents(breakdown[0][1])
         reduce_10 = round(top_total * 0.10, 2)
         tips.append(f"Try reducing your '{top_cat}' spending by ~10% (≈ {reduce_10}).")
     if target > 0:
@@ -180,8 +257,8 @@ def saving_tips(user_id: int):
             tips.append(f"Shortfall to hit target: {shortfall:.2f}. Consider trimming discretionary categories.")
 
     snapshot = {
-        'this_month_income': round(incomes,2),
-        'this_month_expense': round(expenses,2),
-        'top_categories': [(b.category, float(b.total)) for b in breakdown[:5]]
+        'this_month_income': incomes,
+        'this_month_expense': expenses,
+        'top_categories': [(names[cid], from_cents(cents)) for cid, cents in breakdown[:5]]
     }
     return tips, snapshot